@@ -1,17 +1,31 @@
 import logging
 import threading
-import time
 
+from blockchain_system import metrics, snapshots, tracing
 from blockchain_system.blockchain_repository import (
     BlockchainRepository,
     PendingBlocksRepository,
+    SyncRepository,
 )
+from blockchain_system.mining import shutdown_parallel_miners
+from blockchain_system.node import node_directory, start_thread
 from blockchain_system.publisher import Publisher
-from blockchain_system.services import mine_block
-from blockchain_system.subscriber import Subscriber
+from blockchain_system.services import get_chain_tip, mine_block
+from blockchain_system.subscriber import AsyncSubscriber, Subscriber
+from blockchain_system.transports import Transport, create_transport
+from blockchain_system.validation import shutdown_parallel_validators
 
 logger = logging.getLogger(__name__)
 
+# How long the miner waits for a pending block before logging that it is idle
+MINER_IDLE_TIMEOUT = 5
+SNAPSHOT_CHECK_INTERVAL = 10
+# Seconds a starting node gives its subscriber before announcing itself
+NEW_NODE_ANNOUNCE_DELAY = 5
+# Consume with the asyncio subscriber, handlers then run concurrently per
+# lane and messages are acknowledged after handling
+ASYNC_SUBSCRIBER = False
+
 
 def setup_logger():
     logging.basicConfig(
@@ -20,45 +34,105 @@ def setup_logger():
     )
 
 
-def notify_new_node(publisher):
-    time.sleep(5)
-    publisher.notify_new_node()
+def notify_new_node(publisher, stopped: threading.Event):
+    if stopped.wait(NEW_NODE_ANNOUNCE_DELAY):
+        return
+    publisher.notify_new_node(
+        get_chain_tip(
+            blockchain_repository=BlockchainRepository(),
+            sync_repository=SyncRepository(),
+        )
+    )
 
 
-def miner():
+def miner(stopped: threading.Event):
     blockchain_repository = BlockchainRepository()
     pending_blocks_repository = PendingBlocksRepository()
 
-    while True:
+    while not stopped.is_set():
         mined_block = mine_block(
             pending_blocks_repository=pending_blocks_repository,
             blockchain_repository=blockchain_repository,
+            timeout=MINER_IDLE_TIMEOUT,
         )
         if mined_block is None:
             logger.info("Nothing to mine. Waiting for transactions..")
-            time.sleep(5)
 
 
-def start_app():
-    app = App(subscriber=Subscriber(), publisher=Publisher())
+def snapshotter(directory: str, stopped: threading.Event):
+    blockchain_repository = BlockchainRepository()
+    last_snapshot_height = blockchain_repository.get_last_block().index
+
+    while not stopped.wait(SNAPSHOT_CHECK_INTERVAL):
+        height = blockchain_repository.get_last_block().index
+        if height - last_snapshot_height < snapshots.SNAPSHOT_INTERVAL:
+            continue
+
+        snapshots.create_snapshot(blockchain_repository, directory)
+        snapshots.prune_snapshots(directory)
+        last_snapshot_height = height
+
+
+def start_app(transport: Transport | None = None):
+    transport = transport or create_transport()
+    subscriber = (
+        AsyncSubscriber(transport) if ASYNC_SUBSCRIBER else Subscriber(transport)
+    )
+    app = App(subscriber=subscriber, publisher=Publisher(transport))
     app.start()
 
 
 class App:
-    def __init__(self, subscriber: Subscriber, publisher: Publisher):
+    def __init__(self, subscriber: Subscriber | AsyncSubscriber, publisher: Publisher):
         self.subscriber = subscriber
         self.publisher = publisher
-
-    def start(self):
-        # TODO start mining thread
-        miner_thread = threading.Thread(target=miner, args=())
-        notify_new_node_thread = threading.Thread(
-            target=notify_new_node, args=(self.publisher,)
-        )
+        self.stopped = threading.Event()
+        self.threads: list[threading.Thread] = []
+        self.metrics_server: metrics.MetricsServer | None = None
+
+    def start(self, block: bool = True):
+        """
+        Without blocking, messages are consumed on a thread as well and the
+        app runs until `stop` is called.
+        """
         logger.info("Starting app..")
-        miner_thread.start()
-        notify_new_node_thread.start()
-        self.subscriber.start_consuming()
+        if tracing.TRACE_FILE and not tracing.tracing_enabled():
+            # Spans of all nodes of the process go to one file
+            tracing.enable_tracing(tracing.TRACE_FILE)
+        if metrics.METRICS_PORT is not None:
+            self.metrics_server = metrics.MetricsServer(
+                metrics.MetricsRegistry(), metrics.METRICS_HOST, metrics.METRICS_PORT
+            )
+            logger.info(f"Serving metrics on {self.metrics_server.url}")
+            self.threads.append(
+                start_thread(self.metrics_server.serve_forever, name="metrics")
+            )
+        if snapshots.SNAPSHOT_DIR:
+            directory = node_directory(snapshots.SNAPSHOT_DIR)
+            snapshots.bootstrap_from_snapshot(BlockchainRepository(), directory)
+            self.threads.append(
+                start_thread(snapshotter, directory, self.stopped, name="snapshotter")
+            )
+        self.threads.append(start_thread(miner, self.stopped, name="miner"))
+        self.threads.append(
+            start_thread(notify_new_node, self.publisher, self.stopped, name="notify")
+        )
+        consumer = start_thread(self.subscriber.start_consuming, name="consumer")
+        self.threads.append(consumer)
+        if block:
+            consumer.join()
+
+    def stop(self):
+        self.stopped.set()
+        self.subscriber.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        # Once the miner and handlers are done, so the pools are not restarted
+        shutdown_parallel_miners()
+        shutdown_parallel_validators()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,419 @@
+"""
+Microbenchmarks of the hot paths.
+
+Every benchmark reports seconds per operation, lower is better, so a
+hashrate is reported as seconds per hash. Memory benchmarks, named
+`*_bytes`, report bytes per block instead. Results are compared with the
+baselines stored in `BENCHMARK_BASELINES` and a benchmark slower than its
+baseline by more than the threshold counts as a regression.
+"""
+import gc
+import hashlib
+import json
+import math
+import os
+import random
+import time
+import tracemalloc
+from typing import Callable
+
+from blockchain_system import services
+from blockchain_system.blockchain import (
+    Block,
+    Blockchain,
+    PendingBlock,
+    Record,
+    compute_merkle_root,
+    digest_to_hash,
+)
+from blockchain_system.blockchain_repository import (
+    BlockchainRepository,
+    PendingBlocksRepository,
+)
+from blockchain_system.compact import CompactChain
+from blockchain_system.node import forget_node, node_context
+from blockchain_system.record_index import RecordIndex
+
+BENCHMARK_BASELINES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "benchmarks",
+    "baselines.json",
+)
+# Allowed slowdown against the baseline, 0.25 fails at 25% slower
+BENCHMARK_THRESHOLD = 0.25
+BENCHMARK_REPEAT = 5
+# Difficulty of the chains built for validation, low to keep building fast
+CHAIN_DIFFICULTY = 4
+
+POW_DIFFICULTIES = (8, 12, 16)
+PENDING_DEPTHS = (10, 1_000, 100_000)
+CHAIN_LENGTHS = (1_000, 10_000, 100_000)
+FULL_CHAIN_LENGTHS = (*CHAIN_LENGTHS, 1_000_000)
+MEMORY_CHAIN_LENGTH = 10_000
+# Records indexed for the lookup benchmarks, in blocks of 10 records
+INDEXED_RECORDS = 100_000
+
+
+def time_per_operation(
+    operation: Callable[[], object], number: int, repeat: int = BENCHMARK_REPEAT
+) -> float:
+    """Best of `repeat` runs, the other runs were slowed down by noise."""
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def _records(count: int) -> list[Record]:
+    return [
+        Record(index=i, timestamp=1_700_000_000 + i, content=f"Transaction {i}")
+        for i in range(count)
+    ]
+
+
+def _block(index: int = 1, previous_hash: str = "0", records: int = 10) -> Block:
+    return Block(
+        index=index,
+        previous_hash=previous_hash,
+        side_links=[],
+        timestamp=1_700_000_000 + index,
+        records=_records(records),
+    )
+
+
+def _with_difficulty(difficulty: int, function: Callable):
+    previous_difficulty = services.POW_DIFFICULTY
+    services.POW_DIFFICULTY = difficulty
+    try:
+        return function()
+    finally:
+        services.POW_DIFFICULTY = previous_difficulty
+
+
+_chains: dict[int, list[Block]] = {}
+
+
+def build_chain(length: int) -> list[Block]:
+    """A valid chain at `CHAIN_DIFFICULTY`, cached for the process."""
+    chain = _chains.get(length)
+    if chain is not None:
+        return chain
+
+    def mine():
+        chain = []
+        previous_hash = "0"
+        for index in range(length):
+            block = _block(index, previous_hash, records=1)
+            block.hash = services._proof_of_work(block, workers=1)
+            chain.append(block)
+            previous_hash = block.hash
+        return chain
+
+    _chains[length] = _with_difficulty(CHAIN_DIFFICULTY, mine)
+    return _chains[length]
+
+
+def measure_memory(build: Callable[[], object]) -> int:
+    """Bytes allocated by `build` that are still held by its result."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+
+def _memory_chain_json(length: int) -> str:
+    """
+    JSON of a chain with side links, hashes are made up since memory does
+    not depend on proofs.
+    """
+    links = random.Random(length)
+    chain = []
+    previous_hash = "0"
+    for index in range(length):
+        block = _block(index, previous_hash, records=1)
+        block.side_links = [
+            chain[position].hash
+            for position in links.sample(range(index), min(services.N, index))
+        ]
+        block.hash = digest_to_hash(hashlib.sha256(b"%d" % index).digest())
+        chain.append(block)
+        previous_hash = block.hash
+    return Blockchain(chain=chain).to_json()
+
+
+def bench_memory_per_block(length: int, compact: bool) -> float:
+    chain_json = _memory_chain_json(length)
+    decode = CompactChain.from_json if compact else Blockchain.from_json
+    return measure_memory(lambda: decode(chain_json)) / length
+
+
+def bench_repository_memory_per_block(length: int) -> float:
+    """
+    Bytes per block held by a repository after decoding a chain and making
+    it the main chain.
+    """
+    chain_json = _memory_chain_json(length)
+    node = f"benchmark-repository-memory-{length}"
+    with node_context(node):
+        repository = BlockchainRepository(store_directory=None)
+
+        def set_chain():
+            repository.chain = Blockchain.from_json(chain_json).chain
+            return repository
+
+        try:
+            return measure_memory(set_chain) / length
+        finally:
+            forget_node(node)
+
+
+def bench_compute_hash() -> float:
+    block = _block()
+    return time_per_operation(block.compute_hash, number=2_000)
+
+
+def bench_merkle_root(records: int = 100) -> float:
+    block_records = _records(records)
+    return time_per_operation(lambda: compute_merkle_root(block_records), number=1_000)
+
+
+def bench_proof_of_work(difficulty: int, blocks: int = 8) -> float:
+    def search():
+        hashes = 0
+        start = time.perf_counter()
+        for index in range(blocks):
+            block = _block(index)
+            services._proof_of_work(block, workers=1)
+            hashes += block.nonce + 1
+        return (time.perf_counter() - start) / hashes
+
+    return _with_difficulty(difficulty, search)
+
+
+def bench_pending_blocks(depth: int) -> float:
+    """One add and one pop on a queue holding `depth` blocks."""
+    node = f"benchmark-pending-{depth}"
+    with node_context(node):
+        repository = PendingBlocksRepository(maxsize=depth + 1)
+        block = PendingBlock(index=1, records=_records(1))
+        for _ in range(depth):
+            repository.add(block)
+
+        def add_and_pop():
+            repository.add(block)
+            repository.pop()
+
+        try:
+            return time_per_operation(add_and_pop, number=10_000)
+        finally:
+            forget_node(node)
+
+
+def bench_side_links(length: int) -> float:
+    node = f"benchmark-side-links-{length}"
+    with node_context(node):
+        repository = BlockchainRepository(store_directory=None)
+        repository.chain = build_chain(length)
+        try:
+            return time_per_operation(
+                lambda: services._get_side_links(services.N, repository),
+                number=10_000,
+            )
+        finally:
+            forget_node(node)
+
+
+def bench_extend_chain(length: int, blocks: int = 5) -> float:
+    """
+    Validating and applying a received chain one block longer than the
+    local chain of `length` blocks, as after a peer mined a block.
+    """
+    chain = build_chain(length)
+    # Received chains are decoded, their blocks are equal but not the same
+    received = Blockchain.from_json(Blockchain(chain=chain).to_json()).chain
+
+    def mine():
+        extension = []
+        previous_hash = chain[-1].hash
+        for index in range(length, length + blocks):
+            block = _block(index, previous_hash, records=1)
+            block.hash = services._proof_of_work(block, workers=1)
+            extension.append(block)
+            previous_hash = block.hash
+        return extension
+
+    extension = _with_difficulty(CHAIN_DIFFICULTY, mine)
+    node = f"benchmark-extend-chain-{length}"
+    with node_context(node):
+        repository = BlockchainRepository(store_directory=None)
+        repository.chain = chain
+        best = math.inf
+        try:
+            for count in range(1, blocks + 1):
+                blockchain = Blockchain(chain=received + extension[:count])
+                start = time.perf_counter()
+                _with_difficulty(
+                    CHAIN_DIFFICULTY,
+                    lambda: services.set_chain(blockchain, repository),
+                )
+                best = min(best, time.perf_counter() - start)
+        finally:
+            forget_node(node)
+    return best
+
+
+def bench_check_chain_validity(length: int) -> float:
+    blockchain = Blockchain(chain=build_chain(length))
+
+    def validate():
+        if not services.check_chain_validity(blockchain, workers=1):
+            raise AssertionError("The benchmark chain is not valid")
+
+    return _with_difficulty(
+        CHAIN_DIFFICULTY, lambda: time_per_operation(validate, number=1, repeat=3)
+    )
+
+
+_record_indexes: dict[int, RecordIndex] = {}
+
+
+def build_record_index(records: int) -> RecordIndex:
+    """An index of distinct records, cached for the process."""
+    record_index = _record_indexes.get(records)
+    if record_index is not None:
+        return record_index
+
+    record_index = RecordIndex()
+    for height in range(records // 10):
+        block = _block(height, records=0)
+        block.records = [
+            Record(
+                index=i, timestamp=1_700_000_000 + height, content=f"Transaction {i}"
+            )
+            for i in range(height * 10, height * 10 + 10)
+        ]
+        record_index.add_block(height, block)
+    _record_indexes[records] = record_index
+    return record_index
+
+
+def bench_find_records_by_text(records: int = INDEXED_RECORDS) -> float:
+    record_index = build_record_index(records)
+    return time_per_operation(
+        lambda: record_index.find(f"transaction {records // 2}", limit=100),
+        number=1_000,
+    )
+
+
+def bench_find_records_by_timestamp(records: int = INDEXED_RECORDS) -> float:
+    record_index = build_record_index(records)
+    since = 1_700_000_000 + records // 20
+    return time_per_operation(
+        lambda: record_index.find(since=since, until=since + 9, limit=100),
+        number=1_000,
+    )
+
+
+def bench_block_json_round_trip() -> float:
+    block = _block()
+    return time_per_operation(lambda: Block.from_json(block.to_json()), number=1_000)
+
+
+def bench_blockchain_json_round_trip(length: int = 1_000) -> float:
+    blockchain = Blockchain(chain=build_chain(length))
+    return time_per_operation(
+        lambda: Blockchain.from_json(blockchain.to_json()), number=1, repeat=3
+    )
+
+
+def collect_benchmarks(full: bool = False) -> dict[str, Callable[[], float]]:
+    """Benchmarks by name, `full` adds the slow ones on a million blocks."""
+    benchmarks = {
+        "compute_hash": bench_compute_hash,
+        "merkle_root_100": bench_merkle_root,
+        f"find_records_by_text_{INDEXED_RECORDS}": bench_find_records_by_text,
+        f"find_records_by_timestamp_{INDEXED_RECORDS}": (
+            bench_find_records_by_timestamp
+        ),
+        "block_json_round_trip": bench_block_json_round_trip,
+        "blockchain_json_round_trip_1000": bench_blockchain_json_round_trip,
+        f"memory_per_block_{MEMORY_CHAIN_LENGTH}_bytes": lambda: (
+            bench_memory_per_block(MEMORY_CHAIN_LENGTH, compact=False)
+        ),
+        f"memory_per_block_compact_{MEMORY_CHAIN_LENGTH}_bytes": lambda: (
+            bench_memory_per_block(MEMORY_CHAIN_LENGTH, compact=True)
+        ),
+        f"repository_memory_per_block_{MEMORY_CHAIN_LENGTH}_bytes": lambda: (
+            bench_repository_memory_per_block(MEMORY_CHAIN_LENGTH)
+        ),
+    }
+    for difficulty in POW_DIFFICULTIES:
+        benchmarks[
+            f"proof_of_work_d{difficulty}_per_hash"
+        ] = lambda difficulty=difficulty: bench_proof_of_work(difficulty)
+    for depth in PENDING_DEPTHS:
+        benchmarks[
+            f"pending_add_pop_depth_{depth}"
+        ] = lambda depth=depth: bench_pending_blocks(depth)
+    for length in FULL_CHAIN_LENGTHS if full else CHAIN_LENGTHS:
+        benchmarks[f"side_links_{length}"] = lambda length=length: bench_side_links(
+            length
+        )
+        benchmarks[
+            f"check_chain_validity_{length}"
+        ] = lambda length=length: bench_check_chain_validity(length)
+        benchmarks[f"extend_chain_{length}"] = lambda length=length: (
+            bench_extend_chain(length)
+        )
+    return benchmarks
+
+
+def run_benchmarks(
+    full: bool = False, only: str | None = None, report: Callable | None = None
+) -> dict[str, float]:
+    results = {}
+    for name, benchmark in collect_benchmarks(full).items():
+        if only and only not in name:
+            continue
+        results[name] = benchmark()
+        if report:
+            report(name, results[name])
+    return results
+
+
+def load_baselines(path: str = BENCHMARK_BASELINES) -> dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baselines_file:
+        return json.load(baselines_file)
+
+
+def save_baselines(results: dict[str, float], path: str = BENCHMARK_BASELINES) -> None:
+    """Merges the results into the stored baselines."""
+    baselines = {**load_baselines(path), **results}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as baselines_file:
+        json.dump(dict(sorted(baselines.items())), baselines_file, indent=2)
+        baselines_file.write("\n")
+
+
+def find_regressions(
+    results: dict[str, float],
+    baselines: dict[str, float],
+    threshold: float = BENCHMARK_THRESHOLD,
+) -> dict[str, float]:
+    """Returns the slowdown of every benchmark that regressed."""
+    regressions = {}
+    for name, seconds in results.items():
+        baseline = baselines.get(name)
+        if baseline and seconds > baseline * (1 + threshold):
+            regressions[name] = seconds / baseline - 1
+    return regressions
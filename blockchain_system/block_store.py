@@ -0,0 +1,297 @@
+"""
+Durable storage of the chain.
+
+Blocks are appended to `blocks.log`, each record being a header with the
+payload length, its CRC32 and the chain position of the block, followed by
+the block in the binary wire format. Writing a block at position h replaces
+the block at h and drops everything after it, and a record without payload
+truncates the chain to h blocks, so replaying the log gives back the chain,
+including replaced tips and reorganizations.
+
+`index.bin` is memory-mapped. It starts with the number of blocks in the
+chain and the log offset it reflects, followed by one fixed-size entry per
+position holding the log offset, record length and the SHA-256 of the
+block hash. Records written after the indexed log offset are replayed on
+open, and a torn record at the end of the log is cut off.
+
+`hashes.bin` is a memory-mapped open addressing table from block hashes to
+positions, so opening the store does not read the index. Its slots hold
+positions of the index, a slot is live while the entry at its position
+still holds the hash. The table is rebuilt from the index when it does not
+reflect the same log offset, or when dead slots fill it up.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from blockchain_system.blockchain import Block
+from blockchain_system.codec import BinaryCodec
+
+LOG_FILE_NAME = "blocks.log"
+INDEX_FILE_NAME = "index.bin"
+HASHES_FILE_NAME = "hashes.bin"
+# Flush writes to disk with fsync, slower but survives power loss
+BLOCK_STORE_FSYNC = False
+
+_RECORD_HEADER = struct.Struct("<IIQ")
+_INDEX_HEADER = struct.Struct("<QQ")
+_INDEX_ENTRY = struct.Struct("<QI32s")
+_INDEX_GROWTH = 4096
+_HASHES_HEADER = struct.Struct("<QQQ")
+_HASH_SLOT = struct.Struct("<Q")
+_MIN_HASH_SLOTS = 4096
+
+
+class BlockStoreException(Exception):
+    pass
+
+
+def hash_key(block_hash: str) -> bytes:
+    return hashlib.sha256(block_hash.encode()).digest()
+
+
+class BlockStore:
+    def __init__(self, directory: str, fsync: bool = BLOCK_STORE_FSYNC):
+        os.makedirs(directory, exist_ok=True)
+        self.fsync = fsync
+        self._codec = BinaryCodec()
+        self._lock = threading.Lock()
+
+        self._log = open(os.path.join(directory, LOG_FILE_NAME), "a+b")
+        self._index_file = open(os.path.join(directory, INDEX_FILE_NAME), "a+b")
+        if os.fstat(self._index_file.fileno()).st_size < _INDEX_HEADER.size:
+            self._index_file.truncate(
+                _INDEX_HEADER.size + _INDEX_GROWTH * _INDEX_ENTRY.size
+            )
+        self._index = mmap.mmap(self._index_file.fileno(), 0)
+
+        self._count, self._log_end = _INDEX_HEADER.unpack_from(self._index, 0)
+        self._recover()
+
+        self._hashes_file = open(os.path.join(directory, HASHES_FILE_NAME), "a+b")
+        self._hashes: mmap.mmap | None = None
+        self._slots = self._used_slots = 0
+        log_end = None
+        if os.fstat(self._hashes_file.fileno()).st_size >= _HASHES_HEADER.size:
+            self._hashes = mmap.mmap(self._hashes_file.fileno(), 0)
+            self._slots, self._used_slots, log_end = _HASHES_HEADER.unpack_from(
+                self._hashes, 0
+            )
+        if not self._slots or log_end != self._log_end:
+            self._rebuild_hashes()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _entry(self, position: int) -> tuple[int, int, bytes]:
+        return _INDEX_ENTRY.unpack_from(
+            self._index, _INDEX_HEADER.size + position * _INDEX_ENTRY.size
+        )
+
+    def _set_entry(self, position: int, offset: int, length: int, key: bytes):
+        entry_offset = _INDEX_HEADER.size + (position + 1) * _INDEX_ENTRY.size
+        if entry_offset > len(self._index):
+            self._index.close()
+            self._index_file.truncate(entry_offset + _INDEX_GROWTH * _INDEX_ENTRY.size)
+            self._index = mmap.mmap(self._index_file.fileno(), 0)
+
+        _INDEX_ENTRY.pack_into(
+            self._index,
+            _INDEX_HEADER.size + position * _INDEX_ENTRY.size,
+            offset,
+            length,
+            key,
+        )
+
+    def _set_header(self, count: int, log_end: int) -> None:
+        self._count, self._log_end = count, log_end
+        _INDEX_HEADER.pack_into(self._index, 0, count, log_end)
+
+    def _read_record(self, offset: int) -> tuple[int, bytes] | None:
+        """Returns the position and payload of a record, None if it is torn."""
+        self._log.seek(offset)
+        header = self._log.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            return None
+
+        length, checksum, position = _RECORD_HEADER.unpack(header)
+        payload = self._log.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return None
+        return position, payload
+
+    def _recover(self) -> None:
+        log_size = self._log.seek(0, os.SEEK_END)
+        if self._log_end > log_size:
+            # The end of the log was lost, replay it from the last intact block
+            count = self._count
+            while count and not self._is_intact(count - 1, log_size):
+                count -= 1
+            log_end = sum(self._entry(count - 1)[:2]) if count else 0
+            self._set_header(count, log_end)
+
+        offset = self._log_end
+        while (record := self._read_record(offset)) is not None:
+            position, payload = record
+            if position > self._count:
+                break
+            length = _RECORD_HEADER.size + len(payload)
+            offset += length
+            if not payload:
+                self._set_header(position, offset)
+                continue
+            block = self._codec.decode(payload)
+            self._set_entry(position, offset - length, length, hash_key(block.hash))
+            self._set_header(position + 1, offset)
+
+        if offset < log_size:
+            self._log.truncate(offset)
+        self._set_header(self._count, offset)
+        self._log.flush()
+        self._index.flush()
+
+    def _is_intact(self, position: int, log_size: int) -> bool:
+        offset, length, _ = self._entry(position)
+        return offset + length <= log_size and self._read_record(offset) is not None
+
+    def _rebuild_hashes(self) -> None:
+        """Fills a new table with the positions of the chain, O(chain)."""
+        slots = _MIN_HASH_SLOTS
+        while slots < 4 * self._count:
+            slots *= 2
+        if self._hashes is not None:
+            self._hashes.close()
+        self._hashes_file.truncate(0)
+        self._hashes_file.truncate(_HASHES_HEADER.size + slots * _HASH_SLOT.size)
+        self._hashes = mmap.mmap(self._hashes_file.fileno(), 0)
+        self._slots, self._used_slots = slots, 0
+        for position in range(self._count):
+            self._insert_hash(self._entry(position)[2], position)
+        self._set_hashes_header()
+
+    def _set_hashes_header(self) -> None:
+        _HASHES_HEADER.pack_into(
+            self._hashes, 0, self._slots, self._used_slots, self._log_end
+        )
+
+    def _slot_offsets(self, key: bytes):
+        slot = int.from_bytes(key[:8], "little") % self._slots
+        while True:
+            yield _HASHES_HEADER.size + slot * _HASH_SLOT.size
+            slot = (slot + 1) % self._slots
+
+    def _insert_hash(self, key: bytes, position: int) -> None:
+        if 2 * (self._used_slots + 1) > self._slots:
+            # Dead slots are dropped, rebuilding inserts the new entry too
+            self._rebuild_hashes()
+            return
+        for slot_offset in self._slot_offsets(key):
+            if not _HASH_SLOT.unpack_from(self._hashes, slot_offset)[0]:
+                _HASH_SLOT.pack_into(self._hashes, slot_offset, position + 1)
+                self._used_slots += 1
+                return
+
+    def _find_hash(self, key: bytes) -> int | None:
+        for slot_offset in self._slot_offsets(key):
+            (slot,) = _HASH_SLOT.unpack_from(self._hashes, slot_offset)
+            if not slot:
+                return None
+            position = slot - 1
+            if position < self._count and self._entry(position)[2] == key:
+                return position
+
+    def _flush(self) -> None:
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+            # Flushing a map writes it synchronously, without fsync the
+            # page cache already keeps writes across a crash of the process
+            self._index.flush()
+            self._hashes.flush()
+
+    def write(self, position: int, block: Block) -> None:
+        """Stores the block at the position and drops all blocks after it."""
+        with self._lock:
+            if position > self._count:
+                raise BlockStoreException(f"Cannot write block at {position}")
+
+            offset, length = self._append_record(position, self._codec.encode(block))
+            key = hash_key(block.hash)
+            self._set_entry(position, offset, length, key)
+            self._set_header(position + 1, offset + length)
+            self._insert_hash(key, position)
+            self._set_hashes_header()
+            self._flush()
+
+    def truncate(self, count: int) -> None:
+        with self._lock:
+            if count >= self._count:
+                return
+            offset, length = self._append_record(count, b"")
+            self._set_header(count, offset + length)
+            self._set_hashes_header()
+            self._flush()
+
+    def _append_record(self, position: int, payload: bytes) -> tuple[int, int]:
+        record = (
+            _RECORD_HEADER.pack(len(payload), zlib.crc32(payload), position) + payload
+        )
+        offset = self._log.seek(0, os.SEEK_END)
+        self._log.write(record)
+        # The record reaches the file before the index points past it
+        self._log.flush()
+        return offset, len(record)
+
+    def read(self, position: int) -> Block:
+        with self._lock:
+            if not 0 <= position < self._count:
+                raise IndexError(position)
+            offset, _, _ = self._entry(position)
+            _, payload = self._read_record(offset)
+            return self._codec.decode(payload)
+
+    def offset_of(self, position: int) -> int:
+        """Log offset of the block at the position, it stays readable there."""
+        with self._lock:
+            if not 0 <= position < self._count:
+                raise IndexError(position)
+            return self._entry(position)[0]
+
+    def read_at(self, offset: int) -> Block:
+        with self._lock:
+            _, payload = self._read_record(offset)
+            return self._codec.decode(payload)
+
+    def position_of(self, block_hash: str) -> int | None:
+        with self._lock:
+            return self._find_hash(hash_key(block_hash))
+
+    def read_by_hash(self, block_hash: str) -> Block | None:
+        position = self.position_of(block_hash)
+        if position is None:
+            return None
+        return self.read(position)
+
+    def read_chain(self) -> list[Block]:
+        with self._lock:
+            self._log.seek(0)
+            data = self._log.read(self._log_end)
+
+        chain = []
+        for position in range(self._count):
+            offset, length, _ = self._entry(position)
+            payload = data[offset + _RECORD_HEADER.size : offset + length]
+            chain.append(self._codec.decode(payload))
+        return chain
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._hashes.close()
+            self._hashes_file.close()
+            self._index.close()
+            self._index_file.close()
+            self._log.close()
@@ -5,20 +5,48 @@ from dataclasses import dataclass
 from dataclass_wizard import JSONWizard
 
 
-@dataclass
+@dataclass(slots=True)
+class Record(JSONWizard):
+    index: int
+    timestamp: int
+    content: str
+
+
+@dataclass(slots=True)
 class PendingBlock(JSONWizard):
     index: int
-    records: list
+    records: list[Record]
 
 
-@dataclass
-class Record(JSONWizard):
+@dataclass(slots=True)
+class BlockHeader(JSONWizard):
+    """
+    The fixed-size part of a block covered by its proof of work, records are
+    committed to through their Merkle root.
+    """
+
     index: int
+    previous_hash: str
+    side_links: list[str]
     timestamp: int
-    content: str
+    merkle_root: str
+    nonce: int = 0
 
+    def compute_hash(self) -> str:
+        return BlockHasher.from_header(self).compute_hash(self.nonce)
 
-@dataclass
+    def serialize_without_nonce(self) -> tuple[bytes, bytes]:
+        """
+        Returns the serialized header split around the nonce value, so that
+        `prefix + str(nonce) + suffix` equals the string hashed by
+        `compute_hash`.
+        """
+        header_string = str(self.to_dict(exclude=["nonce"]))
+        prefix = f"{header_string[:-1]}, 'nonce': "
+        return prefix.encode(), b"}"
+
+
+@dataclass(slots=True)
 class Block(JSONWizard):
     index: int
     previous_hash: str
@@ -27,15 +55,139 @@ class Block(JSONWizard):
     records: list[Record]  # or transactions
     hash: str | None = None
     nonce: int = 0
+    # Computed from the records when the block is built
+    merkle_root: str | None = None
+
+    def __post_init__(self):
+        if self.merkle_root is None:
+            self.merkle_root = compute_merkle_root(self.records)
+
+    def header(self) -> BlockHeader:
+        return BlockHeader(
+            index=self.index,
+            previous_hash=self.previous_hash,
+            side_links=self.side_links,
+            timestamp=self.timestamp,
+            merkle_root=self.merkle_root,
+            nonce=self.nonce,
+        )
 
     def compute_hash(self):
-        """
-        Returns the hash of the block instance by first converting it
-        into JSON string.
-        """
-        block_string = str(self.to_dict(exclude=["hash"]))
-        _hex_string = hashlib.sha256(block_string.encode()).hexdigest()
-        return format(int(_hex_string, 16), "0>256b")
+        """Returns the hash of the block header."""
+        return self.header().compute_hash()
+
+    def serialize_without_nonce(self) -> tuple[bytes, bytes]:
+        return self.header().serialize_without_nonce()
+
+    def has_valid_merkle_root(self) -> bool:
+        return self.merkle_root == compute_merkle_root(self.records)
+
+    def record_proof(self, position: int) -> "RecordProof":
+        """Proves that the record at `position` is committed to by the header."""
+        record = self.records[position]
+        levels = merkle_levels(list(map(record_digest, self.records)))
+        path = []
+        for level in levels[:-1]:
+            sibling = position ^ 1
+            # The last node of an odd level has no sibling and moves up as is
+            if sibling < len(level):
+                path.append(
+                    MerkleStep(
+                        hash=digest_to_hash(level[sibling]), left=sibling < position
+                    )
+                )
+            position //= 2
+        return RecordProof(
+            header=self.header(),
+            hash=self.hash,
+            record=record,
+            path=path,
+        )
+
+
+def digest_to_hash(digest: bytes) -> str:
+    return format(int.from_bytes(digest, "big"), "0>256b")
+
+
+def hash_to_digest(block_hash: str) -> bytes:
+    return int(block_hash, 2).to_bytes(32, "big")
+
+
+def record_digest(record: Record) -> bytes:
+    """Leaf of the Merkle tree, prefixed so it cannot pass for an inner node."""
+    return hashlib.sha256(
+        f"\x00{record.index}:{record.timestamp}:{record.content}".encode()
+    ).digest()
+
+
+def _merkle_parent(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def merkle_levels(leaves: list[bytes]) -> list[list[bytes]]:
+    """Levels of the Merkle tree from the leaves up to the root."""
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parents = [
+            _merkle_parent(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            parents.append(level[-1])
+        levels.append(parents)
+    return levels
+
+
+def compute_merkle_root(records: list[Record]) -> str:
+    if not records:
+        return digest_to_hash(hashlib.sha256(b"").digest())
+    return digest_to_hash(merkle_levels(list(map(record_digest, records)))[-1][0])
+
+
+def difficulty_target(difficulty: int) -> int:
+    """Digests below the target have at least `difficulty` leading zero bits."""
+    return 1 << (256 - difficulty)
+
+
+class BlockHasher:
+    """
+    Hashes a block for many nonce values. The fixed fields are serialized
+    and fed to SHA-256 once, every nonce then only hashes its own bytes on a
+    copy of that midstate.
+    """
+
+    def __init__(self, prefix: bytes, suffix: bytes):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.midstate = hashlib.sha256(prefix)
+
+    @classmethod
+    def from_header(cls, header: BlockHeader) -> "BlockHasher":
+        return cls(*header.serialize_without_nonce())
+
+    @classmethod
+    def from_block(cls, block: Block) -> "BlockHasher":
+        return cls(*block.serialize_without_nonce())
+
+    def digest(self, nonce: int) -> bytes:
+        state = self.midstate.copy()
+        state.update(b"%d%b" % (nonce, self.suffix))
+        return state.digest()
+
+    def compute_hash(self, nonce: int) -> str:
+        return digest_to_hash(self.digest(nonce))
+
+    def search(self, start: int, stop: int, target: int) -> int | None:
+        """Returns the first nonce in [start, stop) whose digest is below target."""
+        midstate = self.midstate
+        suffix = self.suffix
+        from_bytes = int.from_bytes
+        for nonce in range(start, stop):
+            state = midstate.copy()
+            state.update(b"%d%b" % (nonce, suffix))
+            if from_bytes(state.digest(), "big") < target:
+                return nonce
+        return None
 
 
 @dataclass
@@ -45,3 +197,123 @@ class Blockchain(JSONWizard):
     @property
     def length(self):
         return len(self.chain)
+
+
+@dataclass
+class BlockId(JSONWizard):
+    index: int
+    hash: str
+
+
+@dataclass
+class ChainTip(JSONWizard):
+    node_id: str
+    index: int
+    hash: str
+    # Set when the tip is offered to a single node
+    target_node_id: str | None = None
+
+
+@dataclass
+class SyncRequest(JSONWizard):
+    node_id: str
+    target_node_id: str
+    # Known blocks, newest first, used to find the common ancestor
+    locator: list[BlockId]
+
+
+@dataclass
+class SyncBlocks(JSONWizard):
+    node_id: str
+    target_node_id: str
+    start: int
+    blocks: list[Block]
+    last: bool
+
+
+@dataclass(slots=True)
+class MerkleStep(JSONWizard):
+    hash: str
+    # Whether the sibling is hashed on the left
+    left: bool
+
+
+@dataclass
+class RecordProof(JSONWizard):
+    header: BlockHeader
+    hash: str
+    record: Record
+    # Siblings from the record up to the Merkle root
+    path: list[MerkleStep]
+
+    def verify(self) -> bool:
+        """
+        Checks that the record is committed to by the header and that the
+        header hashes to `hash`. Whether the block belongs to the chain is
+        up to the caller, who compares `hash` with a block it trusts.
+        """
+        digest = record_digest(self.record)
+        for step in self.path:
+            sibling = hash_to_digest(step.hash)
+            if step.left:
+                digest = _merkle_parent(sibling, digest)
+            else:
+                digest = _merkle_parent(digest, sibling)
+        return (
+            digest_to_hash(digest) == self.header.merkle_root
+            and self.header.compute_hash() == self.hash
+        )
+
+
+@dataclass
+class ShowChainRequest(JSONWizard):
+    request_id: str
+    start: int = 0
+    # Height after the last block shown, None shows up to the tip
+    stop: int | None = None
+    # Blocks per page, None uses the default of the node
+    page_size: int | None = None
+
+
+@dataclass
+class ChainPage(JSONWizard):
+    node_id: str
+    request_id: str
+    start: int
+    blocks: list[Block]
+    last: bool
+
+
+@dataclass
+class RecordQuery(JSONWizard):
+    request_id: str
+    # Words the content of the records must contain
+    text: str | None = None
+    # Timestamp range of the records, inclusive
+    since: int | None = None
+    until: int | None = None
+    # Number of matches returned, None uses the default of the node
+    limit: int | None = None
+
+
+@dataclass
+class RecordMatch(JSONWizard):
+    record: Record
+    block_index: int
+    block_hash: str
+    # Position of the record in the block
+    position: int
+
+
+@dataclass
+class RecordQueryResult(JSONWizard):
+    node_id: str
+    request_id: str
+    matches: list[RecordMatch]
+
+
+@dataclass
+class RecordProofRequest(JSONWizard):
+    content: str
+    # Narrows the search down to records with this timestamp
+    timestamp: int | None = None
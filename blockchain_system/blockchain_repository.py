@@ -1,9 +1,25 @@
+import heapq
+import random
 import threading
 import time
+import uuid
+from collections import OrderedDict, deque
+from collections.abc import Sequence
 from contextlib import contextmanager
-from copy import deepcopy
+from dataclasses import dataclass
+from typing import Iterable, Iterator
 
-from blockchain_system.blockchain import Block, Blockchain, PendingBlock
+from blockchain_system.block_store import BlockStore
+from blockchain_system.blockchain import (
+    Block,
+    Blockchain,
+    PendingBlock,
+    RecordMatch,
+    SyncBlocks,
+)
+from blockchain_system.metrics import MetricsRegistry, TimedLock
+from blockchain_system.node import Singleton, node_directory
+from blockchain_system.record_index import RecordEntry, RecordIndex
 
 
 @contextmanager
@@ -11,28 +27,346 @@ def locked_chain(blockchain_repository: "BlockchainRepository"):
     blockchain_repository._lock.acquire()
 
     try:
-        yield blockchain_repository.get_chain()
+        yield blockchain_repository.get_snapshot()
     finally:
         blockchain_repository._lock.release()
 
 
-class PreviousHashMismatchException(Exception):
+# Directory of the durable block store, None keeps the chain in memory only
+BLOCK_STORE_DIR: str | None = None
+# Number of blocks remembered as fully verified
+VERIFIED_BLOCKS_CACHE_SIZE = 100_000
+# Blocks more than this many blocks below the tip are final: they leave the
+# tree, main chain blocks are then found in the chain, and blocks forking
+# deeper are ignored
+FINALITY_DEPTH = 100
+# Blocks kept until their parent arrives, the oldest are dropped first
+MAX_ORPHAN_BLOCKS = 1_000
+# All blocks are mined at the same difficulty, so each adds the same work
+# and the chain with the most work is the longest one, as in syncing
+BLOCK_WORK = 1
+MAX_PENDING_BLOCKS = 10_000
+# What `PendingBlocksRepository.add` does when the queue is full:
+# "block" waits for the miner to free a slot, "reject" raises immediately
+PENDING_BLOCKS_FULL_POLICY = "block"
+# A sync with a peer that stopped sending pages is abandoned after this time
+SYNC_SESSION_TIMEOUT = 30
+# Minimum time between sync requests triggered by orphan blocks
+SYNC_REQUEST_INTERVAL = 5
+# Blocks per chunk shared between chain snapshots
+CHAIN_CHUNK_SIZE = 1_024
+
+
+class PendingBlocksFullException(Exception):
     pass
 
 
-class Singleton(type):
-    _instances = {}
+@dataclass(slots=True)
+class BlockTreeNode:
+    block: Block
+    # Position in the chain from the genesis block
+    height: int
+    # Work of the block and all of its ancestors
+    work: int
 
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
 
+def _is_same_block(position: int, block: Block, local_block: Block) -> bool:
+    if block is local_block or block == local_block:
+        return True
+    # Nodes create their genesis blocks on their own, they agree on the hash
+    return (
+        position == 0
+        and block.index == local_block.index == 0
+        and block.previous_hash == local_block.previous_hash
+        and block.hash == local_block.hash
+        and not block.records
+    )
 
-class BlockchainRepository(metaclass=Singleton):
-    def __init__(self):
-        self.chain: list[Block] = []
+
+class ChainSnapshot(Sequence):
+    """
+    Immutable view of the main chain at one version. Blocks are kept in full
+    chunks, shared with the snapshots derived from this one, and a tail, so
+    a new version copies the tail and the tuple of chunks, never the chain.
+    Chunks of a chain loaded from the block store decode blocks on access.
+    Blocks are found by hash through the draft the snapshot was taken from,
+    its heights are checked against the snapshot.
+    """
+
+    __slots__ = ("version", "chunk_size", "_chunks", "_tail", "_length", "_draft")
+
+    def __init__(
+        self,
+        chunks: tuple[Sequence[Block], ...] = (),
+        tail: tuple[Block, ...] = (),
+        version: int = 0,
+        chunk_size: int = CHAIN_CHUNK_SIZE,
+        draft: "ChainDraft | None" = None,
+    ):
+        self.version = version
+        self.chunk_size = chunk_size
+        self._chunks = chunks
+        self._tail = tail
+        self._length = len(chunks) * chunk_size + len(tail)
+        self._draft = draft
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            start, stop, step = position.indices(self._length)
+            if step != 1:
+                return list(self)[position]
+            return list(self.blocks(start, stop))
+
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError("Block position out of range")
+        chunk, offset = divmod(position, self.chunk_size)
+        if chunk < len(self._chunks):
+            return self._chunks[chunk][offset]
+        return self._tail[offset]
+
+    def __iter__(self) -> Iterator[Block]:
+        return self.blocks()
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (ChainSnapshot, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            block == other_block for block, other_block in zip(self, other)
+        )
+
+    def __add__(self, other) -> list[Block]:
+        return list(self) + list(other)
+
+    def height_of(self, block_hash: str) -> int | None:
+        """Height of the block of this snapshot with the hash, if any."""
+        if self._draft is None:
+            return None
+        for height in self._draft.candidate_heights(block_hash):
+            if height < self._length and self[height].hash == block_hash:
+                return height
+        return None
+
+    def blocks(self, start: int = 0, stop: int | None = None) -> Iterator[Block]:
+        """Yields the blocks at positions [start, stop), chunk by chunk."""
+        stop = self._length if stop is None else min(stop, self._length)
+        position = max(start, 0)
+        while position < stop:
+            chunk, offset = divmod(position, self.chunk_size)
+            blocks = self._chunks[chunk] if chunk < len(self._chunks) else self._tail
+            end = min(len(blocks), offset + stop - position)
+            yield from blocks[offset:end]
+            position += end - offset
+
+
+class StoredChunk(Sequence):
+    """
+    Blocks of the block store at positions [start, start + length), decoded
+    on access. Frozen chunks read the blocks at the log offsets they had,
+    which stay valid after the store replaced those positions.
+    """
+
+    def __init__(self, store: BlockStore, start: int, length: int):
+        self._store = store
+        self._start = start
+        self._length = length
+        self._offsets: list[int] | None = None
         self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, position: int | slice) -> Block | list[Block]:
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(self._length))]
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError("Block position out of range")
+        with self._lock:
+            if self._offsets is not None:
+                offset = self._offsets[position]
+            else:
+                offset = self._store.offset_of(self._start + position)
+        return self._store.read_at(offset)
+
+    def freeze(self) -> None:
+        """Must be called before the store changes the positions of the chunk."""
+        with self._lock:
+            if self._offsets is None:
+                self._offsets = [
+                    self._store.offset_of(position)
+                    for position in range(self._start, self._start + self._length)
+                ]
+
+
+class ChainDraft:
+    """
+    The main chain as changed by the writer, in chunks of blocks shared
+    with the snapshots and a tail. A chain loaded from the block store
+    keeps its full chunks there, found by hash through the store. Heights
+    are not cleared when blocks are removed, so snapshots taken before
+    still find them, every height found is checked against the chain.
+    """
+
+    def __init__(self, chunk_size: int | None = None):
+        self.chunk_size = chunk_size or CHAIN_CHUNK_SIZE
+        self._chunks: list[tuple[Block, ...] | StoredChunk] = []
+        self._tail: list[Block] = []
+        # Last height of the blocks by hash
+        self._heights: dict[str, int] = {}
+        self._store: BlockStore | None = None
+
+    @classmethod
+    def from_store(cls, store: BlockStore, chunk_size: int | None = None):
+        """Decodes only the blocks of the tail, O(chunk size)."""
+        draft = cls(chunk_size)
+        draft._store = store
+        full_chunks = len(store) // draft.chunk_size
+        draft._chunks = [
+            StoredChunk(store, chunk * draft.chunk_size, draft.chunk_size)
+            for chunk in range(full_chunks)
+        ]
+        for position in range(full_chunks * draft.chunk_size, len(store)):
+            draft.append(store.read(position))
+        return draft
+
+    def __len__(self) -> int:
+        return len(self._chunks) * self.chunk_size + len(self._tail)
+
+    def __getitem__(self, position: int) -> Block:
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("Block position out of range")
+        chunk, offset = divmod(position, self.chunk_size)
+        if chunk < len(self._chunks):
+            return self._chunks[chunk][offset]
+        return self._tail[offset]
+
+    def __iter__(self) -> Iterator[Block]:
+        return self.blocks()
+
+    def blocks(self, start: int = 0) -> Iterator[Block]:
+        """Yields the blocks from height `start` on."""
+        if start >= len(self):
+            return
+        chunk, offset = divmod(start, self.chunk_size)
+        for blocks in self._chunks[chunk:]:
+            yield from blocks[offset:] if offset else blocks
+            offset = 0
+        yield from self._tail[offset:]
+
+    def append(self, block: Block) -> None:
+        self._heights[block.hash] = len(self)
+        self._tail.append(block)
+        if len(self._tail) == self.chunk_size:
+            self._chunks.append(tuple(self._tail))
+            self._tail = []
+
+    def pop(self) -> Block:
+        if not self._tail:
+            chunk = self._chunks.pop()
+            if isinstance(chunk, StoredChunk):
+                chunk.freeze()
+            self._tail = list(chunk)
+            if isinstance(chunk, StoredChunk):
+                # The store drops these positions next
+                start = len(self._chunks) * self.chunk_size
+                for height, block in enumerate(self._tail, start):
+                    self._heights[block.hash] = height
+        return self._tail.pop()
+
+    def candidate_heights(self, block_hash: str) -> Iterator[int]:
+        """Heights the block with this hash had, to be checked by the caller."""
+        height = self._heights.get(block_hash)
+        if height is not None:
+            yield height
+        if self._store is not None:
+            height = self._store.position_of(block_hash)
+            if height is not None:
+                yield height
+
+    def height_of(self, block_hash: str) -> int | None:
+        """Height of the block of the chain with this hash, if any."""
+        for height in self.candidate_heights(block_hash):
+            if height < len(self) and self[height].hash == block_hash:
+                return height
+        return None
+
+    def freeze(self) -> None:
+        """Must be called before the store is changed other than by `pop`."""
+        for chunk in self._chunks:
+            if isinstance(chunk, StoredChunk):
+                chunk.freeze()
+
+    def snapshot(self, version: int) -> ChainSnapshot:
+        return ChainSnapshot(
+            tuple(self._chunks), tuple(self._tail), version, self.chunk_size, self
+        )
+
+
+class BlockchainRepository(metaclass=Singleton):
+    """
+    The main chain and the tree of all known blocks it was chosen from.
+    The main chain ends with the block having the most cumulative work,
+    ties go to the older block. Blocks whose parent is unknown wait in the
+    orphan pool until it arrives, side branches deeper than the finality
+    depth are pruned.
+
+    Writers change the chain under the lock and publish a new snapshot when
+    they are done, readers take the current snapshot without the lock.
+    """
+
+    def __init__(self, store_directory: str | None = None):
+        # Main chain as changed by writers, readers use the snapshot
+        self._chain = ChainDraft()
+        self._snapshot = ChainSnapshot()
+        # Whether the chain changed since the last snapshot
+        self._changed = False
+        # Records of the main chain, None until first needed after a restart
+        self._records: RecordIndex | None = RecordIndex()
+        # Blocks added (True) and removed (False) while the index is built
+        # from a snapshot, None when no build is running
+        self._record_changes: list[tuple[bool, int, Block]] | None = None
+        self._records_build_lock = threading.Lock()
+        # Blocks that are not final yet, by hash
+        self._tree: dict[str, BlockTreeNode] = {}
+        # Heights and hashes of the blocks of the tree, pruned once they
+        # are deeper than the finality depth
+        self._tree_heights: list[tuple[int, str]] = []
+        self._orphans: OrderedDict[str, Block] = OrderedDict()
+        self._orphans_by_parent: dict[str, list[str]] = {}
+        # Verified blocks by hash and index, compared in full before reuse
+        self._verified_blocks: OrderedDict[tuple[str, int], Block] = OrderedDict()
+        self._verified_lock = threading.Lock()
+        metrics = MetricsRegistry()
+        self._lock = TimedLock(
+            metrics.histogram(
+                "blockchain_lock_wait_seconds",
+                "Time spent waiting for the chain lock",
+            )
+        )
+        self._height = metrics.gauge("chain_height", "Index of the last block")
+        # Blocks of the main chain dropped by reorganizations and blocks
+        # that arrived before their parent
+        self.replaced_blocks = 0
+        self.orphaned_blocks = 0
+        if store_directory is None:
+            store_directory = BLOCK_STORE_DIR
+        self._store = (
+            BlockStore(node_directory(store_directory)) if store_directory else None
+        )
+
+        if self._store is not None and len(self._store):
+            # The stored chain was validated before it was written
+            self._load_stored_chain()
+            return
+
         genesis_block = self.create_genesis_block()
         self.add_or_replace(genesis_block)
 
@@ -45,75 +379,566 @@ class BlockchainRepository(metaclass=Singleton):
             timestamp=int(time.time()),
             records=[],
         )
-        genesis_block.main_hash = genesis_block.compute_hash()
         return genesis_block
 
+    def _load_stored_chain(self) -> None:
+        """
+        Restarts from the block store without decoding the chain: blocks
+        are read from the store on access, only the tail and the blocks
+        that are not final yet are decoded, and records are indexed on the
+        first query.
+        """
+        self._chain = ChainDraft.from_store(self._store)
+        self._records = None
+        self._seed_tree()
+        self._changed = True
+        self._publish()
+
+    def _seed_tree(self) -> None:
+        self._tree = {}
+        self._tree_heights = []
+        for height in range(max(self._final_height(), 0), len(self._chain)):
+            self._add_tree_node(
+                BlockTreeNode(self._chain[height], height, (height + 1) * BLOCK_WORK)
+            )
+
+    def _indexed_records(self) -> RecordIndex:
+        """
+        The record index, built on first use after a restart. The chain is
+        decoded from a snapshot without holding the chain lock, so mining
+        and sync go on, and the blocks changed meanwhile are replayed.
+        """
+        records = self._records
+        if records is not None:
+            return records
+        with self._records_build_lock:
+            with self._lock:
+                if self._records is not None:
+                    return self._records
+                # Writers publish before releasing the lock, the snapshot
+                # is the chain the recorded changes apply to
+                snapshot = self._snapshot
+                self._record_changes = []
+            records = RecordIndex()
+            for height, block in enumerate(snapshot):
+                records.add_block(height, block)
+            with self._lock:
+                if self._records is None:
+                    for added, height, block in self._record_changes:
+                        if added:
+                            records.add_block(height, block)
+                        else:
+                            records.remove_block(height, block)
+                    self._records = records
+                self._record_changes = None
+                return self._records
+
+    @property
+    def chain(self) -> ChainSnapshot:
+        return self._snapshot
+
+    @chain.setter
+    def chain(self, chain: list[Block]) -> None:
+        with self._lock:
+            if self._store is not None:
+                self._chain.freeze()
+                fork_position = self._common_prefix_length(chain)
+                self._store.truncate(fork_position)
+                for position in range(fork_position, len(chain)):
+                    self._store.write(position, chain[position])
+
+            self._set_indexed_chain(chain)
+
+    def _set_indexed_chain(self, chain: Iterable[Block]) -> None:
+        self._chain = ChainDraft()
+        self._records = RecordIndex()
+        for block in chain:
+            self._records.add_block(len(self._chain), block)
+            self._chain.append(block)
+
+        self._seed_tree()
+        self._changed = True
+        self._publish()
+
+    def _publish(self) -> None:
+        """Makes the changes of the writer visible to readers at once."""
+        if not self._changed:
+            return
+        self._snapshot = self._chain.snapshot(self._snapshot.version + 1)
+        self._changed = False
+        self._height.set(len(self._chain) - 1)
+        self._prune_tree()
+
+    def _final_height(self) -> int:
+        """Blocks below this height are final and leave the tree."""
+        return len(self._chain) - 1 - FINALITY_DEPTH
+
+    def _add_tree_node(self, node: BlockTreeNode) -> None:
+        self._tree[node.block.hash] = node
+        heapq.heappush(self._tree_heights, (node.height, node.block.hash))
+
+    def _tree_node(self, block_hash: str) -> BlockTreeNode | None:
+        """The node of a block of the tree or of the main chain."""
+        node = self._tree.get(block_hash)
+        if node is not None:
+            return node
+        height = self._chain.height_of(block_hash)
+        if height is None:
+            return None
+        return BlockTreeNode(self._chain[height], height, (height + 1) * BLOCK_WORK)
+
+    def _is_known(self, block_hash: str) -> bool:
+        return block_hash in self._tree or self._chain.height_of(block_hash) is not None
+
+    def _prune_tree(self) -> None:
+        final_height = self._final_height()
+        pruned = []
+        while self._tree_heights and self._tree_heights[0][0] < final_height:
+            height, block_hash = heapq.heappop(self._tree_heights)
+            node = self._tree.get(block_hash)
+            if node is None or node.height != height:
+                continue
+            del self._tree[block_hash]
+            pruned.append((block_hash, height))
+
+        if pruned:
+            with self._verified_lock:
+                for key in pruned:
+                    self._verified_blocks.pop(key, None)
+
+    def _append_block(self, block: Block) -> None:
+        height = len(self._chain)
+        if self._store is not None:
+            self._store.write(height, block)
+        if block.hash not in self._tree:
+            parent = self._tree_node(self._chain[-1].hash) if height else None
+            self._add_tree_node(
+                BlockTreeNode(
+                    block, height, (parent.work if parent else 0) + BLOCK_WORK
+                )
+            )
+        if self._records is not None:
+            self._records.add_block(height, block)
+        elif self._record_changes is not None:
+            self._record_changes.append((True, height, block))
+        self._chain.append(block)
+        self._changed = True
+
+    def _remove_last_block(self) -> Block:
+        # Stored chunks are decoded by the pop before the store drops them
+        block = self._chain.pop()
+        if self._store is not None:
+            self._store.truncate(len(self._chain))
+        if self._records is not None:
+            self._records.remove_block(len(self._chain), block)
+        elif self._record_changes is not None:
+            self._record_changes.append((False, len(self._chain), block))
+        self._changed = True
+        return block
+
     def add_or_replace(self, block: Block) -> None:
+        """
+        Adds the block to the tree, together with the orphans it is an
+        ancestor of, and switches the main chain if it gained more work.
+        """
         with self._lock:
-            last_block = self.get_last_block()
-            if self._is_in_chain(block_to_add=block, last_block=last_block):
-                # Replace
-                self.chain[-1] = block
+            if self._is_known(block.hash) or block.hash in self._orphans:
                 return
 
-            if last_block and last_block.hash != block.previous_hash:
-                raise PreviousHashMismatchException()
-            self.chain.append(block)
+            parent = self._tree_node(block.previous_hash)
+            if parent is None and self._chain:
+                self._add_orphan(block)
+                return
+            if parent is not None and parent.height + 1 < self._final_height():
+                return
+            if not self._follows(block, parent):
+                # The chain would fail validation at this block
+                return
 
-    def _is_in_chain(self, block_to_add: Block, last_block: Block) -> None:
-        penultimate_block = self.chain[-2] if len(self.chain) >= 2 else None
+            best = self._connect_orphans_of(block, self._connect(block, parent))
+            if not self._chain or self._has_more_work(
+                best, self._tree_node(self._chain[-1].hash)
+            ):
+                self._switch_to(best)
+                self._publish()
 
-        if not penultimate_block:
-            return False
+    def _connect(self, block: Block, parent: BlockTreeNode | None) -> BlockTreeNode:
+        node = BlockTreeNode(
+            block,
+            parent.height + 1 if parent else 0,
+            (parent.work if parent else 0) + BLOCK_WORK,
+        )
+        self._add_tree_node(node)
+        return node
 
-        if (
-            block_to_add.index == last_block.index
-            and penultimate_block.hash == block_to_add.previous_hash
-            and block_to_add.timestamp < last_block.timestamp
-        ):
-            return True
+    @staticmethod
+    def _follows(block: Block, parent: BlockTreeNode | None) -> bool:
+        return block.index == (parent.height + 1 if parent else 0)
+
+    @staticmethod
+    def _has_more_work(node: BlockTreeNode, other: BlockTreeNode) -> bool:
+        return node.work > other.work or (
+            node.work == other.work and node.block.timestamp < other.block.timestamp
+        )
+
+    def _switch_to(self, tip: BlockTreeNode) -> None:
+        """Reorganizes the main chain to end with the tip, O(reorg depth)."""
+        branch = []
+        node = tip
+        while self._chain.height_of(node.block.hash) != node.height:
+            branch.append(node.block)
+            node = self._tree_node(node.block.previous_hash)
+            if node is None:
+                break
 
-        return False
+        fork_height = node.height + 1 if node is not None else 0
+        while len(self._chain) > fork_height:
+            self._remove_last_block()
+            self.replaced_blocks += 1
+        for block in reversed(branch):
+            self._append_block(block)
+
+    def _add_orphan(self, block: Block) -> None:
+        self.orphaned_blocks += 1
+        self._orphans[block.hash] = block
+        self._orphans_by_parent.setdefault(block.previous_hash, []).append(block.hash)
+        while len(self._orphans) > MAX_ORPHAN_BLOCKS:
+            _, dropped = self._orphans.popitem(last=False)
+            siblings = self._orphans_by_parent[dropped.previous_hash]
+            siblings.remove(dropped.hash)
+            if not siblings:
+                del self._orphans_by_parent[dropped.previous_hash]
+
+    def _connect_orphans_of(self, block: Block, best: BlockTreeNode) -> BlockTreeNode:
+        """
+        Moves orphan descendants of the block to the tree and returns the
+        node with the most work among them and `best`.
+        """
+        parents = [block.hash]
+        while parents:
+            for orphan_hash in self._orphans_by_parent.pop(parents.pop(), []):
+                orphan = self._orphans.pop(orphan_hash)
+                parent = self._tree_node(orphan.previous_hash)
+                if not self._follows(orphan, parent):
+                    continue
+                node = self._connect(orphan, parent)
+                if self._has_more_work(node, best):
+                    best = node
+                parents.append(orphan.hash)
+        return best
+
+    def is_in_tree(self, block_hash: str) -> bool:
+        return self._is_known(block_hash)
+
+    def is_orphan(self, block_hash: str) -> bool:
+        return block_hash in self._orphans
+
+    def orphan_count(self) -> int:
+        return len(self._orphans)
+
+    def get_snapshot(self) -> ChainSnapshot:
+        return self._snapshot
 
     def get_chain(self) -> Blockchain:
-        return Blockchain(chain=self.chain)
+        return Blockchain(chain=list(self._snapshot))
 
     def set_chain(self, blockchain: Blockchain) -> None:
+        """
+        Replaces the chain, keeping the blocks of the common prefix so that
+        only the divergent suffix is re-indexed.
+        """
+        self.replace_suffix(0, blockchain.chain)
+
+    def replace_suffix(self, start: int, blocks: list[Block]) -> bool:
+        """
+        Replaces the blocks from height `start` on with `blocks`, keeping
+        those equal to blocks of the chain, without reading the chain
+        before `start`. Returns False and leaves the chain as is if the
+        blocks do not link to the block before `start`.
+        """
         with self._lock:
-            self.chain = blockchain.chain
+            if start > len(self._chain) or (
+                start
+                and blocks
+                and blocks[0].previous_hash != self._chain[start - 1].hash
+            ):
+                return False
+
+            fork_position = start + self._common_prefix_length(blocks, start)
+            while len(self._chain) > fork_position:
+                self._remove_last_block()
+            new_blocks = blocks[fork_position - start :]
+            for block in new_blocks:
+                self._append_block(block)
+
+            tip = best = self._tree_node(self._chain[-1].hash)
+            if self._orphans:
+                for block in new_blocks:
+                    best = self._connect_orphans_of(block, best)
+            if best is not tip:
+                self._switch_to(best)
+            self._publish()
+            return True
+
+    def _common_prefix_length(self, chain: list[Block], start: int = 0) -> int:
+        """Number of leading blocks equal to the blocks from `start` on."""
+        length = 0
+        for block, local_block in zip(chain, self._chain.blocks(start)):
+            if not _is_same_block(start + length, block, local_block):
+                break
+            length += 1
+        return length
+
+    def known_prefix_length(self, chain: list[Block], start: int = 0) -> int:
+        """
+        Returns the number of leading blocks of the chain, placed at height
+        `start`, known to be valid. These are the blocks equal to the blocks
+        of the main chain at the same heights, which are replaced by the
+        local objects, followed by blocks equal to blocks verified before,
+        each linked to the previous one. A matching hash alone is never
+        trusted.
+        """
+        snapshot = self._snapshot
+        if start > len(snapshot):
+            return 0
+        length = 0
+        for block, local_block in zip(chain, snapshot.blocks(start)):
+            if not _is_same_block(start + length, block, local_block):
+                break
+            chain[length] = local_block
+            length += 1
+
+        with self._verified_lock:
+            while length < len(chain):
+                block = chain[length]
+                height = start + length
+                key = (block.hash, height)
+                verified_block = self._verified_blocks.get(key)
+                if length:
+                    previous_hash = chain[length - 1].hash
+                else:
+                    previous_hash = snapshot[start - 1].hash if start else "0"
+                if (
+                    verified_block is None
+                    or (verified_block is not block and verified_block != block)
+                    or block.index != height
+                    or block.previous_hash != previous_hash
+                ):
+                    break
+                self._verified_blocks.move_to_end(key)
+                length += 1
+
+        return length
+
+    def mark_verified(self, blocks: list[Block]) -> None:
+        with self._verified_lock:
+            for block in blocks:
+                self._verified_blocks[(block.hash, block.index)] = block
+                self._verified_blocks.move_to_end((block.hash, block.index))
+
+            while len(self._verified_blocks) > VERIFIED_BLOCKS_CACHE_SIZE:
+                self._verified_blocks.popitem(last=False)
 
     def get_last_block(self) -> Block:
-        if not self.chain:
+        snapshot = self._snapshot
+        if not snapshot:
             return
 
-        return self.chain[-1]
+        return snapshot[-1]
+
+    def get_block_by_hash(self, block_hash: str) -> Block | None:
+        """The block of the current snapshot with this hash, if any."""
+        snapshot = self._snapshot
+        height = snapshot.height_of(block_hash)
+        return snapshot[height] if height is not None else None
+
+    def get_block_by_height(self, height: int) -> Block | None:
+        snapshot = self._snapshot
+        if 0 <= height < len(snapshot):
+            return snapshot[height]
+        return None
+
+    def _record_match(self, entry: RecordEntry) -> RecordMatch:
+        _, height, position = entry
+        block = self._chain[height]
+        return RecordMatch(
+            record=block.records[position],
+            block_index=block.index,
+            block_hash=block.hash,
+            position=position,
+        )
+
+    def find_records(
+        self,
+        text: str | None = None,
+        since: int | None = None,
+        until: int | None = None,
+        limit: int | None = None,
+    ) -> list[RecordMatch]:
+        """
+        Records of the main chain containing all words of `text` with their
+        timestamp in [since, until], oldest first. The lock is held only
+        for the index lookup, which does not scan the chain.
+        """
+        records = self._indexed_records()
+        with self._lock:
+            return [
+                self._record_match(entry)
+                for entry in records.find(text, since, until, limit)
+            ]
+
+    def locate_records(self, content: str) -> list[RecordMatch]:
+        """Records of the main chain with exactly this content, in chain order."""
+        records = self._indexed_records()
+        with self._lock:
+            return [self._record_match(entry) for entry in records.locate(content)]
+
+    def sample_side_links(self, n: int) -> list[str]:
+        """
+        Returns hashes of up to n random blocks of the chain, excluding
+        the last block, without copying the chain.
+        """
+        chain = self.chain
+        candidates = len(chain) - 1
+        if candidates <= n:
+            return [block.hash for block in chain[:candidates]]
+
+        # Drawing positions until n are distinct is cheaper than
+        # `random.sample` when n is much smaller than the chain
+        positions: dict[int, None] = {}
+        while len(positions) < n:
+            positions[random.randrange(candidates)] = None
+        return [chain[position].hash for position in positions]
 
 
 class PendingBlocksRepository(metaclass=Singleton):
-    def __init__(self):
-        self.pending_blocks = []
+    """Bounded FIFO queue of blocks waiting to be mined."""
+
+    def __init__(
+        self,
+        maxsize: int = MAX_PENDING_BLOCKS,
+        full_policy: str = PENDING_BLOCKS_FULL_POLICY,
+    ):
+        self.pending_blocks: deque[PendingBlock] = deque()
+        self.maxsize = maxsize
+        self.full_policy = full_policy
         self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._depth = MetricsRegistry().gauge(
+            "pending_blocks", "Blocks waiting to be mined"
+        )
 
     def pending_blocks_count(self) -> int:
         return len(self.pending_blocks)
 
-    def add(self, block: PendingBlock) -> None:
-        with self._lock:
+    def _has_free_slot(self) -> bool:
+        return len(self.pending_blocks) < self.maxsize
+
+    def add(self, block: PendingBlock, timeout: float | None = None) -> None:
+        with self._not_full:
+            if not self._has_free_slot():
+                if self.full_policy == "reject" or not self._not_full.wait_for(
+                    self._has_free_slot, timeout
+                ):
+                    raise PendingBlocksFullException()
+
             self.pending_blocks.append(block)
+            self._depth.set(len(self.pending_blocks))
+            self._not_empty.notify()
 
-    def pop(self) -> PendingBlock:
-        """First in first out"""
-        if not self.pending_blocks:
-            return
+    def get(self, timeout: float | None = None) -> PendingBlock | None:
+        """
+        First in first out. Waits up to `timeout` seconds for a block,
+        forever if it is None, and returns None if nothing arrived.
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self.pending_blocks, timeout):
+                return
 
+            popped_block = self.pending_blocks.popleft()
+            self._depth.set(len(self.pending_blocks))
+            self._not_full.notify()
+
+        return popped_block
+
+    def pop(self) -> PendingBlock | None:
+        return self.get(timeout=0)
+
+    def clear(self) -> None:
         with self._lock:
-            if len(self.pending_blocks) == 1:
-                popped_block = self.pending_blocks[0]
-                self.pending_blocks = []
-                return popped_block
+            self.pending_blocks.clear()
+            self._depth.set(0)
+            self._not_full.notify_all()
 
-            temp = deepcopy(self.pending_blocks[1:])
-            popped_block = self.pending_blocks[0]
-            self.pending_blocks = temp
 
-        return popped_block
+class SyncSessionException(Exception):
+    pass
+
+
+class SyncRepository(metaclass=Singleton):
+    """Identity of the node and state of its sync with a single peer."""
+
+    def __init__(self):
+        self.node_id = uuid.uuid4().hex
+        self.peer_node_id: str | None = None
+        self.start: int | None = None
+        self.blocks: list[Block] = []
+        self._started_at = 0.0
+        self._sync_requested_at: float | None = None
+        self._lock = threading.Lock()
+
+    def should_request_sync(self) -> bool:
+        """
+        Returns True, at most once per `SYNC_REQUEST_INTERVAL`, if no sync
+        is in progress.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self.peer_node_id is not None
+                and now - self._started_at < SYNC_SESSION_TIMEOUT
+            ) or (
+                self._sync_requested_at is not None
+                and now - self._sync_requested_at < SYNC_REQUEST_INTERVAL
+            ):
+                return False
+            self._sync_requested_at = now
+            return True
+
+    def start_session(self, peer_node_id: str) -> bool:
+        """Returns False if a sync with another peer is still in progress."""
+        with self._lock:
+            if (
+                self.peer_node_id is not None
+                and time.monotonic() - self._started_at < SYNC_SESSION_TIMEOUT
+            ):
+                return False
+
+            self.peer_node_id = peer_node_id
+            self.start = None
+            self.blocks = []
+            self._started_at = time.monotonic()
+            return True
+
+    def add_page(self, page: SyncBlocks) -> None:
+        with self._lock:
+            if page.node_id != self.peer_node_id:
+                raise SyncSessionException(f"No sync session with {page.node_id}")
+
+            if self.start is None:
+                self.start = page.start
+            elif page.start != self.start + len(self.blocks):
+                self.peer_node_id = None
+                raise SyncSessionException(f"Unexpected sync page at {page.start}")
+
+            self.blocks.extend(page.blocks)
+            self._started_at = time.monotonic()
+
+    def finish_session(self) -> tuple[int, list[Block]]:
+        with self._lock:
+            start, blocks = self.start, self.blocks
+            self.peer_node_id = None
+            self.start = None
+            self.blocks = []
+            return start, blocks
@@ -1,14 +1,37 @@
 import time
+import urllib.request
+import uuid
 
 import typer
 
-from blockchain_system.blockchain import Record
+from blockchain_system import benchmarks, metrics, services, simulator, transports
+from blockchain_system.blockchain import (
+    Record,
+    RecordProofRequest,
+    RecordQuery,
+    ShowChainRequest,
+)
 from blockchain_system.publisher import Publisher
-from blockchain_system.subscriber import CliSubscriber
+from blockchain_system.subscriber import (
+    FIND_RECORDS_TIMEOUT,
+    SHOW_CHAIN_TIMEOUT,
+    ChainPageSubscriber,
+    CliSubscriber,
+    RecordQuerySubscriber,
+)
 
 app = typer.Typer()
 
 
+@app.callback()
+def main(
+    transport: str = typer.Option(
+        transports.TRANSPORT, help="One of amqp, memory and socket"
+    )
+):
+    transports.TRANSPORT = transport
+
+
 @app.command()
 def listen_events():
     subscriber = CliSubscriber()
@@ -23,9 +46,150 @@ def add_record(content: str):
 
 
 @app.command()
-def show_chain():
+def show_chain(
+    start: int = 0,
+    stop: int = typer.Option(None, help="Height after the last block shown"),
+    page_size: int = services.SHOW_CHAIN_PAGE_SIZE,
+    timeout: float = typer.Option(
+        SHOW_CHAIN_TIMEOUT, help="Seconds to wait for the next page"
+    ),
+):
+    """Prints the blocks at heights [start, stop) as the pages arrive."""
+    request = ShowChainRequest(
+        request_id=uuid.uuid4().hex, start=start, stop=stop, page_size=page_size
+    )
+    # Subscribed before asking, so no page is missed
+    subscriber = ChainPageSubscriber(
+        request.request_id, render=typer.echo, timeout=timeout
+    )
+    publisher = Publisher()
+    publisher.notify_show_chain(request)
+    if not subscriber.start_consuming():
+        typer.echo("Timed out waiting for the chain", err=True)
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def find_record(
+    text: str = typer.Argument(None, help="Words the record must contain"),
+    since: int = typer.Option(None, help="Earliest record timestamp"),
+    until: int = typer.Option(None, help="Latest record timestamp"),
+    limit: int = services.FIND_RECORDS_LIMIT,
+    timeout: float = FIND_RECORDS_TIMEOUT,
+):
+    """Prints committed records matching the query with their blocks."""
+    query = RecordQuery(
+        request_id=uuid.uuid4().hex, text=text, since=since, until=until, limit=limit
+    )
+    # Subscribed before asking, so the result is not missed
+    subscriber = RecordQuerySubscriber(query.request_id, timeout=timeout)
     publisher = Publisher()
-    publisher.notify_show_chain()
+    publisher.notify_find_records(query)
+    result = subscriber.wait()
+    if result is None:
+        typer.echo("Timed out waiting for the records", err=True)
+        raise typer.Exit(code=1)
+    for match in result.matches:
+        typer.echo(
+            f"block {match.block_index} {match.block_hash} #{match.position}: "
+            f"{match.record.timestamp} {match.record.content}"
+        )
+
+
+@app.command()
+def prove_record(
+    content: str,
+    timestamp: int = typer.Option(None, help="Timestamp of the record"),
+):
+    """Asks the nodes for an inclusion proof, shown by listen-events."""
+    publisher = Publisher()
+    publisher.notify_prove_record(
+        RecordProofRequest(content=content, timestamp=timestamp)
+    )
+
+
+@app.command()
+def stats(
+    url: str = metrics.METRICS_URL,
+    match: str = typer.Option(None, help="Only show metrics with this in the name"),
+):
+    """Prints the metrics of a running node."""
+    with urllib.request.urlopen(url, timeout=5) as response:
+        text = response.read().decode()
+    for line in text.splitlines():
+        if match is None or (match in line and not line.startswith("#")):
+            typer.echo(line)
+
+
+@app.command()
+def profile(seconds: float = 5, url: str = metrics.METRICS_URL):
+    """Prints hot stacks of the miner and consumer threads of a running node."""
+    profile_url = url.rsplit("/", 1)[0] + f"/profile?seconds={seconds}"
+    with urllib.request.urlopen(profile_url, timeout=seconds + 5) as response:
+        typer.echo(response.read().decode(), nl=False)
+
+
+@app.command()
+def simulate(
+    output: str,
+    nodes: int = simulator.SIMULATION_NODES,
+    records: int = simulator.SIMULATION_RECORDS,
+    rate: float = simulator.SIMULATION_RATE,
+    difficulty: int = simulator.SIMULATION_DIFFICULTY,
+    transport: str = "memory",
+    timeout: float = simulator.SIMULATION_TIMEOUT,
+):
+    """Runs a cluster in this process and writes its results as JSON."""
+    result = simulator.run_simulation(
+        nodes=nodes,
+        records=records,
+        rate=rate,
+        difficulty=difficulty,
+        transport=transport,
+        timeout=timeout,
+    )
+    simulator.write_results(result, output)
+    typer.echo(
+        f"{result.records_committed}/{result.records_sent} records committed, "
+        f"{result.records_per_second:.1f} records/s"
+    )
+
+
+@app.command()
+def benchmark(
+    full: bool = typer.Option(False, help="Include chains of a million blocks"),
+    only: str = typer.Option(None, help="Run benchmarks with this in the name"),
+    threshold: float = benchmarks.BENCHMARK_THRESHOLD,
+    baselines: str = benchmarks.BENCHMARK_BASELINES,
+    update_baselines: bool = False,
+):
+    """Runs the microbenchmarks and fails on regressions against baselines."""
+    stored_baselines = benchmarks.load_baselines(baselines)
+
+    def report(name: str, value: float):
+        baseline = stored_baselines.get(name)
+        change = f"{value / baseline - 1:+.1%}" if baseline else "no baseline"
+        unit = "B/block" if name.endswith("_bytes") else "s/op"
+        typer.echo(f"{name:40} {value:12.3e} {unit:7}  {change}")
+
+    results = benchmarks.run_benchmarks(full=full, only=only, report=report)
+    if update_baselines:
+        benchmarks.save_baselines(results, baselines)
+        return
+
+    regressions = benchmarks.find_regressions(results, stored_baselines, threshold)
+    for name, slowdown in regressions.items():
+        typer.echo(f"Regression: {name} is {slowdown:.1%} slower", err=True)
+    if regressions:
+        raise typer.Exit(code=1)
+
+
+@app.command()
+def run_bus(address: str = transports.SOCKET_BUS_ADDRESS):
+    """Runs the hub of the socket transport."""
+    from blockchain_system.transports.socket_bus import SocketBusServer
+
+    SocketBusServer(address).serve_forever()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,283 @@
+"""
+Wire formats of the messages exchanged between nodes.
+
+The binary format is a version byte and a type tag followed by the fields
+of the message in declaration order. Integers are zigzag varints, strings
+and lists are length-prefixed, and hashes made of 256 binary digits are
+sent as 32 raw bytes. JSON is kept as a readable debug format.
+"""
+import dataclasses
+import json
+import types
+import typing
+
+from blockchain_system.blockchain import (
+    Block,
+    Blockchain,
+    BlockId,
+    ChainPage,
+    ChainTip,
+    PendingBlock,
+    Record,
+    RecordProof,
+    RecordProofRequest,
+    RecordQuery,
+    RecordQueryResult,
+    ShowChainRequest,
+    SyncBlocks,
+    SyncRequest,
+)
+
+BINARY_FORMAT_VERSION = 2
+
+# Tags are part of the wire format, new types must get new tags
+MESSAGE_TYPES: dict[int, type] = {
+    1: Record,
+    2: Block,
+    3: PendingBlock,
+    4: Blockchain,
+    5: BlockId,
+    6: ChainTip,
+    7: SyncRequest,
+    8: SyncBlocks,
+    9: RecordProof,
+    10: RecordProofRequest,
+    11: ShowChainRequest,
+    12: ChainPage,
+    13: RecordQuery,
+    14: RecordQueryResult,
+}
+NONE_TAG = 0
+
+_STRING = 0
+_HASH = 1
+_HASH_LENGTH = 256
+
+
+class CodecException(Exception):
+    pass
+
+
+def pack_hash(value: str) -> bytes | None:
+    """Returns 32 raw bytes for a hash of 256 binary digits, None otherwise."""
+    if len(value) != _HASH_LENGTH or value.strip("01"):
+        return None
+    return int(value, 2).to_bytes(32, "big")
+
+
+def unpack_hash(value: bytes) -> str:
+    return bin(int.from_bytes(value, "big"))[2:].zfill(_HASH_LENGTH)
+
+
+def _write_varint(value: int, out: bytearray) -> None:
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, position: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def _encode_int(value, out):
+    # Zigzag, so small negative numbers stay short
+    _write_varint(value << 1 if value >= 0 else (-value << 1) - 1, out)
+
+
+def _decode_int(data, position):
+    value, position = _read_varint(data, position)
+    return (value >> 1) ^ -(value & 1), position
+
+
+def _encode_bool(value, out):
+    out.append(1 if value else 0)
+
+
+def _decode_bool(data, position):
+    return data[position] == 1, position + 1
+
+
+def _encode_str(value, out):
+    packed_hash = pack_hash(value)
+    if packed_hash is not None:
+        out.append(_HASH)
+        out += packed_hash
+        return
+
+    encoded = value.encode()
+    out.append(_STRING)
+    _write_varint(len(encoded), out)
+    out += encoded
+
+
+def _decode_str(data, position):
+    kind = data[position]
+    position += 1
+    if kind == _HASH:
+        return unpack_hash(data[position : position + 32]), position + 32
+
+    length, position = _read_varint(data, position)
+    end = position + length
+    return bytes(data[position:end]).decode(), end
+
+
+def _optional(encoder, decoder):
+    def encode(value, out):
+        if value is None:
+            out.append(0)
+            return
+        out.append(1)
+        encoder(value, out)
+
+    def decode(data, position):
+        if data[position] == 0:
+            return None, position + 1
+        return decoder(data, position + 1)
+
+    return encode, decode
+
+
+def _list_of(encoder, decoder):
+    def encode(value, out):
+        _write_varint(len(value), out)
+        for item in value:
+            encoder(item, out)
+
+    def decode(data, position):
+        length, position = _read_varint(data, position)
+        items = []
+        for _ in range(length):
+            item, position = decoder(data, position)
+            items.append(item)
+        return items, position
+
+    return encode, decode
+
+
+def _encode_tagged(value, out):
+    if value is None:
+        out.append(NONE_TAG)
+        return
+    tag = _TAGS.get(type(value))
+    if tag is None:
+        raise CodecException(f"Unsupported message type {type(value).__name__}")
+    out.append(tag)
+    _field_codec(type(value))[0](value, out)
+
+
+def _decode_tagged(data, position):
+    tag = data[position]
+    if tag == NONE_TAG:
+        return None, position + 1
+    if tag not in MESSAGE_TYPES:
+        raise CodecException(f"Unknown message type tag {tag}")
+    return _field_codec(MESSAGE_TYPES[tag])[1](data, position + 1)
+
+
+def _dataclass_codec(cls):
+    hints = typing.get_type_hints(cls)
+    fields = [
+        (field.name, _field_codec(hints[field.name]))
+        for field in dataclasses.fields(cls)
+    ]
+
+    def encode(value, out):
+        for name, (encoder, _) in fields:
+            encoder(getattr(value, name), out)
+
+    def decode(data, position):
+        values = {}
+        for name, (_, decoder) in fields:
+            values[name], position = decoder(data, position)
+        return cls(**values), position
+
+    return encode, decode
+
+
+_SCALAR_CODECS = {
+    int: (_encode_int, _decode_int),
+    bool: (_encode_bool, _decode_bool),
+    str: (_encode_str, _decode_str),
+}
+_codecs: dict = {}
+
+
+def _field_codec(tp):
+    if tp in _codecs:
+        return _codecs[tp]
+
+    origin = typing.get_origin(tp)
+    args = typing.get_args(tp)
+    if tp in _SCALAR_CODECS:
+        codec = _SCALAR_CODECS[tp]
+    elif origin in (types.UnionType, typing.Union) and type(None) in args:
+        (inner,) = [arg for arg in args if arg is not type(None)]
+        codec = _optional(*_field_codec(inner))
+    elif origin is list:
+        codec = _list_of(*_field_codec(args[0]))
+    elif dataclasses.is_dataclass(tp):
+        codec = _dataclass_codec(tp)
+    else:
+        raise CodecException(f"Unsupported field type {tp}")
+
+    _codecs[tp] = codec
+    return codec
+
+
+_TAGS = {cls: tag for tag, cls in MESSAGE_TYPES.items()}
+
+
+class BinaryCodec:
+    def encode(self, message) -> bytes:
+        out = bytearray([BINARY_FORMAT_VERSION])
+        _encode_tagged(message, out)
+        return bytes(out)
+
+    def decode(self, body: bytes):
+        if body[0] != BINARY_FORMAT_VERSION:
+            raise CodecException(f"Unsupported binary format version {body[0]}")
+        message, _ = _decode_tagged(memoryview(body), 1)
+        return message
+
+
+class JsonCodec:
+    def encode(self, message) -> bytes:
+        if message is None:
+            return json.dumps(None).encode()
+        return json.dumps(
+            {"type": type(message).__name__, "payload": message.to_dict()}
+        ).encode()
+
+    def decode(self, body: bytes):
+        envelope = json.loads(body)
+        if envelope is None:
+            return None
+        cls = _TYPES_BY_NAME.get(envelope["type"])
+        if cls is None:
+            raise CodecException(f"Unknown message type {envelope['type']}")
+        return cls.from_dict(envelope["payload"])
+
+
+_TYPES_BY_NAME = {cls.__name__: cls for cls in MESSAGE_TYPES.values()}
+
+CODECS = {"binary": BinaryCodec(), "json": JsonCodec()}
+
+
+def get_codec(wire_format: str):
+    return CODECS[wire_format]
+
+
+def decode_message(body: bytes):
+    """Decodes a message in any of the wire formats."""
+    if body and body[0] == BINARY_FORMAT_VERSION:
+        return CODECS["binary"].decode(body)
+    return CODECS["json"].decode(body)
@@ -0,0 +1,166 @@
+"""
+Compact storage of long chains.
+
+`CompactChain` keeps blocks in columns of machine integers instead of an
+object per block, record and hash. Hashes are interned in a `HashTable`,
+which stores hashes of 256 binary digits as 32 raw bytes, so previous
+hashes and side links are ids of hashes stored once. Blocks are rebuilt
+on access and convert losslessly to and from the JSON form of
+`Blockchain`.
+"""
+import json
+from array import array
+from typing import Iterable, Iterator
+
+from blockchain_system.blockchain import Block, Blockchain, Record
+from blockchain_system.codec import pack_hash, unpack_hash
+
+# Id standing for a missing hash
+NO_HASH = -1
+
+
+class HashTable:
+    """Interns hashes, their ids are positions in the table."""
+
+    def __init__(self):
+        # Raw bytes of hashes, other strings like the genesis hash as is
+        self._hashes: list[bytes | str] = []
+        self._ids: dict[bytes | str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def intern(self, value: str | None) -> int:
+        if value is None:
+            return NO_HASH
+        key = pack_hash(value) or value
+        hash_id = self._ids.get(key)
+        if hash_id is None:
+            hash_id = len(self._hashes)
+            self._hashes.append(key)
+            self._ids[key] = hash_id
+        return hash_id
+
+    def lookup(self, hash_id: int) -> str | None:
+        if hash_id == NO_HASH:
+            return None
+        key = self._hashes[hash_id]
+        return unpack_hash(key) if isinstance(key, bytes) else key
+
+
+class CompactChain:
+    """
+    A chain stored column-wise. Side links and records of all blocks are
+    kept in flat columns, with offsets marking where each block starts.
+    Truncated blocks leave their hashes in the table.
+    """
+
+    def __init__(self, blocks: Iterable[Block] = ()):
+        self.hashes = HashTable()
+        self._indices = array("q")
+        self._timestamps = array("q")
+        self._nonces = array("q")
+        self._hash_ids = array("q")
+        self._previous_hash_ids = array("q")
+        self._merkle_root_ids = array("q")
+        self._side_links = array("q")
+        self._side_link_offsets = array("q", [0])
+        self._record_indices = array("q")
+        self._record_timestamps = array("q")
+        self._record_contents: list[str] = []
+        self._record_offsets = array("q", [0])
+        for block in blocks:
+            self.append(block)
+
+    def __len__(self) -> int:
+        return len(self._indices)
+
+    def __iter__(self) -> Iterator[Block]:
+        for position in range(len(self)):
+            yield self.block(position)
+
+    def __getitem__(self, position: int) -> Block:
+        return self.block(position)
+
+    def append(self, block: Block) -> None:
+        intern = self.hashes.intern
+        self._indices.append(block.index)
+        self._timestamps.append(block.timestamp)
+        self._nonces.append(block.nonce)
+        self._hash_ids.append(intern(block.hash))
+        self._previous_hash_ids.append(intern(block.previous_hash))
+        self._merkle_root_ids.append(intern(block.merkle_root))
+        self._side_links.extend(intern(side_link) for side_link in block.side_links)
+        self._side_link_offsets.append(len(self._side_links))
+        for record in block.records:
+            self._record_indices.append(record.index)
+            self._record_timestamps.append(record.timestamp)
+            self._record_contents.append(record.content)
+        self._record_offsets.append(len(self._record_contents))
+
+    def block(self, position: int) -> Block:
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("Block position out of range")
+
+        lookup = self.hashes.lookup
+        side_links = self._side_links[
+            self._side_link_offsets[position] : self._side_link_offsets[position + 1]
+        ]
+        records = range(
+            self._record_offsets[position], self._record_offsets[position + 1]
+        )
+        return Block(
+            index=self._indices[position],
+            previous_hash=lookup(self._previous_hash_ids[position]),
+            side_links=[lookup(hash_id) for hash_id in side_links],
+            timestamp=self._timestamps[position],
+            records=[
+                Record(
+                    index=self._record_indices[i],
+                    timestamp=self._record_timestamps[i],
+                    content=self._record_contents[i],
+                )
+                for i in records
+            ],
+            hash=lookup(self._hash_ids[position]),
+            nonce=self._nonces[position],
+            merkle_root=lookup(self._merkle_root_ids[position]),
+        )
+
+    def truncate(self, length: int) -> None:
+        """Drops the blocks after the first `length` blocks."""
+        if length >= len(self):
+            return
+        for column in (
+            self._indices,
+            self._timestamps,
+            self._nonces,
+            self._hash_ids,
+            self._previous_hash_ids,
+            self._merkle_root_ids,
+        ):
+            del column[length:]
+        del self._side_links[self._side_link_offsets[length] :]
+        del self._side_link_offsets[length + 1 :]
+        records_end = self._record_offsets[length]
+        del self._record_indices[records_end:]
+        del self._record_timestamps[records_end:]
+        del self._record_contents[records_end:]
+        del self._record_offsets[length + 1 :]
+
+    def to_blockchain(self) -> Blockchain:
+        return Blockchain(chain=list(self))
+
+    @classmethod
+    def from_blockchain(cls, blockchain: Blockchain) -> "CompactChain":
+        return cls(blockchain.chain)
+
+    def to_json(self) -> str:
+        return self.to_blockchain().to_json()
+
+    @classmethod
+    def from_json(cls, string: str) -> "CompactChain":
+        """Decodes the JSON form of `Blockchain` one block at a time."""
+        return cls(Block.from_dict(block) for block in json.loads(string)["chain"])
@@ -0,0 +1,200 @@
+"""
+Runtime metrics of a node.
+
+Counters, gauges and histograms live in a registry per node and are
+served in the Prometheus text format by `MetricsServer`, which the app
+starts when `METRICS_PORT` is set. The server also profiles the node on
+demand at `/profile?seconds=N`.
+"""
+import bisect
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from blockchain_system import tracing
+from blockchain_system.node import Singleton
+
+METRICS_HOST = "127.0.0.1"
+# Port of the HTTP endpoint, None disables it
+METRICS_PORT: int | None = None
+# Endpoint read by the `stats` command
+METRICS_URL = "http://127.0.0.1:9100/metrics"
+
+# Seconds, from a microsecond to a minute
+LATENCY_BUCKETS = (
+    0.000_001,
+    0.000_01,
+    0.000_1,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1,
+    5,
+    10,
+    60,
+)
+HASHRATE_BUCKETS = (10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labels: str):
+        yield f"{name}{{{labels}}}" if labels else name, self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def samples(self, name: str, labels: str):
+        yield f"{name}{{{labels}}}" if labels else name, self.value
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self, name: str, labels: str):
+        prefix = f"{labels}," if labels else ""
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else repr(float(bound))
+            yield f'{name}_bucket{{{prefix}le="{le}"}}', cumulative
+        suffix = f"{{{labels}}}" if labels else ""
+        yield f"{name}_sum{suffix}", self.sum
+        yield f"{name}_count{suffix}", self.count
+
+
+class MetricsRegistry(metaclass=Singleton):
+    def __init__(self):
+        # Name to type, help and metrics by their labels
+        self._families: dict[str, tuple[str, str, dict]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, name: str, help: str, labels: dict, factory):
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        if family is None or key not in family[2]:
+            with self._lock:
+                family = self._families.setdefault(name, (kind, help, {}))
+                family[2].setdefault(key, factory())
+        return family[2][key]
+
+    def counter(self, name: str, help: str = "", **labels) -> Counter:
+        return self._get("counter", name, help, labels, Counter)
+
+    def gauge(self, name: str, help: str = "", **labels) -> Gauge:
+        return self._get("gauge", name, help, labels, Gauge)
+
+    def histogram(
+        self, name: str, help: str = "", buckets: tuple = LATENCY_BUCKETS, **labels
+    ) -> Histogram:
+        return self._get("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            families = sorted(
+                (name, kind, help, dict(metrics))
+                for name, (kind, help, metrics) in self._families.items()
+            )
+        for name, kind, help, metrics in families:
+            if help:
+                lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, metric in sorted(metrics.items()):
+                labels = ",".join(f'{label}="{value}"' for label, value in key)
+                for sample, value in metric.samples(name, labels):
+                    lines.append(f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class TimedLock:
+    """A lock recording in a histogram how long acquiring it waited."""
+
+    def __init__(self, wait_histogram: Histogram):
+        self._lock = threading.Lock()
+        self._wait_histogram = wait_histogram
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        self._wait_histogram.observe(time.perf_counter() - start)
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class MetricsServer:
+    def __init__(self, registry: MetricsRegistry, host: str, port: int):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path in ("/", "/metrics"):
+                    body = registry.render().encode()
+                elif url.path == "/profile":
+                    seconds = float(parse_qs(url.query).get("seconds", ["5"])[0])
+                    body = tracing.profile(seconds).encode()
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def serve_forever(self) -> None:
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
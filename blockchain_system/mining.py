@@ -0,0 +1,136 @@
+import multiprocessing
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable
+
+from blockchain_system.blockchain import BlockHasher
+
+# How often the coordinating thread checks whether the search should abort
+ABORT_CHECK_INTERVAL = 0.005
+
+_stop_event = None
+
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _search_nonce_ranges(
+    prefix: bytes,
+    suffix: bytes,
+    target: int,
+    first_range: int,
+    step: int,
+    chunk_size: int,
+) -> tuple[int | None, int]:
+    """
+    Searches nonce ranges first_range, first_range + step, ... of chunk_size
+    nonces each, until a valid nonce is found or another worker succeeds.
+    Returns the nonce and the number of hashes computed.
+    """
+    hasher = BlockHasher(prefix, suffix)
+    range_number = first_range
+    hashes = 0
+
+    while not _stop_event.is_set():
+        start = range_number * chunk_size
+        nonce = hasher.search(start, start + chunk_size, target)
+        if nonce is not None:
+            return nonce, hashes + nonce - start + 1
+        hashes += chunk_size
+        range_number += step
+
+    return None, hashes
+
+
+class ParallelMiner:
+    """
+    Splits the nonce space into ranges across a pool of worker processes.
+    The pool lives for the whole node, so processes are only started once.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        context = multiprocessing.get_context("spawn")
+        self._stop_event = context.Event()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._stop_event,),
+        )
+        self._lock = threading.Lock()
+
+    def search(
+        self,
+        hasher: BlockHasher,
+        target: int,
+        chunk_size: int,
+        should_abort: Callable[[], bool] | None = None,
+    ) -> tuple[int | None, int]:
+        """
+        Returns the first valid nonce found, None if the search was aborted,
+        and the number of hashes computed by all workers.
+        """
+        with self._lock:
+            self._stop_event.clear()
+            futures = [
+                self._executor.submit(
+                    _search_nonce_ranges,
+                    hasher.prefix,
+                    hasher.suffix,
+                    target,
+                    worker,
+                    self.workers,
+                    chunk_size,
+                )
+                for worker in range(self.workers)
+            ]
+
+            nonce = None
+            pending = set(futures)
+            try:
+                while pending and nonce is None:
+                    done, pending = wait(
+                        pending,
+                        timeout=ABORT_CHECK_INTERVAL,
+                        return_when=FIRST_COMPLETED,
+                    )
+                    results = [future.result()[0] for future in done]
+                    nonce = next(
+                        (result for result in results if result is not None), None
+                    )
+                    if nonce is None and should_abort and should_abort():
+                        break
+            finally:
+                # Stop the remaining workers before the next search reuses them
+                self._stop_event.set()
+                wait(futures)
+
+            # Every worker reports the hashes it computed, also when stopped
+            return nonce, sum(future.result()[1] for future in futures)
+
+    def shutdown(self):
+        self._stop_event.set()
+        self._executor.shutdown(cancel_futures=True)
+
+
+_miners: dict[int, ParallelMiner] = {}
+_miners_lock = threading.Lock()
+
+
+def get_parallel_miner(workers: int) -> ParallelMiner:
+    with _miners_lock:
+        if workers not in _miners:
+            _miners[workers] = ParallelMiner(workers)
+        return _miners[workers]
+
+
+def shutdown_parallel_miners() -> None:
+    """Stops the worker processes, the next search starts a new pool."""
+    with _miners_lock:
+        miners = list(_miners.values())
+        _miners.clear()
+    for miner in miners:
+        miner.shutdown()
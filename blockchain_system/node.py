@@ -0,0 +1,75 @@
+"""
+Node context of the running code.
+
+Repositories, the publisher and other per-node state are singletons per
+node, so several nodes can run in one process. The current node is a
+context variable, threads started with `start_thread` and callbacks wrapped
+with `bind_node_context` keep the node of the code that created them.
+"""
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable
+
+_current_node: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_node", default=""
+)
+
+
+def current_node() -> str:
+    return _current_node.get()
+
+
+@contextmanager
+def node_context(name: str):
+    token = _current_node.set(name)
+    try:
+        yield name
+    finally:
+        _current_node.reset(token)
+
+
+def bind_node_context(function: Callable) -> Callable:
+    """Returns a callable running `function` in the current node context."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+
+def start_thread(
+    target: Callable, *args, daemon: bool = False, name: str | None = None
+) -> threading.Thread:
+    if name and current_node():
+        name = f"{current_node()}:{name}"
+    thread = threading.Thread(
+        target=bind_node_context(target), args=args, daemon=daemon, name=name
+    )
+    thread.start()
+    return thread
+
+
+class Singleton(type):
+    _instances = {}
+
+    def __call__(cls, *args, **kwargs):
+        key = (cls, current_node())
+        if key not in cls._instances:
+            cls._instances[key] = super(Singleton, cls).__call__(*args, **kwargs)
+        return cls._instances[key]
+
+
+def node_directory(directory: str) -> str:
+    """Returns the subdirectory of the current node, nodes share no files."""
+    if not current_node():
+        return directory
+    return os.path.join(directory, current_node())
+
+
+def forget_node(name: str) -> None:
+    """Drops the per-node instances of a node that stopped."""
+    for key in [key for key in Singleton._instances if key[1] == name]:
+        del Singleton._instances[key]
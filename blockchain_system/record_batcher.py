@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+from logging import getLogger
+
+from blockchain_system.blockchain import PendingBlock, Record
+from blockchain_system.blockchain_repository import (
+    BlockchainRepository,
+    PendingBlocksRepository,
+)
+from blockchain_system.node import Singleton, bind_node_context
+from blockchain_system.services import add_pending_block
+
+logger = getLogger(__name__)
+
+MAX_BATCH_RECORDS = 100
+MAX_BATCH_BYTES = 64 * 1024
+# How long the first record of a batch may wait for more records
+BATCH_LINGER_SECONDS = 0.5
+
+
+class RecordBatcher(metaclass=Singleton):
+    """
+    Packs incoming records into pending blocks. A batch is handed over to
+    the pending blocks repository when it reaches `max_records` records,
+    `max_bytes` of serialized records or after `linger` seconds.
+
+    Full batches are queued under the lock and handed over after releasing
+    it, as handing over waits while the pending blocks queue is full.
+    """
+
+    def __init__(
+        self,
+        max_records: int = MAX_BATCH_RECORDS,
+        max_bytes: int = MAX_BATCH_BYTES,
+        linger: float = BATCH_LINGER_SECONDS,
+    ):
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.linger = linger
+        self.records: list[Record] = []
+        self.size = 0
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+        # Batches waiting to be handed over, in the order of their records
+        self._batches: deque[list[Record]] = deque()
+        self._hand_over_lock = threading.Lock()
+
+    def add(self, record: Record) -> None:
+        with self._lock:
+            self.records.append(record)
+            self.size += len(record.to_json())
+
+            if (
+                len(self.records) < self.max_records
+                and self.size < self.max_bytes
+                and self.linger > 0
+            ):
+                if self._timer is None:
+                    self._timer = threading.Timer(
+                        self.linger, bind_node_context(self.flush)
+                    )
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+
+            self._close_batch()
+        self._hand_over()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._close_batch()
+        self._hand_over()
+
+    def _close_batch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self.records:
+            self._batches.append(self.records)
+            self.records, self.size = [], 0
+
+    def _hand_over(self) -> None:
+        # Whoever holds the lock hands over all queued batches in order
+        with self._hand_over_lock:
+            while self._batches:
+                records = self._batches.popleft()
+                add_pending_block(
+                    pending_blocks_repository=PendingBlocksRepository(),
+                    blockchain_repository=BlockchainRepository(),
+                    pending_block=PendingBlock(index=1, records=records),
+                )
+                logger.info("Batched %s records into a pending block", len(records))
@@ -0,0 +1,181 @@
+"""
+Secondary indexes over the records of the main chain.
+
+A record is indexed as a (timestamp, height, position) entry, the height of
+its block in the chain and its position in the block. Entries are kept in
+an inverted index of the words of their content, a sorted list of entries
+by timestamp and a map from content to entries. The repository updates the
+indexes block by block as the main chain changes, so lookups never scan
+the chain.
+"""
+import bisect
+import heapq
+import re
+from typing import Iterator
+
+from blockchain_system.blockchain import Block
+
+RecordEntry = tuple[int, int, int]
+
+_WORD = re.compile(r"\w+")
+_NO_ENTRIES: frozenset = frozenset()
+
+
+def tokenize(text: str) -> set[str]:
+    return set(_WORD.findall(text.lower()))
+
+
+class SortedEntries:
+    """
+    Entries kept sorted in lists of at most twice the load, so adding or
+    removing an entry moves O(load) entries instead of O(n).
+    """
+
+    def __init__(self, load: int = 512):
+        self.load = load
+        self._lists: list[list[RecordEntry]] = []
+        # Last entry of each list
+        self._maxes: list[RecordEntry] = []
+        self._length = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[RecordEntry]:
+        for entries in self._lists:
+            yield from entries
+
+    def add(self, entry: RecordEntry) -> None:
+        self._length += 1
+        if not self._lists:
+            self._lists.append([entry])
+            self._maxes.append(entry)
+            return
+
+        i = bisect.bisect_left(self._maxes, entry)
+        if i == len(self._lists):
+            i -= 1
+            self._lists[i].append(entry)
+            self._maxes[i] = entry
+        else:
+            bisect.insort(self._lists[i], entry)
+
+        entries = self._lists[i]
+        if len(entries) > 2 * self.load:
+            self._lists.insert(i + 1, entries[self.load :])
+            self._maxes.insert(i + 1, entries[-1])
+            del entries[self.load :]
+            self._maxes[i] = entries[-1]
+
+    def remove(self, entry: RecordEntry) -> None:
+        i = bisect.bisect_left(self._maxes, entry)
+        if i == len(self._lists):
+            raise ValueError(f"{entry} is not in the index")
+        entries = self._lists[i]
+        j = bisect.bisect_left(entries, entry)
+        if entries[j] != entry:
+            raise ValueError(f"{entry} is not in the index")
+        del entries[j]
+        self._length -= 1
+        if not entries:
+            del self._lists[i]
+            del self._maxes[i]
+        elif j == len(entries):
+            self._maxes[i] = entries[-1]
+
+    def range(
+        self, start: tuple, stop: tuple | None = None, limit: int | None = None
+    ) -> list[RecordEntry]:
+        """Up to `limit` entries from `start` up to, but not including, `stop`."""
+        result: list[RecordEntry] = []
+        i = bisect.bisect_left(self._maxes, start)
+        j = bisect.bisect_left(self._lists[i], start) if i < len(self._lists) else 0
+        while i < len(self._lists) and (limit is None or len(result) < limit):
+            entries = self._lists[i]
+            end = len(entries)
+            if stop is not None and entries[-1] >= stop:
+                end = bisect.bisect_left(entries, stop, j)
+            if limit is not None:
+                end = min(end, j + limit - len(result))
+            result.extend(entries[j:end])
+            if end < len(entries):
+                break
+            i, j = i + 1, 0
+        return result
+
+
+class RecordIndex:
+    def __init__(self):
+        self._entries_by_token: dict[str, set[RecordEntry]] = {}
+        self._entries_by_content: dict[str, list[RecordEntry]] = {}
+        self._entries_by_timestamp = SortedEntries()
+
+    def __len__(self) -> int:
+        return len(self._entries_by_timestamp)
+
+    def add_block(self, height: int, block: Block) -> None:
+        for position, record in enumerate(block.records):
+            entry = (record.timestamp, height, position)
+            for token in tokenize(record.content):
+                self._entries_by_token.setdefault(token, set()).add(entry)
+            self._entries_by_content.setdefault(record.content, []).append(entry)
+            self._entries_by_timestamp.add(entry)
+
+    def remove_block(self, height: int, block: Block) -> None:
+        for position, record in enumerate(block.records):
+            entry = (record.timestamp, height, position)
+            for token in tokenize(record.content):
+                entries = self._entries_by_token[token]
+                entries.discard(entry)
+                if not entries:
+                    del self._entries_by_token[token]
+            entries = self._entries_by_content[record.content]
+            entries.remove(entry)
+            if not entries:
+                del self._entries_by_content[record.content]
+            self._entries_by_timestamp.remove(entry)
+
+    def find(
+        self,
+        text: str | None = None,
+        since: int | None = None,
+        until: int | None = None,
+        limit: int | None = None,
+    ) -> list[RecordEntry]:
+        """
+        Entries of the records whose content has all words of `text` and
+        whose timestamp is in [since, until], oldest first. A `text`
+        without words matches no records.
+        """
+        if text is None:
+            return self._entries_by_timestamp.range(
+                (since,) if since is not None else (),
+                (until + 1,) if until is not None else None,
+                limit,
+            )
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+
+        # Intersecting from the rarest word checks the fewest entries
+        postings = sorted(
+            (self._entries_by_token.get(token, _NO_ENTRIES) for token in tokens),
+            key=len,
+        )
+        entries = [
+            entry
+            for entry in postings[0].intersection(*postings[1:])
+            if (since is None or entry[0] >= since)
+            and (until is None or entry[0] <= until)
+        ]
+        if limit is not None:
+            # Keeps a heap of `limit` entries instead of sorting all matches
+            return heapq.nsmallest(limit, entries)
+        return sorted(entries)
+
+    def locate(self, content: str) -> list[RecordEntry]:
+        """
+        Entries of the records with exactly this content in chain order,
+        blocks are only ever added and removed at the tip.
+        """
+        return list(self._entries_by_content.get(content, ()))
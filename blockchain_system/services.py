@@ -1,20 +1,63 @@
-import copy
-import random
 import time
+from contextlib import nullcontext
+from functools import partial
+from itertools import islice
 from logging import getLogger
-
-from blockchain_system.blockchain import Block, Blockchain, PendingBlock
+from typing import Callable, Iterator
+
+from blockchain_system import tracing
+from blockchain_system.blockchain import (
+    Block,
+    Blockchain,
+    BlockHasher,
+    BlockId,
+    ChainPage,
+    ChainTip,
+    PendingBlock,
+    RecordProof,
+    RecordProofRequest,
+    RecordQuery,
+    RecordQueryResult,
+    ShowChainRequest,
+    SyncBlocks,
+    SyncRequest,
+    difficulty_target,
+)
 from blockchain_system.blockchain_repository import (
     BlockchainRepository,
     PendingBlocksRepository,
+    SyncRepository,
     locked_chain,
 )
+from blockchain_system.metrics import HASHRATE_BUCKETS, MetricsRegistry
+from blockchain_system.mining import get_parallel_miner
 from blockchain_system.publisher import Publisher
+from blockchain_system.validation import get_parallel_validator
 
 logger = getLogger(__name__)
 
 POW_DIFFICULTY = 16
 N = 2
+NONCE_SEARCH_CHUNK = 4096
+# Number of processes searching nonces, 1 mines in the calling thread
+POW_WORKERS = 1
+# Number of processes verifying proofs of a foreign chain, 1 verifies in
+# the calling thread
+VALIDATION_WORKERS = 1
+VALIDATION_CHUNK_SIZE = 500
+# Shorter chains are not worth sending to the worker processes
+PARALLEL_VALIDATION_THRESHOLD = 2_000
+SYNC_PAGE_SIZE = 500
+# Publish the pages of a sync as one batch, accepted by the broker together
+BATCH_SYNC_PAGES = False
+SHOW_CHAIN_PAGE_SIZE = 100
+# Larger requested pages are cut down to keep messages small
+MAX_SHOW_CHAIN_PAGE_SIZE = 1_000
+FIND_RECORDS_LIMIT = 100
+MAX_FIND_RECORDS_LIMIT = 1_000
+# Number of most recent blocks listed one by one in a sync locator, older
+# blocks are listed with exponentially growing gaps
+SYNC_LOCATOR_DENSE_BLOCKS = 10
 
 
 class InvalidProofException(Exception):
@@ -25,98 +68,241 @@ class InvalidBlockchainException(Exception):
     pass
 
 
-def _proof_of_work(block: Block):
-    block.nonce = 0
-
-    computed_hash = block.compute_hash()
-    while not computed_hash.startswith("0" * POW_DIFFICULTY):
-        block.nonce += 1
-        computed_hash = block.compute_hash()
-
-    return computed_hash
+def _proof_of_work(
+    block: Block,
+    workers: int | None = None,
+    should_abort: Callable[[], bool] | None = None,
+) -> str | None:
+    """
+    Returns the hash of the block with a valid nonce, or None if
+    `should_abort` returned True before a nonce was found.
+    """
+    workers = workers or POW_WORKERS
+    hasher = BlockHasher.from_block(block)
+    target = difficulty_target(POW_DIFFICULTY)
+    started = time.perf_counter()
+
+    if workers > 1:
+        nonce, hashes = get_parallel_miner(workers).search(
+            hasher, target, NONCE_SEARCH_CHUNK, should_abort=should_abort
+        )
+    else:
+        nonce = None
+        start = 0
+        while nonce is None:
+            if should_abort and should_abort():
+                break
+            nonce = hasher.search(start, start + NONCE_SEARCH_CHUNK, target)
+            start += NONCE_SEARCH_CHUNK
+        hashes = nonce + 1 if nonce is not None else start
+
+    _record_hashes(hashes, time.perf_counter() - started)
+    if nonce is None:
+        return None
+
+    block.nonce = nonce
+    return hasher.compute_hash(nonce)
+
+
+def _record_hashes(hashes: int, seconds: float) -> None:
+    metrics = MetricsRegistry()
+    metrics.counter("pow_hashes_total", "Hashes computed searching nonces").inc(hashes)
+    if hashes and seconds > 0:
+        metrics.histogram(
+            "pow_hashes_per_second",
+            "Hashrate of nonce searches",
+            buckets=HASHRATE_BUCKETS,
+        ).observe(hashes / seconds)
 
 
 def _is_valid_proof(block: Block, block_hash) -> bool:
     return (
         block_hash.startswith("0" * POW_DIFFICULTY)
         and block_hash == block.compute_hash()
+        and block.has_valid_merkle_root()
     )
 
 
 def _get_side_links(n: int, blockchain_repository: BlockchainRepository):
-    blockchain = blockchain_repository.get_chain()
-    chain = copy.deepcopy(blockchain.chain)
-    if len(chain) >= 1:
-        chain.pop()
+    return blockchain_repository.sample_side_links(n)
 
-    if len(chain) <= n:
-        return [block.hash for block in chain]
-    else:
-        return random.sample(chain, n)
 
+def find_invalid_block(
+    blockchain: Blockchain,
+    blockchain_repository: BlockchainRepository | None = None,
+    workers: int | None = None,
+    trusted_length: int = 0,
+) -> int | None:
+    """
+    Verifies positions, hash links and proofs of the chain and returns the
+    index of the first invalid block, or None if the chain is valid. Given
+    a repository, blocks it already knows in full are not verified again.
+    Proofs of the first `trusted_length` blocks, up to a trusted
+    checkpoint, are not verified, only their links.
+    """
+    return _find_invalid_block(
+        blockchain.chain, 0, "0", blockchain_repository, workers, trusted_length
+    )
 
-def check_chain_validity(blockchain: Blockchain):
-    previous_hash = "0"
 
-    for block in blockchain.chain:
-        if (
-            not _is_valid_proof(block, block.hash)
-            or previous_hash != block.previous_hash
-        ):
-            return False
+def find_invalid_suffix(
+    start: int,
+    blocks: list[Block],
+    blockchain_repository: BlockchainRepository,
+    workers: int | None = None,
+) -> int | None:
+    """
+    Like `find_invalid_block` for blocks replacing the chain from height
+    `start` on, linked to the block before it in the current snapshot. The
+    chain before `start` is not read.
+    """
+    snapshot = blockchain_repository.get_snapshot()
+    if start > len(snapshot):
+        return start
+    previous_hash = snapshot[start - 1].hash if start else "0"
+    return _find_invalid_block(
+        blocks, start, previous_hash, blockchain_repository, workers
+    )
+
+
+def _find_invalid_block(
+    chain: list[Block],
+    start: int,
+    previous_hash: str,
+    blockchain_repository: BlockchainRepository | None,
+    workers: int | None,
+    trusted_length: int = 0,
+) -> int | None:
+    workers = workers or VALIDATION_WORKERS
+    known = 0
+    if blockchain_repository is not None:
+        known = blockchain_repository.known_prefix_length(chain, start)
+    if known:
+        previous_hash = chain[known - 1].hash
+    blocks = chain[known:]
+
+    for height, block in enumerate(blocks, start + known):
+        if block.index != height or previous_hash != block.previous_hash:
+            return height
         previous_hash = block.hash
 
-    return True
+    unproven = blocks[max(trusted_length - start - known, 0) :]
+    if workers > 1 and len(unproven) >= PARALLEL_VALIDATION_THRESHOLD:
+        invalid_index = get_parallel_validator(workers).find_invalid_proof(
+            unproven, POW_DIFFICULTY, VALIDATION_CHUNK_SIZE
+        )
+    else:
+        invalid_index = next(
+            (
+                block.index
+                for block in unproven
+                if not _is_valid_proof(block, block.hash)
+            ),
+            None,
+        )
+
+    if invalid_index is None and blockchain_repository is not None:
+        blockchain_repository.mark_verified(blocks)
+    return invalid_index
+
+
+def check_chain_validity(
+    blockchain: Blockchain,
+    blockchain_repository: BlockchainRepository | None = None,
+    workers: int | None = None,
+) -> bool:
+    return find_invalid_block(blockchain, blockchain_repository, workers) is None
 
 
 def set_chain(
-    blockchain: Blockchain, blockchain_repository: BlockchainRepository
+    blockchain: Blockchain,
+    blockchain_repository: BlockchainRepository,
+    trusted_length: int = 0,
 ) -> None:
-    if not check_chain_validity(blockchain):
-        raise InvalidBlockchainException()
+    with tracing.phase("validate"):
+        invalid_index = find_invalid_block(
+            blockchain, blockchain_repository, trusted_length=trusted_length
+        )
+    if invalid_index is not None:
+        raise InvalidBlockchainException(f"Invalid block at index {invalid_index}")
 
-    blockchain_repository.set_chain(blockchain)
+    with tracing.phase("apply"):
+        blockchain_repository.set_chain(blockchain)
     logger.info("Chain updated")
 
 
 def add_block(
     blockchain_repository: BlockchainRepository, block: Block, proof: str
 ) -> bool:
-    if not _is_valid_proof(block, proof):
-        raise InvalidProofException()
+    with tracing.phase("validate"):
+        if not _is_valid_proof(block, proof):
+            raise InvalidProofException()
 
     block.hash = proof
-    blockchain_repository.add_or_replace(block)
+    with tracing.phase("apply"):
+        blockchain_repository.add_or_replace(block)
     logger.info("Block added to the chain")
     return True
 
 
+def _tip_changed(blockchain_repository: BlockchainRepository, tip: Block) -> bool:
+    return blockchain_repository.get_last_block().hash != tip.hash
+
+
 def mine_block(
     pending_blocks_repository: PendingBlocksRepository,
     blockchain_repository: BlockchainRepository,
+    timeout: float = 0,
 ) -> int | None:
     global N
 
-    pending_block = pending_blocks_repository.pop()
+    pending_block = pending_blocks_repository.get(timeout=timeout)
     if not pending_block:
         return
 
-    logger.info("Mining block")
-    last_block = blockchain_repository.get_last_block()
-
-    new_block = Block(
-        index=pending_block.index,
-        side_links=_get_side_links(N, blockchain_repository),
-        records=pending_block.records,
-        timestamp=int(time.time()),
-        previous_hash=last_block.hash,
-    )
-
-    proof = _proof_of_work(new_block)
-    publisher = Publisher()
-    new_block.hash = proof
-    publisher.notify_block_mined(block=new_block)
-    return new_block.index
+    with tracing.span("mine_block", records=len(pending_block.records)) as span:
+        started = time.perf_counter()
+        last_block = blockchain_repository.get_last_block()
+        rebuilds = 0
+
+        while True:
+            # The index follows the tip the block is built on, the tip may
+            # have moved since the pending block was queued
+            index = last_block.index + 1
+            logger.info("Mining block")
+            with tracing.phase("build"):
+                new_block = Block(
+                    index=index,
+                    side_links=_get_side_links(N, blockchain_repository),
+                    records=pending_block.records,
+                    timestamp=int(time.time()),
+                    previous_hash=last_block.hash,
+                )
+
+            with tracing.phase("proof_of_work"):
+                proof = _proof_of_work(
+                    new_block,
+                    should_abort=partial(
+                        _tip_changed, blockchain_repository, last_block
+                    ),
+                )
+            if proof is not None:
+                break
+
+            # A block from another node was accepted, rebuild on top of it
+            last_block = blockchain_repository.get_last_block()
+            rebuilds += 1
+            logger.info("Chain tip changed, rebuilding block %s", last_block.index + 1)
+
+        MetricsRegistry().histogram(
+            "block_mining_seconds", "Time from taking a pending block to its proof"
+        ).observe(time.perf_counter() - started)
+        span.set(index=new_block.index, nonce=new_block.nonce, rebuilds=rebuilds)
+        publisher = Publisher()
+        new_block.hash = proof
+        with tracing.phase("publish"):
+            publisher.notify_block_mined(block=new_block)
+        return new_block.index
 
 
 def show_chain(blockchain_repository: BlockchainRepository) -> Blockchain:
@@ -124,16 +310,204 @@ def show_chain(blockchain_repository: BlockchainRepository) -> Blockchain:
     return blockchain
 
 
+def iter_chain_pages(
+    blockchain_repository: BlockchainRepository,
+    request: ShowChainRequest,
+    node_id: str,
+) -> Iterator[ChainPage]:
+    """
+    Pages of the blocks at heights [start, stop) of one chain snapshot. They
+    are built as they are consumed, so a single page is held at a time. At
+    least one page is yielded, the last one is marked.
+    """
+    snapshot = blockchain_repository.get_snapshot()
+    page_size = max(
+        1, min(request.page_size or SHOW_CHAIN_PAGE_SIZE, MAX_SHOW_CHAIN_PAGE_SIZE)
+    )
+    stop = len(snapshot) if request.stop is None else min(request.stop, len(snapshot))
+    start = min(max(request.start, 0), stop)
+    blocks = snapshot.blocks(start, stop)
+
+    while True:
+        page = list(islice(blocks, page_size))
+        last = start + len(page) >= stop
+        yield ChainPage(
+            node_id=node_id,
+            request_id=request.request_id,
+            start=start,
+            blocks=page,
+            last=last,
+        )
+        if last:
+            return
+        start += len(page)
+
+
+def find_records(
+    blockchain_repository: BlockchainRepository, query: RecordQuery, node_id: str
+) -> RecordQueryResult:
+    limit = max(1, min(query.limit or FIND_RECORDS_LIMIT, MAX_FIND_RECORDS_LIMIT))
+    return RecordQueryResult(
+        node_id=node_id,
+        request_id=query.request_id,
+        matches=blockchain_repository.find_records(
+            query.text, query.since, query.until, limit
+        ),
+    )
+
+
+def prove_record(
+    blockchain_repository: BlockchainRepository, request: RecordProofRequest
+) -> RecordProof | None:
+    """Proves the newest record of the chain matching the request."""
+    for match in reversed(blockchain_repository.locate_records(request.content)):
+        if request.timestamp not in (None, match.record.timestamp):
+            continue
+        # The chain may have been reorganized since the lookup
+        block = blockchain_repository.get_block_by_hash(match.block_hash)
+        if block is not None:
+            return block.record_proof(match.position)
+
+    return None
+
+
 def add_pending_block(
     pending_blocks_repository: PendingBlocksRepository,
     blockchain_repository: BlockchainRepository,
     pending_block: PendingBlock,
 ) -> None:
     with locked_chain(blockchain_repository) as chain:
-        last_block = blockchain_repository.get_last_block()
         # recount actual index
         pending_block.index = (
-            last_block.index + pending_blocks_repository.pending_blocks_count() + 1
+            chain[-1].index + pending_blocks_repository.pending_blocks_count() + 1
         )
-        pending_blocks_repository.add(block=pending_block)
+    # A full queue may block, chain writers must not wait for the miner
+    pending_blocks_repository.add(block=pending_block)
     logger.info("New pending block added")
+
+
+def get_chain_tip(
+    blockchain_repository: BlockchainRepository, sync_repository: SyncRepository
+) -> ChainTip:
+    last_block = blockchain_repository.get_last_block()
+    return ChainTip(
+        node_id=sync_repository.node_id, index=last_block.index, hash=last_block.hash
+    )
+
+
+def build_locator(blockchain_repository: BlockchainRepository) -> list[BlockId]:
+    chain = blockchain_repository.chain
+    locator = []
+    position = len(chain) - 1
+    step = 1
+
+    while position > 0:
+        locator.append(BlockId(index=chain[position].index, hash=chain[position].hash))
+        if len(locator) >= SYNC_LOCATOR_DENSE_BLOCKS:
+            step *= 2
+        position -= step
+
+    locator.append(BlockId(index=chain[0].index, hash=chain[0].hash))
+    return locator
+
+
+def find_sync_start(
+    locator: list[BlockId], blockchain_repository: BlockchainRepository
+) -> int:
+    """Returns the height of the first block the requesting node is missing."""
+    for block_id in locator:
+        block = blockchain_repository.get_block_by_height(block_id.index)
+        if block is not None and block.hash == block_id.hash:
+            return block_id.index + 1
+
+    return 0
+
+
+def send_missing_blocks(
+    sync_request: SyncRequest,
+    blockchain_repository: BlockchainRepository,
+    sync_repository: SyncRepository,
+) -> None:
+    """
+    Sends the blocks from the first one the requesting node is missing, in
+    pages built from one snapshot as they are sent.
+    """
+    snapshot = blockchain_repository.get_snapshot()
+    start = min(
+        find_sync_start(sync_request.locator, blockchain_repository), len(snapshot)
+    )
+    count = len(snapshot) - start
+    blocks = snapshot.blocks(start)
+    publisher = Publisher()
+
+    # At least one page is sent, so the requesting node can finish the sync
+    with publisher.batch() if BATCH_SYNC_PAGES else nullcontext():
+        offset = 0
+        while True:
+            page = list(islice(blocks, SYNC_PAGE_SIZE))
+            last = offset + len(page) >= count
+            publisher.notify_sync_blocks(
+                SyncBlocks(
+                    node_id=sync_repository.node_id,
+                    target_node_id=sync_request.node_id,
+                    start=start + offset,
+                    blocks=page,
+                    last=last,
+                )
+            )
+            if last:
+                break
+            offset += len(page)
+    logger.info(
+        "Sent %s blocks from height %s to %s", count, start, sync_request.node_id
+    )
+
+
+def request_missing_blocks(
+    blockchain_repository: BlockchainRepository, sync_repository: SyncRepository
+) -> None:
+    """
+    Announces the chain tip like a new node does, peers with a longer chain
+    then offer the blocks the orphans are waiting for.
+    """
+    if not sync_repository.should_request_sync():
+        return
+
+    logger.info("Parent of a block is missing, requesting a sync")
+    publisher = Publisher()
+    publisher.notify_new_node(
+        get_chain_tip(
+            blockchain_repository=blockchain_repository,
+            sync_repository=sync_repository,
+        )
+    )
+
+
+def apply_sync_blocks(
+    sync_blocks: SyncBlocks,
+    blockchain_repository: BlockchainRepository,
+    sync_repository: SyncRepository,
+) -> None:
+    """
+    Validates the blocks of a finished sync against the snapshot and
+    applies them from their start height, the local chain before it is
+    neither copied nor compared.
+    """
+    sync_repository.add_page(sync_blocks)
+    if not sync_blocks.last:
+        return
+
+    start, blocks = sync_repository.finish_session()
+    if start + len(blocks) <= len(blockchain_repository.get_snapshot()):
+        return
+
+    with tracing.phase("validate"):
+        invalid_index = find_invalid_suffix(start, blocks, blockchain_repository)
+    if invalid_index is not None:
+        raise InvalidBlockchainException(f"Invalid block at index {invalid_index}")
+
+    with tracing.phase("apply"):
+        if not blockchain_repository.replace_suffix(start, blocks):
+            logger.info("Chain changed during the sync, blocks dropped")
+            return
+    logger.info("Chain updated")
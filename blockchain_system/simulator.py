@@ -0,0 +1,267 @@
+"""
+Cluster simulator for end-to-end benchmarks.
+
+Starts full nodes, each with its miner and subscriber, in one process on
+a local transport and sends them records. Every message on the bus is
+observed, so the results include how long records took to be committed,
+how many blocks went stale and how many bytes were spent on syncing.
+"""
+import dataclasses
+import json
+import threading
+import time
+import uuid
+
+from blockchain_system import services
+from blockchain_system.app import App
+from blockchain_system.blockchain import Block, Record
+from blockchain_system.blockchain_repository import BlockchainRepository
+from blockchain_system.codec import decode_message
+from blockchain_system.node import forget_node, node_context
+from blockchain_system.publisher import Publisher
+from blockchain_system.subscriber import Subscriber
+from blockchain_system.transports import InProcessBroker, InProcessTransport, Transport
+
+SIMULATION_NODES = 3
+SIMULATION_RECORDS = 100
+# Records sent per second, 0 sends all of them at once
+SIMULATION_RATE = 50
+SIMULATION_DIFFICULTY = 12
+# Time given to the cluster to commit all records
+SIMULATION_TIMEOUT = 120
+RESULTS_SCHEMA_VERSION = 2
+
+SYNC_ROUTING_KEYS = {
+    "blockchain.event.new_node",
+    "blockchain.event.sync_offer",
+    "blockchain.command.sync_request",
+    "blockchain.command.sync_blocks",
+    "blockchain.command.set_chain",
+}
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Nearest-rank percentile, `q` between 0 and 100."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+@dataclasses.dataclass
+class SimulationResult:
+    nodes: int
+    transport: str
+    difficulty: int
+    records_sent: int
+    records_committed: int
+    records_per_second: float
+    latency_seconds: dict[str, float | None]
+    blocks_mined: int
+    stale_blocks: int
+    replaced_blocks: int
+    orphaned_blocks: int
+    orphan_rate: float
+    sync_bytes: int
+    total_bytes: int
+    converged: bool
+    timed_out: bool
+    duration_seconds: float
+    schema: int = RESULTS_SCHEMA_VERSION
+
+
+class TrafficObserver:
+    """Watches every message on the bus, like an extra node that never acts."""
+
+    def __init__(self, transport: Transport):
+        self.subscription = transport.subscribe("blockchain.#")
+        self.bytes_by_routing_key: dict[str, int] = {}
+        # Time each block was first announced
+        self.mined_at: dict[str, float] = {}
+        self.announced_blocks = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self.subscription.consume, args=(self._observe,), daemon=True
+        )
+        self._thread.start()
+
+    def _observe(self, routing_key: str, body: bytes, ack) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.bytes_by_routing_key[routing_key] = self.bytes_by_routing_key.get(
+                routing_key, 0
+            ) + len(body)
+        if routing_key == "blockchain.event.block_mined":
+            block: Block = decode_message(body)
+            with self._lock:
+                self.mined_at.setdefault(block.hash, now)
+                self.announced_blocks += 1
+
+    def stop(self) -> None:
+        self.subscription.stop()
+        self._thread.join()
+
+
+class Cluster:
+    def __init__(self, nodes: int, transport: str = "memory"):
+        self.transport_name = transport
+        self._broker = InProcessBroker()
+        self._bus = None
+        if transport == "socket":
+            from blockchain_system.transports.socket_bus import SocketBusServer
+
+            self._bus = SocketBusServer("tcp://127.0.0.1:0").start()
+        elif transport != "memory":
+            raise ValueError(f"Unsupported simulation transport {transport}")
+
+        # Unique names, so nodes of earlier runs in this process are not reused
+        run_id = uuid.uuid4().hex[:8]
+        self.node_names = [f"sim-{run_id}-node-{i}" for i in range(nodes)]
+        self.client_name = f"sim-{run_id}-client"
+        self.apps: dict[str, App] = {}
+
+    def create_transport(self) -> Transport:
+        if self._bus is not None:
+            from blockchain_system.transports.socket_bus import SocketTransport
+
+            return SocketTransport(self._bus.address)
+        return InProcessTransport(self._broker)
+
+    def start(self) -> None:
+        for name in self.node_names:
+            with node_context(name):
+                transport = self.create_transport()
+                self.apps[name] = App(Subscriber(transport), Publisher(transport))
+                self.apps[name].start(block=False)
+
+    def repositories(self) -> dict[str, BlockchainRepository]:
+        repositories = {}
+        for name in self.node_names:
+            with node_context(name):
+                repositories[name] = BlockchainRepository()
+        return repositories
+
+    def client(self) -> Publisher:
+        with node_context(self.client_name):
+            return Publisher(self.create_transport())
+
+    def stop(self) -> None:
+        for app in self.apps.values():
+            app.stop()
+        for name in [*self.node_names, self.client_name]:
+            with node_context(name):
+                Publisher().transport.close()
+            forget_node(name)
+        if self._bus is not None:
+            self._bus.stop()
+
+
+def _committed_blocks(chain: list[Block], contents: set[str]) -> dict[str, Block]:
+    blocks = {}
+    for block in chain:
+        for record in block.records:
+            if record.content in contents:
+                blocks.setdefault(record.content, block)
+    return blocks
+
+
+def run_simulation(
+    nodes: int = SIMULATION_NODES,
+    records: int = SIMULATION_RECORDS,
+    rate: float = SIMULATION_RATE,
+    difficulty: int = SIMULATION_DIFFICULTY,
+    transport: str = "memory",
+    timeout: float = SIMULATION_TIMEOUT,
+) -> SimulationResult:
+    """
+    Records count as committed once they are in the chain of the first
+    node, their latency is measured up to the announcement of that block.
+    """
+    previous_difficulty = services.POW_DIFFICULTY
+    services.POW_DIFFICULTY = difficulty
+    cluster = Cluster(nodes, transport)
+    observer = TrafficObserver(cluster.create_transport())
+    try:
+        cluster.start()
+        reference = cluster.repositories()[cluster.node_names[0]]
+        client = cluster.client()
+
+        started = time.monotonic()
+        sent_at: dict[str, float] = {}
+        for i in range(records):
+            if rate:
+                # Keep the schedule, sending late records without a pause
+                time.sleep(max(0.0, started + i / rate - time.monotonic()))
+            content = f"simulated record {i}"
+            sent_at[content] = time.monotonic()
+            client.notify_add_record(
+                Record(index=0, timestamp=int(time.time()), content=content)
+            )
+
+        deadline = started + timeout
+        committed = {}
+        while time.monotonic() < deadline:
+            committed = _committed_blocks(reference.get_chain().chain, set(sent_at))
+            if len(committed) == records:
+                break
+            time.sleep(0.1)
+        timed_out = len(committed) < records
+        duration = time.monotonic() - started
+
+        repositories = cluster.repositories().values()
+        tips = {repository.get_last_block().hash for repository in repositories}
+        chain_hashes = {block.hash for block in reference.get_chain().chain}
+    finally:
+        cluster.stop()
+        observer.stop()
+        services.POW_DIFFICULTY = previous_difficulty
+
+    mined_at = observer.mined_at
+    latencies = [
+        mined_at[block.hash] - sent_at[content]
+        for content, block in committed.items()
+        if block.hash in mined_at
+    ]
+    last_commit = max(
+        (mined_at.get(block.hash, started) for block in committed.values()),
+        default=started,
+    )
+    orphaned = sum(repository.orphaned_blocks for repository in repositories)
+    # Every node receives every announced block
+    deliveries = observer.announced_blocks * nodes
+    bytes_by_routing_key = observer.bytes_by_routing_key
+
+    return SimulationResult(
+        nodes=nodes,
+        transport=transport,
+        difficulty=difficulty,
+        records_sent=records,
+        records_committed=len(committed),
+        records_per_second=(
+            len(committed) / (last_commit - started) if last_commit > started else 0.0
+        ),
+        latency_seconds={
+            f"p{q}": percentile(latencies, q) for q in (50, 90, 95, 99, 100)
+        },
+        blocks_mined=len(mined_at),
+        stale_blocks=len(set(mined_at) - chain_hashes),
+        replaced_blocks=sum(repository.replaced_blocks for repository in repositories),
+        orphaned_blocks=orphaned,
+        orphan_rate=orphaned / deliveries if deliveries else 0.0,
+        sync_bytes=sum(
+            size
+            for routing_key, size in bytes_by_routing_key.items()
+            if routing_key in SYNC_ROUTING_KEYS
+        ),
+        total_bytes=sum(bytes_by_routing_key.values()),
+        converged=len(tips) == 1,
+        timed_out=timed_out,
+        duration_seconds=duration,
+    )
+
+
+def write_results(result: SimulationResult, path: str) -> None:
+    with open(path, "w") as results_file:
+        json.dump(dataclasses.asdict(result), results_file, indent=2)
+        results_file.write("\n")
@@ -0,0 +1,266 @@
+"""
+Chain snapshots used as checkpoints for a fast bootstrap.
+
+Snapshots are written incrementally. Each snapshot file holds the blocks
+added since the previous snapshot it builds on. A header carries the height
+of its first block, the height and hash of its tip block and the SHA-256
+checksum of the payload, followed by the blocks in the binary wire format.
+Applying the files in order, each replacing the chain from its first block,
+gives back the chain, including reorganizations between snapshots. The
+headers alone tell which files supply blocks, so only those are decoded.
+"""
+import glob
+import hashlib
+import os
+import struct
+from collections.abc import Sequence
+from logging import getLogger
+
+from blockchain_system.blockchain import Block, Blockchain
+from blockchain_system.blockchain_repository import BlockchainRepository
+from blockchain_system.codec import BinaryCodec
+from blockchain_system.services import InvalidBlockchainException, set_chain
+
+logger = getLogger(__name__)
+
+# Directory of the snapshots, None disables them
+SNAPSHOT_DIR: str | None = None
+# Number of new blocks after which a new snapshot is taken
+SNAPSHOT_INTERVAL = 1_000
+# Trusted hashes of snapshot tips by height, proofs of the blocks up to
+# the newest one found in the snapshots are not verified on bootstrap
+SNAPSHOT_CHECKPOINTS: dict[int, str] = {}
+
+SNAPSHOT_MAGIC = b"BCSN"
+SNAPSHOT_VERSION = 2
+_HEADER = struct.Struct("<4sBQQ32sH")
+
+
+class InvalidSnapshotException(Exception):
+    pass
+
+
+def snapshot_path(directory: str, height: int) -> str:
+    return os.path.join(directory, f"chain-{height:012d}.snapshot")
+
+
+def _read_header(path: str) -> tuple[int, int, bytes, str]:
+    """Returns the first height, tip height, checksum and tip hash of a file."""
+    with open(path, "rb") as snapshot_file:
+        header = snapshot_file.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise InvalidSnapshotException(f"Snapshot {path} is truncated")
+        magic, version, start, height, checksum, tip_hash_length = _HEADER.unpack(
+            header
+        )
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise InvalidSnapshotException(f"{path} is not a supported snapshot")
+        tip_hash = snapshot_file.read(tip_hash_length).decode()
+    return start, height, checksum, tip_hash
+
+
+def _next_snapshot_start(directory: str, chain) -> int:
+    """
+    Height after the newest snapshot whose tip is still in the chain, the
+    blocks before it are already stored.
+    """
+    for path in reversed(list_snapshots(directory)):
+        try:
+            _, height, _, tip_hash = _read_header(path)
+        except InvalidSnapshotException:
+            continue
+        if height < len(chain) and chain[height].hash == tip_hash:
+            return height + 1
+
+    return 0
+
+
+def create_snapshot(
+    blockchain_repository: BlockchainRepository, directory: str
+) -> str | None:
+    """
+    Writes the blocks added since the last snapshot and returns the path of
+    the new snapshot, None if there are no new blocks. The chain is read
+    from an immutable snapshot, so the lock is not taken.
+    """
+    chain = blockchain_repository.get_snapshot()
+    if not chain:
+        return None
+
+    os.makedirs(directory, exist_ok=True)
+    start = _next_snapshot_start(directory, chain)
+    if start >= len(chain):
+        return None
+
+    tip = chain[-1]
+    payload = BinaryCodec().encode(Blockchain(chain=list(chain.blocks(start))))
+    tip_hash = tip.hash.encode()
+    header = _HEADER.pack(
+        SNAPSHOT_MAGIC,
+        SNAPSHOT_VERSION,
+        start,
+        tip.index,
+        hashlib.sha256(payload).digest(),
+        len(tip_hash),
+    )
+
+    path = snapshot_path(directory, tip.index)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as snapshot_file:
+        snapshot_file.write(header + tip_hash + payload)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    # Readers never see a partially written snapshot
+    os.replace(temporary_path, path)
+
+    logger.info("Snapshot of blocks %s to %s written", start, tip.index)
+    return path
+
+
+def load_snapshot(path: str) -> tuple[int, list[Block]]:
+    """Returns the height of the first block of the snapshot and its blocks."""
+    start, height, checksum, tip_hash = _read_header(path)
+    with open(path, "rb") as snapshot_file:
+        data = snapshot_file.read()
+
+    payload = data[_HEADER.size + len(tip_hash.encode()) :]
+    if hashlib.sha256(payload).digest() != checksum:
+        raise InvalidSnapshotException(f"Checksum of snapshot {path} does not match")
+
+    blocks = BinaryCodec().decode(payload).chain
+    if blocks[0].index != start:
+        raise InvalidSnapshotException(f"Start of snapshot {path} does not match")
+    tip = blocks[-1]
+    if tip.index != height or tip.hash != tip_hash:
+        raise InvalidSnapshotException(f"Tip of snapshot {path} does not match")
+    return start, blocks
+
+
+def _plan_chain(directory: str) -> list[tuple[str, int, int, int, str]]:
+    """
+    Reads only the headers and returns the path, first height, stop height,
+    tip height and tip hash of every snapshot supplying blocks, in order.
+    Applying the snapshots in order, a snapshot that is invalid or does
+    not connect to the chain planned so far is skipped.
+    """
+    segments = []
+    length = 0
+    for path in list_snapshots(directory):
+        try:
+            start, height, _, tip_hash = _read_header(path)
+        except InvalidSnapshotException as e:
+            logger.warning(str(e))
+            continue
+        if start > length:
+            logger.warning("Snapshot %s does not connect to the chain", path)
+            continue
+        # Blocks from `start` on are replaced by this snapshot
+        while segments and segments[-1][1] >= start:
+            segments.pop()
+        if segments:
+            segments[-1] = (*segments[-1][:2], start, *segments[-1][3:])
+        segments.append((path, start, height + 1, height, tip_hash))
+        length = height + 1
+
+    return segments
+
+
+def load_chain(directory: str, chain: Sequence[Block] = ()) -> list[Block]:
+    """
+    Applies the snapshots in order. Snapshots whose blocks were replaced by
+    a newer one are not read, nor those up to the newest snapshot whose tip
+    is still in `chain`, whose blocks are taken from `chain` instead. The
+    loaded chain ends before a snapshot whose payload is invalid.
+    """
+    segments = _plan_chain(directory)
+    loaded: list[Block] = []
+    for position in range(len(segments) - 1, -1, -1):
+        _, _, stop, height, tip_hash = segments[position]
+        if (
+            stop == height + 1
+            and height < len(chain)
+            and chain[height].hash == tip_hash
+        ):
+            loaded = list(chain[:stop])
+            segments = segments[position + 1 :]
+            break
+
+    for path, start, stop, _, _ in segments:
+        try:
+            snapshot_start, blocks = load_snapshot(path)
+        except InvalidSnapshotException as e:
+            logger.warning(str(e))
+            break
+        loaded.extend(blocks[start - snapshot_start : stop - snapshot_start])
+
+    return loaded
+
+
+def list_snapshots(directory: str) -> list[str]:
+    """Returns snapshot paths, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, "chain-*.snapshot")))
+
+
+def prune_snapshots(directory: str) -> None:
+    """Removes the snapshots whose blocks were all replaced by a newer one."""
+    lowest_start = None
+    for path in reversed(list_snapshots(directory)):
+        try:
+            start, *_ = _read_header(path)
+        except InvalidSnapshotException:
+            continue
+        if lowest_start is not None and lowest_start <= start:
+            os.remove(path)
+        else:
+            lowest_start = start
+
+
+def trusted_checkpoint(
+    directory: str, chain: list[Block], checkpoints: dict[int, str]
+) -> int:
+    """
+    Number of leading blocks of the chain loaded from the snapshots that
+    end with the newest trusted checkpoint, 0 if there is none. Checkpoints
+    are tips of snapshots, read with a verified checksum.
+    """
+    for _, _, _, height, tip_hash in reversed(_plan_chain(directory)):
+        if (
+            checkpoints.get(height) == tip_hash
+            and height < len(chain)
+            and chain[height].hash == tip_hash
+        ):
+            return height + 1
+
+    return 0
+
+
+def bootstrap_from_snapshot(
+    blockchain_repository: BlockchainRepository,
+    directory: str,
+    checkpoints: dict[int, str] | None = None,
+) -> bool:
+    """
+    Loads the chain of the snapshots if it is longer than the current one.
+    Snapshot files are not trusted beyond their newest checkpoint, taken
+    from `SNAPSHOT_CHECKPOINTS` unless given, like tips confirmed by
+    peers. Proofs of the blocks up to the checkpoint are not verified,
+    the blocks after it are validated like blocks received from a peer.
+    """
+    if checkpoints is None:
+        checkpoints = SNAPSHOT_CHECKPOINTS
+    chain = load_chain(directory, blockchain_repository.get_snapshot())
+    if len(chain) <= len(blockchain_repository.chain):
+        return False
+
+    try:
+        set_chain(
+            blockchain=Blockchain(chain=chain),
+            blockchain_repository=blockchain_repository,
+            trusted_length=trusted_checkpoint(directory, chain, checkpoints),
+        )
+    except InvalidBlockchainException as e:
+        logger.warning("Snapshots hold an invalid chain: %s", e)
+        return False
+
+    logger.info("Bootstrapped from snapshots up to %s", chain[-1].index)
+    return True
@@ -1,56 +1,159 @@
 import logging
 
-from blockchain_system.blockchain import Block, Blockchain, PendingBlock, Record
-from blockchain_system.blockchain_repository import (
-    BlockchainRepository,
-    PendingBlocksRepository,
+from blockchain_system.blockchain import (
+    Block,
+    Blockchain,
+    ChainTip,
+    Record,
+    RecordProofRequest,
+    RecordQuery,
+    ShowChainRequest,
+    SyncBlocks,
+    SyncRequest,
 )
+from blockchain_system.blockchain_repository import BlockchainRepository, SyncRepository
 from blockchain_system.publisher import Publisher
+from blockchain_system.record_batcher import RecordBatcher
 from blockchain_system.services import (
     add_block,
-    add_pending_block,
+    apply_sync_blocks,
+    build_locator,
+    find_records,
+    get_chain_tip,
+    iter_chain_pages,
+    prove_record,
+    request_missing_blocks,
+    send_missing_blocks,
     set_chain,
-    show_chain,
 )
 
 logger = logging.getLogger(__name__)
 
 
-def handle_mine_block(payload):
-    record = Record.from_json(payload)
-    pending_block = PendingBlock(index=1, records=[record])
-    add_pending_block(
-        pending_blocks_repository=PendingBlocksRepository(),
+def handle_mine_block(payload: Record):
+    record = payload
+    RecordBatcher().add(record)
+
+
+def handle_show_chain(payload: ShowChainRequest | None):
+    # Older clients send no request and get the whole chain
+    request = payload or ShowChainRequest(request_id="")
+    publisher = Publisher()
+    for page in iter_chain_pages(
         blockchain_repository=BlockchainRepository(),
-        pending_block=pending_block,
-    )
+        request=request,
+        node_id=SyncRepository().node_id,
+    ):
+        publisher.notify_chain_page(page)
+
 
+def handle_prove_record(payload: RecordProofRequest):
+    request = payload
+    proof = prove_record(blockchain_repository=BlockchainRepository(), request=request)
+    if proof is None:
+        logger.info("No record to prove with content %r", request.content)
+        return
+
+    publisher = Publisher()
+    publisher.notify_record_proof(proof)
 
-def handle_show_chain(payload):
-    blockchain = show_chain(blockchain_repository=BlockchainRepository())
+
+def handle_find_records(payload: RecordQuery):
+    query = payload
+    result = find_records(
+        blockchain_repository=BlockchainRepository(),
+        query=query,
+        node_id=SyncRepository().node_id,
+    )
     publisher = Publisher()
-    publisher.notify_event_show_chain(blockchain)
+    publisher.notify_record_matches(result)
 
 
-def handle_block_mined(payload):
-    block = Block.from_json(payload)
+def handle_block_mined(payload: Block):
+    block = payload
+    blockchain_repository = BlockchainRepository()
 
     add_block(
-        blockchain_repository=BlockchainRepository(), block=block, proof=block.hash
+        blockchain_repository=blockchain_repository, block=block, proof=block.hash
+    )
+    if blockchain_repository.is_orphan(block.hash):
+        request_missing_blocks(
+            blockchain_repository=blockchain_repository,
+            sync_repository=SyncRepository(),
+        )
+
+
+def handle_new_node(payload: ChainTip):
+    new_node_tip = payload
+    my_tip = get_chain_tip(
+        blockchain_repository=BlockchainRepository(),
+        sync_repository=SyncRepository(),
     )
 
+    if new_node_tip.node_id == my_tip.node_id or my_tip.index <= new_node_tip.index:
+        return
 
-def handle_new_node(payload):
-    blockchain = show_chain(blockchain_repository=BlockchainRepository())
+    my_tip.target_node_id = new_node_tip.node_id
     publisher = Publisher()
-    publisher.notify_set_chain(blockchain)
+    publisher.notify_sync_offer(my_tip)
+
+
+def handle_sync_offer(payload: ChainTip):
+    offer = payload
+    sync_repository = SyncRepository()
+    blockchain_repository = BlockchainRepository()
+
+    if offer.target_node_id != sync_repository.node_id:
+        return
+    if offer.index <= blockchain_repository.get_last_block().index:
+        return
+    # Only the first offering peer sends blocks
+    if not sync_repository.start_session(offer.node_id):
+        return
+
+    publisher = Publisher()
+    publisher.notify_sync_request(
+        SyncRequest(
+            node_id=sync_repository.node_id,
+            target_node_id=offer.node_id,
+            locator=build_locator(blockchain_repository),
+        )
+    )
+
+
+def handle_sync_request(payload: SyncRequest):
+    sync_request = payload
+    sync_repository = SyncRepository()
+
+    if sync_request.target_node_id != sync_repository.node_id:
+        return
+
+    send_missing_blocks(
+        sync_request=sync_request,
+        blockchain_repository=BlockchainRepository(),
+        sync_repository=sync_repository,
+    )
+
+
+def handle_sync_blocks(payload: SyncBlocks):
+    sync_blocks = payload
+    sync_repository = SyncRepository()
+
+    if sync_blocks.target_node_id != sync_repository.node_id:
+        return
+
+    apply_sync_blocks(
+        sync_blocks=sync_blocks,
+        blockchain_repository=BlockchainRepository(),
+        sync_repository=sync_repository,
+    )
 
 
-def handle_set_chain(payload):
-    blockchain = Blockchain.from_json(payload)
-    my_blockchain_copy = show_chain(blockchain_repository=BlockchainRepository())
+def handle_set_chain(payload: Blockchain):
+    blockchain = payload
+    blockchain_repository = BlockchainRepository()
 
-    if blockchain.length <= my_blockchain_copy.length:
+    if blockchain.length <= len(blockchain_repository.get_snapshot()):
         return
 
-    set_chain(blockchain=blockchain, blockchain_repository=BlockchainRepository())
+    set_chain(blockchain=blockchain, blockchain_repository=blockchain_repository)
@@ -0,0 +1,181 @@
+"""
+Opt-in tracing of message handling and mining, and a sampling profiler.
+
+With tracing enabled, every handled message and every mined block gets a
+span written as a JSON line to a rolling trace file. A span holds its
+attributes and the time spent in each phase, e.g. deserialize, validate
+and apply. When tracing is disabled, `span` and `phase` return a shared
+no-op object, so instrumented code pays a single check.
+"""
+import contextvars
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from logging.handlers import RotatingFileHandler
+
+from blockchain_system.node import current_node
+
+# Trace file, None disables tracing
+TRACE_FILE: str | None = None
+TRACE_MAX_BYTES = 10 * 1024 * 1024
+# Number of rotated trace files kept next to the current one
+TRACE_BACKUPS = 3
+PROFILER_INTERVAL = 0.005
+# Threads sampled by the profiler, matched against thread names
+PROFILED_THREADS = ("miner", "consumer", "handler")
+
+_trace_logger = logging.getLogger("blockchain_system.trace")
+_trace_logger.propagate = False
+_trace_handler: logging.Handler | None = None
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.attributes = attributes
+        self.phases: dict[str, float] = {}
+        self._token = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self._started_at = time.time()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        record = {
+            "name": self.name,
+            "start": self._started_at,
+            "duration": duration,
+            "node": current_node(),
+            "thread": threading.current_thread().name,
+            "attributes": self.attributes,
+            "phases": self.phases,
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        _trace_logger.info(json.dumps(record, default=str))
+        return False
+
+
+class _Phase:
+    def __init__(self, span: Span, name: str):
+        self.span = span
+        self.name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        # Phases repeated within a span, like rebuilt blocks, add up
+        self.span.phases[self.name] = (
+            self.span.phases.get(self.name, 0.0) + time.perf_counter() - self._start
+        )
+        return False
+
+
+def tracing_enabled() -> bool:
+    return _trace_handler is not None
+
+
+def enable_tracing(
+    path: str, max_bytes: int = TRACE_MAX_BYTES, backups: int = TRACE_BACKUPS
+) -> None:
+    global _trace_handler
+    disable_tracing()
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _trace_logger.addHandler(handler)
+    _trace_logger.setLevel(logging.INFO)
+    _trace_handler = handler
+
+
+def disable_tracing() -> None:
+    global _trace_handler
+    if _trace_handler is None:
+        return
+    _trace_logger.removeHandler(_trace_handler)
+    _trace_handler.close()
+    _trace_handler = None
+
+
+def span(name: str, **attributes):
+    if _trace_handler is None:
+        return _NOOP_SPAN
+    return Span(name, attributes)
+
+
+def phase(name: str):
+    """Times a phase of the current span, if there is one."""
+    if _trace_handler is None:
+        return _NOOP_SPAN
+    current_span = _current_span.get()
+    if current_span is None:
+        return _NOOP_SPAN
+    return _Phase(current_span, name)
+
+
+def _frame_stack(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_filename}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+def sample_stacks(
+    seconds: float,
+    interval: float = PROFILER_INTERVAL,
+    thread_names: tuple[str, ...] = PROFILED_THREADS,
+) -> Counter:
+    """
+    Samples the stacks of the threads whose name contains one of
+    `thread_names` and counts them in the collapsed format of flame graphs,
+    with the thread name as the root frame.
+    """
+    samples = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            name = threads.get(ident, "")
+            if ident == threading.get_ident() or not any(
+                wanted in name for wanted in thread_names
+            ):
+                continue
+            samples[f"{name};{_frame_stack(frame)}"] += 1
+        time.sleep(interval)
+    return samples
+
+
+def profile(seconds: float, interval: float = PROFILER_INTERVAL) -> str:
+    """Hot stacks of the miner and consumer threads, most sampled first."""
+    samples = sample_stacks(seconds, interval)
+    return "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
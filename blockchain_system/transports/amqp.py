@@ -0,0 +1,212 @@
+import threading
+from contextlib import contextmanager
+from logging import getLogger
+
+import pika
+
+from blockchain_system.transports.base import MessageCallback, Subscription, Transport
+
+EXCHANGE = "topic_blockchain"
+# Wait for the broker to confirm every message published outside a batch,
+# messages of a batch are always committed in a transaction
+PUBLISHER_CONFIRMS = False
+# Number of times a publish is retried on a new connection
+PUBLISH_RETRIES = 1
+
+logger = getLogger(__name__)
+
+
+class PublisherConnection:
+    """Connection and channels of a single thread, pika is not thread-safe."""
+
+    def __init__(self, broker_dsn: str, confirms: bool):
+        parameters = pika.URLParameters(broker_dsn)
+        self.connection = pika.BlockingConnection(parameters)
+        self.channel = self.connection.channel()
+        self.channel.exchange_declare(exchange=EXCHANGE, exchange_type="topic")
+        if confirms:
+            self.channel.confirm_delivery()
+        # Opened by the first batch, in transaction mode
+        self._batch_channel = None
+
+    def batch_channel(self):
+        if self._batch_channel is None:
+            self._batch_channel = self.connection.channel()
+            self._batch_channel.tx_select()
+        return self._batch_channel
+
+    def close(self) -> None:
+        if self.connection.is_open:
+            self.connection.close()
+
+
+class AmqpSubscription(Subscription):
+    def __init__(
+        self,
+        broker_dsn: str,
+        binding_key: str,
+        prefetch: int | None,
+        queue_name: str | None = None,
+    ):
+        self.connection = pika.BlockingConnection(pika.URLParameters(broker_dsn))
+        self.channel = self.connection.channel()
+        self.channel.exchange_declare(exchange=EXCHANGE, exchange_type="topic")
+
+        if queue_name:
+            # Outlives the subscriber, unacknowledged messages stay queued
+            # for the next subscriber with the same name
+            declared = self.channel.queue_declare(queue=queue_name, durable=True)
+        else:
+            # An exclusive queue of this subscriber, deleted with it
+            declared = self.channel.queue_declare(queue="", exclusive=True)
+        self.queue_name = declared.method.queue
+        self.channel.queue_bind(
+            exchange=EXCHANGE, queue=self.queue_name, routing_key=binding_key
+        )
+        if prefetch:
+            self.channel.basic_qos(prefetch_count=prefetch)
+
+    def consume(self, callback: MessageCallback, auto_ack: bool = True) -> None:
+        def on_message(channel, method, properties, body):
+            callback(method.routing_key, body, self._ack(method.delivery_tag))
+
+        self.channel.basic_consume(
+            queue=self.queue_name, on_message_callback=on_message, auto_ack=auto_ack
+        )
+        try:
+            self.channel.start_consuming()
+        finally:
+            if self.connection.is_open:
+                self.connection.close()
+
+    def _ack(self, delivery_tag: int):
+        def ack():
+            # Messages may be acknowledged from other threads
+            self.connection.add_callback_threadsafe(
+                lambda: self.channel.basic_ack(delivery_tag=delivery_tag)
+            )
+
+        return ack
+
+    def stop(self) -> None:
+        self.connection.add_callback_threadsafe(self.channel.stop_consuming)
+
+
+class AmqpTransport(Transport):
+    def __init__(self, broker_dsn: str, confirms: bool = PUBLISHER_CONFIRMS):
+        self.broker_dsn = broker_dsn
+        self.confirms = confirms
+        self._local = threading.local()
+        self._connections: list[PublisherConnection] = []
+        self._lock = threading.Lock()
+
+    def connect(self) -> PublisherConnection:
+        # Create a connection to the RabbitMQ broker for the current thread
+        connection = PublisherConnection(self.broker_dsn, self.confirms)
+        self._local.connection = connection
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    def _connection(self) -> PublisherConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None or not connection.connection.is_open:
+            connection = self.connect()
+        return connection
+
+    def _reconnect(self) -> PublisherConnection:
+        connection = self._local.connection
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        try:
+            connection.close()
+        except pika.exceptions.AMQPError:
+            pass
+
+        return self.connect()
+
+    def _publish_with_retries(self, send) -> None:
+        """Calls `send` with a connection, reconnecting when it fails."""
+        for attempt in range(PUBLISH_RETRIES + 1):
+            connection = self._connection()
+            try:
+                send(connection)
+                return
+            except pika.exceptions.AMQPError as e:
+                if attempt == PUBLISH_RETRIES:
+                    raise
+                logger.warning(f"Publishing failed: {e!r}. Reconnecting..")
+                self._reconnect()
+
+    @staticmethod
+    def _basic_publish(channel, routing_key: str, body: bytes) -> None:
+        channel.basic_publish(
+            exchange=EXCHANGE,
+            routing_key=routing_key,
+            body=body,
+            # Make messages persistent
+            properties=pika.BasicProperties(delivery_mode=2),
+        )
+
+    def publish(self, routing_key: str, body: bytes) -> None:
+        batch = getattr(self._local, "batch", None)
+        if batch is not None:
+            batch.append((routing_key, body))
+            return
+
+        self._publish_with_retries(
+            lambda connection: self._basic_publish(
+                connection.channel, routing_key, body
+            )
+        )
+
+    def subscribe(
+        self,
+        binding_key: str,
+        prefetch: int | None = None,
+        queue_name: str | None = None,
+    ) -> Subscription:
+        return AmqpSubscription(self.broker_dsn, binding_key, prefetch, queue_name)
+
+    @contextmanager
+    def batch(self):
+        """
+        Collects the messages published inside the block and publishes them
+        in one transaction when it exits, so the broker accepts all of them
+        with a single round trip. Blocking channels wait for the confirm of
+        each message, which is why confirms are not used here. The messages
+        are kept until the commit, on a lost connection the uncommitted
+        transaction is published again on a new one, so every message was
+        accepted once the block exits. Nothing is published if the block
+        raises.
+        """
+        if getattr(self._local, "batch", None) is not None:
+            # Nested batches are part of the outer one
+            yield self
+            return
+
+        messages = self._local.batch = []
+        try:
+            yield self
+        finally:
+            self._local.batch = None
+        self._publish_committed(messages)
+
+    def _publish_committed(self, messages: list[tuple[str, bytes]]) -> None:
+        def send(connection: PublisherConnection):
+            channel = connection.batch_channel()
+            for routing_key, body in messages:
+                self._basic_publish(channel, routing_key, body)
+            # Waits once, for the broker to accept the whole batch
+            channel.tx_commit()
+
+        self._publish_with_retries(send)
+
+    def close(self) -> None:
+        # Close the connections to the broker
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
@@ -0,0 +1,68 @@
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Callable
+
+# Called with the routing key, the message body and a function acknowledging
+# the message
+MessageCallback = Callable[[str, bytes, Callable[[], None]], None]
+
+
+def no_ack() -> None:
+    pass
+
+
+@lru_cache(maxsize=1024)
+def topic_matches(binding_key: str, routing_key: str) -> bool:
+    """
+    AMQP topic matching, "*" matches exactly one word and "#" matches zero
+    or more words.
+    """
+    return _words_match(tuple(binding_key.split(".")), tuple(routing_key.split(".")))
+
+
+def _words_match(pattern: tuple[str, ...], words: tuple[str, ...]) -> bool:
+    if not pattern:
+        return not words
+
+    head, rest = pattern[0], pattern[1:]
+    if head == "#":
+        return any(_words_match(rest, words[skip:]) for skip in range(len(words) + 1))
+    if not words:
+        return False
+    return (head == "*" or head == words[0]) and _words_match(rest, words[1:])
+
+
+class Subscription:
+    """Messages routed to a binding key, queued from the moment of subscribing."""
+
+    def consume(self, callback: MessageCallback, auto_ack: bool = True) -> None:
+        """Delivers messages to the callback until `stop` is called."""
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        raise NotImplementedError
+
+
+class Transport:
+    def publish(self, routing_key: str, body: bytes) -> None:
+        raise NotImplementedError
+
+    def subscribe(
+        self,
+        binding_key: str,
+        prefetch: int | None = None,
+        queue_name: str | None = None,
+    ) -> Subscription:
+        """
+        Given a queue name, transports that support it keep the messages in
+        a durable queue of that name, which a subscriber created with the
+        same name after a restart consumes again.
+        """
+        raise NotImplementedError
+
+    def batch(self):
+        """Groups the messages published inside the block, if supported."""
+        return nullcontext()
+
+    def close(self) -> None:
+        pass
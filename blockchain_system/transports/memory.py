@@ -0,0 +1,72 @@
+import queue
+import threading
+
+from blockchain_system.transports.base import (
+    MessageCallback,
+    Subscription,
+    Transport,
+    no_ack,
+    topic_matches,
+)
+
+_STOP = object()
+
+
+class InProcessBroker:
+    """Topic exchange delivering messages to queues in the same process."""
+
+    def __init__(self):
+        self._queues: list[tuple[str, queue.Queue]] = []
+        self._lock = threading.Lock()
+
+    def bind(self, binding_key: str) -> queue.Queue:
+        messages = queue.Queue()
+        with self._lock:
+            self._queues.append((binding_key, messages))
+        return messages
+
+    def unbind(self, messages: queue.Queue) -> None:
+        with self._lock:
+            self._queues = [
+                (binding_key, bound)
+                for binding_key, bound in self._queues
+                if bound is not messages
+            ]
+
+    def publish(self, routing_key: str, body: bytes) -> None:
+        with self._lock:
+            queues = list(self._queues)
+        for binding_key, messages in queues:
+            if topic_matches(binding_key, routing_key):
+                messages.put((routing_key, body))
+
+
+class InProcessSubscription(Subscription):
+    def __init__(self, broker: InProcessBroker, binding_key: str):
+        self.broker = broker
+        self.messages = broker.bind(binding_key)
+
+    def consume(self, callback: MessageCallback, auto_ack: bool = True) -> None:
+        while (message := self.messages.get()) is not _STOP:
+            routing_key, body = message
+            callback(routing_key, body, no_ack)
+        self.broker.unbind(self.messages)
+
+    def stop(self) -> None:
+        self.messages.put(_STOP)
+
+
+class InProcessTransport(Transport):
+    def __init__(self, broker: InProcessBroker):
+        self.broker = broker
+
+    def publish(self, routing_key: str, body: bytes) -> None:
+        self.broker.publish(routing_key, body)
+
+    def subscribe(
+        self,
+        binding_key: str,
+        prefetch: int | None = None,
+        queue_name: str | None = None,
+    ) -> Subscription:
+        return InProcessSubscription(self.broker, binding_key)
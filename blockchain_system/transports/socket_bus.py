@@ -0,0 +1,292 @@
+"""
+A small topic bus for nodes running on one host, without a broker.
+
+The bus is a hub accepting TCP or Unix socket connections. Each frame is
+a kind byte and the payload length, followed by the payload. A client
+sends SUBSCRIBE with a binding key, answered by SUBSCRIBED once the
+binding is active, and PUBLISH with a routing key and a body. The hub
+forwards every published message as MESSAGE to the connections with a
+matching binding key. Each connection has its own writer thread and a
+bounded buffer, so a client that stops reading never blocks publishers,
+its messages are dropped once the buffer is full.
+"""
+import os
+import socket
+import socketserver
+import struct
+import threading
+from collections import deque
+from logging import getLogger
+from urllib.parse import urlparse
+
+from blockchain_system.transports.base import (
+    MessageCallback,
+    Subscription,
+    Transport,
+    no_ack,
+    topic_matches,
+)
+
+SUBSCRIBE = b"S"
+SUBSCRIBED = b"A"
+PUBLISH = b"P"
+MESSAGE = b"M"
+
+# Bytes of frames queued for one client, frames for a client that stopped
+# reading are dropped beyond this
+SOCKET_BUS_CLIENT_BUFFER = 64 * 1024 * 1024
+
+_FRAME_HEADER = struct.Struct("<cI")
+_ROUTING_KEY_LENGTH = struct.Struct("<H")
+
+logger = getLogger(__name__)
+
+
+def parse_address(address: str) -> tuple[int, str | tuple[str, int]]:
+    """Parses "tcp://host:port" or "unix:///path/to/socket"."""
+    url = urlparse(address)
+    if url.scheme == "tcp":
+        return socket.AF_INET, (url.hostname, url.port)
+    if url.scheme == "unix":
+        return socket.AF_UNIX, url.path
+    raise ValueError(f"Unsupported socket bus address {address}")
+
+
+def _receive_exactly(sock: socket.socket, length: int) -> bytes | None:
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def read_frame(sock: socket.socket) -> tuple[bytes, bytes] | None:
+    """Returns the kind and payload of the next frame, None on disconnect."""
+    header = _receive_exactly(sock, _FRAME_HEADER.size)
+    if header is None:
+        return None
+    kind, length = _FRAME_HEADER.unpack(header)
+    payload = _receive_exactly(sock, length)
+    if payload is None:
+        return None
+    return kind, payload
+
+
+def encode_frame(kind: bytes, payload: bytes = b"") -> bytes:
+    return _FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+def encode_message(routing_key: str, body: bytes) -> bytes:
+    encoded_key = routing_key.encode()
+    return _ROUTING_KEY_LENGTH.pack(len(encoded_key)) + encoded_key + body
+
+
+def decode_message(payload: bytes) -> tuple[str, bytes]:
+    (length,) = _ROUTING_KEY_LENGTH.unpack_from(payload)
+    start = _ROUTING_KEY_LENGTH.size
+    return payload[start : start + length].decode(), payload[start + length :]
+
+
+class _ClientHandler(socketserver.BaseRequestHandler):
+    server: "_BusServerMixin"
+
+    def setup(self):
+        self._outbox: deque[bytes] = deque()
+        self._outbox_bytes = 0
+        self._outbox_ready = threading.Condition()
+        self._closed = False
+        # Frames dropped because the client did not read them in time
+        self.dropped = 0
+        self._writer = threading.Thread(
+            target=self._write, name="socket-bus-writer", daemon=True
+        )
+        self._writer.start()
+
+    def send(self, frame: bytes) -> bool:
+        """
+        Queues the frame for the writer thread without blocking, returns
+        False if it was dropped.
+        """
+        with self._outbox_ready:
+            if self._closed:
+                return False
+            if (
+                self._outbox
+                and self._outbox_bytes + len(frame) > SOCKET_BUS_CLIENT_BUFFER
+            ):
+                if not self.dropped:
+                    logger.warning("Dropping messages for a client not reading")
+                self.dropped += 1
+                return False
+            self._outbox.append(frame)
+            self._outbox_bytes += len(frame)
+            self._outbox_ready.notify()
+            return True
+
+    def _write(self) -> None:
+        while True:
+            with self._outbox_ready:
+                self._outbox_ready.wait_for(lambda: self._outbox or self._closed)
+                if not self._outbox:
+                    return
+                # Queued frames go out in one write
+                frames = b"".join(self._outbox)
+                self._outbox.clear()
+                self._outbox_bytes = 0
+            try:
+                self.request.sendall(frames)
+            except OSError:
+                with self._outbox_ready:
+                    self._closed = True
+                    self._outbox.clear()
+                return
+
+    def handle(self):
+        while (frame := read_frame(self.request)) is not None:
+            kind, payload = frame
+            if kind == SUBSCRIBE:
+                self.server.bind(payload.decode(), self)
+            elif kind == PUBLISH:
+                routing_key, _ = decode_message(payload)
+                self.server.route(routing_key, encode_frame(MESSAGE, payload))
+
+    def finish(self):
+        self.server.unbind(self)
+        with self._outbox_ready:
+            self._closed = True
+            self._outbox_ready.notify()
+
+
+class _BusServerMixin:
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def init_bindings(self):
+        self._bindings: list[tuple[str, _ClientHandler]] = []
+        self._bindings_lock = threading.Lock()
+
+    def bind(self, binding_key: str, client: _ClientHandler) -> None:
+        with self._bindings_lock:
+            # Messages routed after the binding follow SUBSCRIBED
+            client.send(encode_frame(SUBSCRIBED))
+            self._bindings.append((binding_key, client))
+
+    def unbind(self, client: _ClientHandler) -> None:
+        with self._bindings_lock:
+            self._bindings = [
+                (binding_key, bound)
+                for binding_key, bound in self._bindings
+                if bound is not client
+            ]
+
+    def route(self, routing_key: str, frame: bytes) -> None:
+        with self._bindings_lock:
+            bindings = list(self._bindings)
+        for binding_key, client in bindings:
+            if topic_matches(binding_key, routing_key):
+                client.send(frame)
+
+
+class _TcpBusServer(_BusServerMixin, socketserver.ThreadingTCPServer):
+    pass
+
+
+class _UnixBusServer(_BusServerMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class SocketBusServer:
+    def __init__(self, address: str):
+        family, server_address = parse_address(address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(server_address):
+                os.remove(server_address)
+            self.server = _UnixBusServer(server_address, _ClientHandler)
+        else:
+            self.server = _TcpBusServer(server_address, _ClientHandler)
+        self.server.init_bindings()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def address(self) -> str:
+        if isinstance(self.server, _UnixBusServer):
+            return f"unix://{self.server.server_address}"
+        host, port = self.server.server_address[:2]
+        return f"tcp://{host}:{port}"
+
+    def serve_forever(self) -> None:
+        logger.info(f"Socket bus listening on {self.address}")
+        self.server.serve_forever()
+
+    def start(self) -> "SocketBusServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def connect(address: str) -> socket.socket:
+    family, server_address = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(server_address)
+    if family == socket.AF_INET:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class SocketSubscription(Subscription):
+    def __init__(self, address: str, binding_key: str):
+        self.sock = connect(address)
+        self.sock.sendall(encode_frame(SUBSCRIBE, binding_key.encode()))
+        # Messages published after subscribing are never missed
+        if read_frame(self.sock) != (SUBSCRIBED, b""):
+            raise ConnectionError(f"Subscribing to {binding_key} failed")
+
+    def consume(self, callback: MessageCallback, auto_ack: bool = True) -> None:
+        try:
+            while (frame := read_frame(self.sock)) is not None:
+                routing_key, body = decode_message(frame[1])
+                callback(routing_key, body, no_ack)
+        except OSError:
+            pass
+        finally:
+            self.sock.close()
+
+    def stop(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class SocketTransport(Transport):
+    def __init__(self, address: str):
+        self.address = address
+        self._sock: socket.socket | None = None
+        self._lock = threading.Lock()
+
+    def publish(self, routing_key: str, body: bytes) -> None:
+        frame = encode_frame(PUBLISH, encode_message(routing_key, body))
+        with self._lock:
+            if self._sock is None:
+                self._sock = connect(self.address)
+            self._sock.sendall(frame)
+
+    def subscribe(
+        self,
+        binding_key: str,
+        prefetch: int | None = None,
+        queue_name: str | None = None,
+    ) -> Subscription:
+        return SocketSubscription(self.address, binding_key)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
@@ -0,0 +1,88 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from blockchain_system.blockchain import (
+    Block,
+    BlockHasher,
+    difficulty_target,
+    digest_to_hash,
+)
+
+
+def first_invalid_proof(blocks: list[Block], difficulty: int) -> int | None:
+    """
+    Returns the index of the first block whose hash is not a valid proof or
+    whose records do not match its Merkle root.
+    """
+    target = difficulty_target(difficulty)
+
+    for block in blocks:
+        digest = BlockHasher.from_block(block).digest(block.nonce)
+        if (
+            int.from_bytes(digest, "big") >= target
+            or digest_to_hash(digest) != block.hash
+            or not block.has_valid_merkle_root()
+        ):
+            return block.index
+
+    return None
+
+
+class ParallelValidator:
+    """
+    Verifies block proofs in chunks on a pool of worker processes. Proofs
+    are independent of each other, so chunks are checked concurrently, and
+    results are read in chunk order to report the first invalid block.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def find_invalid_proof(
+        self, blocks: list[Block], difficulty: int, chunk_size: int
+    ) -> int | None:
+        futures = [
+            self._executor.submit(
+                first_invalid_proof, blocks[start : start + chunk_size], difficulty
+            )
+            for start in range(0, len(blocks), chunk_size)
+        ]
+
+        try:
+            for future in futures:
+                invalid_index = future.result()
+                if invalid_index is not None:
+                    return invalid_index
+        finally:
+            # Chunks after an invalid block that have not started are dropped
+            for future in futures:
+                future.cancel()
+
+        return None
+
+    def shutdown(self):
+        self._executor.shutdown(cancel_futures=True)
+
+
+_validators: dict[int, ParallelValidator] = {}
+_validators_lock = threading.Lock()
+
+
+def get_parallel_validator(workers: int) -> ParallelValidator:
+    with _validators_lock:
+        if workers not in _validators:
+            _validators[workers] = ParallelValidator(workers)
+        return _validators[workers]
+
+
+def shutdown_parallel_validators() -> None:
+    """Stops the worker processes, the next validation starts a new pool."""
+    with _validators_lock:
+        validators = list(_validators.values())
+        _validators.clear()
+    for validator in validators:
+        validator.shutdown()
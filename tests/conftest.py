@@ -0,0 +1,56 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from blockchain_system.blockchain import Block, Record
+from blockchain_system.blockchain_repository import PendingBlocksRepository
+from blockchain_system.services import _proof_of_work
+
+
+def _mine_blocks(previous_block: Block, count: int, content: str) -> list[Block]:
+    blocks = []
+    with patch("blockchain_system.services.POW_DIFFICULTY", 4):
+        for _ in range(count):
+            block = Block(
+                index=previous_block.index + 1,
+                previous_hash=previous_block.hash,
+                side_links=[],
+                timestamp=previous_block.timestamp + 1,
+                records=[Record(index=0, timestamp=0, content=content)],
+            )
+            block.hash = _proof_of_work(block)
+            blocks.append(block)
+            previous_block = block
+    return blocks
+
+
+@pytest.fixture
+def mine_blocks():
+    """Mines `count` blocks with one record each on top of a block."""
+    return _mine_blocks
+
+
+@pytest.fixture
+def waiting_for_slot(monkeypatch):
+    """
+    Returns an event set once a block waits for a slot of the full pending
+    blocks repository.
+    """
+
+    def wait_for_slot(pending_blocks_repository: PendingBlocksRepository):
+        waiting = threading.Event()
+        has_free_slot = pending_blocks_repository._has_free_slot
+
+        def has_free_slot_or_wait() -> bool:
+            if has_free_slot():
+                return True
+            waiting.set()
+            return False
+
+        monkeypatch.setattr(
+            pending_blocks_repository, "_has_free_slot", has_free_slot_or_wait
+        )
+        return waiting
+
+    return wait_for_slot
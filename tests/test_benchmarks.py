@@ -0,0 +1,44 @@
+from blockchain_system import benchmarks, blockchain_repository, services
+
+
+def test_find_regressions():
+    baselines = {"compute_hash": 1.0, "side_links_1000": 2.0}
+    results = {"compute_hash": 1.2, "side_links_1000": 3.0, "new_benchmark": 5.0}
+
+    regressions = benchmarks.find_regressions(results, baselines, threshold=0.25)
+
+    assert list(regressions) == ["side_links_1000"]
+    assert regressions["side_links_1000"] == 0.5
+
+
+def test_save_baselines_merges(tmp_path):
+    path = str(tmp_path / "baselines.json")
+    benchmarks.save_baselines({"compute_hash": 1.0, "side_links_1000": 2.0}, path)
+    benchmarks.save_baselines({"compute_hash": 0.5}, path)
+
+    assert benchmarks.load_baselines(path) == {
+        "compute_hash": 0.5,
+        "side_links_1000": 2.0,
+    }
+
+
+def test_benchmark_chain_is_valid():
+    difficulty = services.POW_DIFFICULTY
+    assert benchmarks.bench_check_chain_validity(50) > 0
+    assert services.POW_DIFFICULTY == difficulty
+    assert benchmarks.bench_pending_blocks(10) > 0
+
+
+def test_compact_chain_uses_less_memory():
+    compact = benchmarks.bench_memory_per_block(200, compact=True)
+    assert compact < benchmarks.bench_memory_per_block(200, compact=False)
+
+
+def test_repository_holds_blocks_once(monkeypatch):
+    monkeypatch.setattr(blockchain_repository, "CHAIN_CHUNK_SIZE", 50)
+    repository = benchmarks.bench_repository_memory_per_block(500)
+    assert repository < 1.25 * benchmarks.bench_memory_per_block(500, compact=False)
+
+
+def test_set_chain_benchmark_extends_the_chain():
+    assert benchmarks.bench_extend_chain(200, blocks=3) > 0
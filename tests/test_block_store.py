@@ -0,0 +1,226 @@
+import os
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from blockchain_system import blockchain_repository
+from blockchain_system.block_store import (
+    _INDEX_ENTRY,
+    _INDEX_GROWTH,
+    _INDEX_HEADER,
+    HASHES_FILE_NAME,
+    INDEX_FILE_NAME,
+    LOG_FILE_NAME,
+    BlockStore,
+)
+from blockchain_system.blockchain import Block, Blockchain, Record
+from blockchain_system.blockchain_repository import BlockchainRepository
+from blockchain_system.codec import BinaryCodec
+from blockchain_system.record_index import RecordIndex
+
+
+def _block(index: int, content: str = "") -> Block:
+    return Block(
+        index=index,
+        previous_hash=str(index - 1),
+        side_links=[],
+        timestamp=1684000000 + index,
+        records=[Record(index=0, timestamp=1684000000, content=content)],
+        hash=str(index) + content,
+    )
+
+
+@pytest.fixture
+def store_directory(tmp_path):
+    return str(tmp_path / "store")
+
+
+def test_write_and_reopen(store_directory):
+    store = BlockStore(store_directory)
+    for index in range(5):
+        store.write(index, _block(index))
+    store.write(3, _block(3, "replacement"))
+    store.close()
+
+    store = BlockStore(store_directory)
+    assert len(store) == 4
+    assert store.read(3) == _block(3, "replacement")
+    assert store.read_by_hash("3replacement") == _block(3, "replacement")
+    assert store.read_by_hash("4") is None
+    assert store.read_chain() == [
+        _block(0),
+        _block(1),
+        _block(2),
+        _block(3, "replacement"),
+    ]
+    store.close()
+
+
+def test_truncate_survives_reopen(store_directory):
+    store = BlockStore(store_directory)
+    for index in range(3):
+        store.write(index, _block(index))
+    store.truncate(1)
+    store.close()
+
+    store = BlockStore(store_directory)
+    assert store.read_chain() == [_block(0)]
+    store.close()
+
+
+def test_recover_torn_tail(store_directory):
+    store = BlockStore(store_directory)
+    for index in range(3):
+        store.write(index, _block(index))
+    store.close()
+
+    log_path = os.path.join(store_directory, LOG_FILE_NAME)
+    log_size = os.path.getsize(log_path)
+    with open(log_path, "r+b") as log:
+        log.truncate(log_size - 5)
+
+    store = BlockStore(store_directory)
+    assert store.read_chain() == [_block(0), _block(1)]
+    store.write(2, _block(2, "rewritten"))
+    store.close()
+
+    store = BlockStore(store_directory)
+    assert store.read_chain() == [_block(0), _block(1), _block(2, "rewritten")]
+    store.close()
+
+
+def test_repository_restart(store_directory):
+    repository = object.__new__(BlockchainRepository)
+    repository.__init__(store_directory=store_directory)
+    genesis_block = repository.get_last_block()
+    block = Block(1, genesis_block.hash, [], 1234, [], "3434", 0)
+    repository.add_or_replace(block)
+    repository.set_chain(Blockchain(chain=[genesis_block, _block(1, "fork")]))
+    repository._store.close()
+
+    restarted = object.__new__(BlockchainRepository)
+    restarted.__init__(store_directory=store_directory)
+    assert restarted.chain == [genesis_block, _block(1, "fork")]
+    assert restarted.get_block_by_hash("1fork") == _block(1, "fork")
+    restarted._store.close()
+
+
+def test_hash_index_is_kept_on_disk(store_directory):
+    store = BlockStore(store_directory)
+    index_path = os.path.join(store_directory, INDEX_FILE_NAME)
+    assert os.path.getsize(index_path) == _INDEX_HEADER.size + (
+        _INDEX_GROWTH * _INDEX_ENTRY.size
+    )
+    for index in range(5):
+        store.write(index, _block(index))
+    # Replaced blocks leave dead slots behind
+    for _ in range(3):
+        store.truncate(3)
+        store.write(3, _block(3, "again"))
+    store.close()
+
+    with patch.object(BlockStore, "_rebuild_hashes") as rebuild_hashes:
+        store = BlockStore(store_directory)
+        assert store.position_of("3again") == 3
+        assert store.position_of("2") == 2
+        assert store.position_of("3") is None and store.position_of("4") is None
+        rebuild_hashes.assert_not_called()
+        store.close()
+
+    os.remove(os.path.join(store_directory, HASHES_FILE_NAME))
+    store = BlockStore(store_directory)
+    assert store.read_by_hash("3again") == _block(3, "again")
+    store.close()
+
+
+def _linked_blocks(previous_block: Block, names: list[str]) -> list[Block]:
+    blocks = []
+    for name in names:
+        previous_block = Block(
+            previous_block.index + 1,
+            previous_block.hash,
+            [],
+            1234,
+            [Record(index=0, timestamp=1684000000, content=f"Record {name}")],
+            name,
+            0,
+        )
+        blocks.append(previous_block)
+    return blocks
+
+
+def test_repository_restart_reads_blocks_lazily(store_directory, monkeypatch):
+    monkeypatch.setattr(blockchain_repository, "CHAIN_CHUNK_SIZE", 2)
+    monkeypatch.setattr(blockchain_repository, "FINALITY_DEPTH", 3)
+    repository = object.__new__(BlockchainRepository)
+    repository.__init__(store_directory=store_directory)
+    genesis_block = repository.get_last_block()
+    chain = [genesis_block] + _linked_blocks(genesis_block, ["1", "2", "3", "4"])
+    chain += _linked_blocks(chain[-1], ["5", "6"])
+    repository.chain = chain
+    repository._store.close()
+
+    with patch.object(
+        BinaryCodec, "decode", autospec=True, side_effect=BinaryCodec.decode
+    ) as decode:
+        restarted = object.__new__(BlockchainRepository)
+        restarted.__init__(store_directory=store_directory)
+        # The tail and the blocks that are not final yet
+        assert decode.call_count == 4
+    assert restarted.chain == chain
+    assert restarted.get_block_by_hash("2") == chain[2]
+    assert restarted.find_records("record 3")[0].block_hash == "3"
+
+    snapshot = restarted.get_snapshot()
+    branch = chain[:4] + _linked_blocks(chain[3], ["4b", "5b", "6b", "7b"])
+    for block in branch[4:]:
+        restarted.add_or_replace(block)
+    assert restarted.chain == branch
+    assert snapshot == chain
+    assert restarted.get_block_by_hash("5") is None
+    assert restarted.find_records("record 5") == []
+    restarted._store.close()
+
+    restarted = object.__new__(BlockchainRepository)
+    restarted.__init__(store_directory=store_directory)
+    assert restarted.chain == branch
+    assert restarted.get_block_by_hash("1") == chain[1]
+    restarted._store.close()
+
+
+def test_record_index_is_built_without_the_chain_lock(store_directory, monkeypatch):
+    monkeypatch.setattr(blockchain_repository, "FINALITY_DEPTH", 3)
+    repository = object.__new__(BlockchainRepository)
+    repository.__init__(store_directory=store_directory)
+    genesis_block = repository.get_last_block()
+    chain = [genesis_block] + _linked_blocks(genesis_block, ["1", "2", "3", "4"])
+    repository.chain = chain
+    repository._store.close()
+
+    restarted = object.__new__(BlockchainRepository)
+    restarted.__init__(store_directory=store_directory)
+    branch = chain[:3] + _linked_blocks(chain[2], ["3b", "4b", "5b"])
+    switched = threading.Thread(
+        target=lambda: [restarted.add_or_replace(block) for block in branch[3:]]
+    )
+    add_block = RecordIndex.add_block
+
+    def add_block_while_switching(record_index, height, block):
+        # The chain switches while the index is being built
+        if switched.ident is None:
+            switched.start()
+            switched.join(timeout=5)
+            assert not switched.is_alive()
+        add_block(record_index, height, block)
+
+    monkeypatch.setattr(RecordIndex, "add_block", add_block_while_switching)
+    assert restarted.find_records("record 4") == []
+    assert [match.block_hash for match in restarted.find_records("record")] == [
+        "1",
+        "2",
+        "3b",
+        "4b",
+        "5b",
+    ]
+    restarted._store.close()
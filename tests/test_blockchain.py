@@ -0,0 +1,64 @@
+import hashlib
+
+import pytest
+
+from blockchain_system.blockchain import (
+    Block,
+    BlockHasher,
+    Record,
+    RecordProof,
+    compute_merkle_root,
+)
+
+
+def _block(records: int) -> Block:
+    block = Block(
+        index=3,
+        previous_hash="0" * 256,
+        side_links=["1" * 256],
+        timestamp=1234,
+        records=[
+            Record(index=i, timestamp=1234, content=f"Transaction {i}")
+            for i in range(records)
+        ],
+        nonce=42,
+    )
+    block.hash = block.compute_hash()
+    return block
+
+
+def test_compute_hash_matches_header_serialization():
+    block = _block(1)
+    header_string = str(block.header().to_dict())
+    expected = format(
+        int(hashlib.sha256(header_string.encode()).hexdigest(), 16), "0>256b"
+    )
+
+    assert block.compute_hash() == expected
+    assert BlockHasher.from_block(block).compute_hash(42) == expected
+
+
+def test_hash_commits_to_records():
+    block = _block(3)
+    block.records[1].content = "Forged"
+
+    assert not block.has_valid_merkle_root()
+    assert compute_merkle_root(block.records) != block.merkle_root
+
+
+@pytest.mark.parametrize("records", [1, 2, 5, 8])
+def test_record_proofs(records):
+    block = _block(records)
+
+    for position in range(records):
+        proof = block.record_proof(position)
+        assert proof.verify()
+        assert RecordProof.from_json(proof.to_json()).verify()
+
+
+def test_record_proof_rejects_other_record():
+    block = _block(5)
+    proof = block.record_proof(2)
+    proof.record = Record(index=2, timestamp=1234, content="Forged")
+
+    assert not proof.verify()
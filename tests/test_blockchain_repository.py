@@ -3,9 +3,14 @@ import time
 
 import pytest
 
-from blockchain_system.blockchain import Block, PendingBlock
+from blockchain_system import blockchain_repository as blockchain_repository_module
+from blockchain_system.blockchain import Block, Blockchain, PendingBlock, Record
 from blockchain_system.blockchain_repository import (
+    MAX_PENDING_BLOCKS,
+    PENDING_BLOCKS_FULL_POLICY,
     BlockchainRepository,
+    ChainDraft,
+    PendingBlocksFullException,
     PendingBlocksRepository,
     locked_chain,
 )
@@ -15,7 +20,7 @@ from blockchain_system.blockchain_repository import (
 def pending_blocks_repository():
     repo = PendingBlocksRepository()
     yield repo
-    repo.pending_blocks = []
+    repo.clear()
 
 
 @pytest.fixture
@@ -55,19 +60,379 @@ class TestPendingBlockchainRepository:
         assert pending_blocks_repository.pop().index == 0
         assert pending_blocks_repository.pop().index == 1
 
+    def test_pop_empty(self, pending_blocks_repository: PendingBlocksRepository):
+        assert pending_blocks_repository.pop() is None
+        assert pending_blocks_repository.get(timeout=0.01) is None
+
+    def test_get_wakes_up_on_add(
+        self, pending_blocks_repository: PendingBlocksRepository
+    ):
+        block = PendingBlock(index=0, records=[])
+        timer = threading.Timer(0.1, pending_blocks_repository.add, args=(block,))
+        timer.start()
+
+        start = time.monotonic()
+        assert pending_blocks_repository.get(timeout=5) is block
+        assert time.monotonic() - start < 1
+        timer.join()
+
+    def test_add_when_full(self, pending_blocks_repository: PendingBlocksRepository):
+        pending_blocks_repository.maxsize = 1
+        pending_blocks_repository.add(PendingBlock(index=0, records=[]))
+
+        try:
+            pending_blocks_repository.full_policy = "reject"
+            with pytest.raises(PendingBlocksFullException):
+                pending_blocks_repository.add(PendingBlock(index=1, records=[]))
+
+            pending_blocks_repository.full_policy = "block"
+            with pytest.raises(PendingBlocksFullException):
+                pending_blocks_repository.add(
+                    PendingBlock(index=1, records=[]), timeout=0.01
+                )
+
+            thread = threading.Thread(
+                target=pending_blocks_repository.add,
+                args=(PendingBlock(index=1, records=[]),),
+            )
+            thread.start()
+            assert pending_blocks_repository.pop().index == 0
+            thread.join(timeout=1)
+            assert pending_blocks_repository.pop().index == 1
+        finally:
+            pending_blocks_repository.maxsize = MAX_PENDING_BLOCKS
+            pending_blocks_repository.full_policy = PENDING_BLOCKS_FULL_POLICY
+
 
 class TestBlockchainRepository:
-    def test_get_chain(self, blockchain_repository: BlockchainRepository):
-        block = Block(0, "", [], 1234, [], "3434", 0)
+    def test_get_chain(self, blockchain_repository: BlockchainRepository, monkeypatch):
+        block = Block(1, "", [], 1234, [], "3434", 0)
         thread = threading.Thread(
             target=blockchain_repository.add_or_replace, args=(block,)
         )
+        waiting = threading.Event()
+        acquire = blockchain_repository._lock.acquire
 
-        with locked_chain(blockchain_repository) as blockchain:
+        def acquire_waiting(*args, **kwargs):
+            if threading.current_thread() is thread:
+                waiting.set()
+            return acquire(*args, **kwargs)
+
+        monkeypatch.setattr(blockchain_repository._lock, "acquire", acquire_waiting)
+
+        with locked_chain(blockchain_repository) as snapshot:
             thread.start()
-            time.sleep(2)
-            assert blockchain.length == 1
+            # The writer waits for the lock while readers see the old chain
+            assert waiting.wait(timeout=5)
+            assert len(snapshot) == 1
+            assert blockchain_repository.get_chain().length == 1
 
         thread.join()
         blockchain = blockchain_repository.get_chain()
         assert blockchain.length == 2
+
+    def test_indexes(self, blockchain_repository: BlockchainRepository):
+        chain = blockchain_repository.chain
+        genesis_block = blockchain_repository.create_genesis_block()
+        blockchain_repository.chain = [genesis_block]
+        block = Block(1, genesis_block.hash, [], 1234, [], "3434", 0)
+        replacement = Block(1, genesis_block.hash, [], 1233, [], "3535", 0)
+
+        try:
+            blockchain_repository.add_or_replace(block)
+            assert blockchain_repository.get_block_by_hash("3434") is block
+            assert blockchain_repository.get_block_by_height(1) is block
+
+            blockchain_repository.add_or_replace(replacement)
+            assert blockchain_repository.get_block_by_hash("3434") is None
+            assert blockchain_repository.get_block_by_hash("3535") is replacement
+            assert blockchain_repository.get_block_by_height(1) is replacement
+        finally:
+            blockchain_repository.chain = chain
+
+    def test_sample_side_links(self, blockchain_repository: BlockchainRepository):
+        chain = blockchain_repository.chain
+        blockchain_repository.chain = [
+            Block(index, str(index - 1), [], 1234, [], str(index), 0)
+            for index in range(10)
+        ]
+
+        try:
+            assert blockchain_repository.sample_side_links(20) == [
+                str(index) for index in range(9)
+            ]
+            side_links = blockchain_repository.sample_side_links(2)
+            assert len(side_links) == 2
+            assert set(side_links) < {str(index) for index in range(9)}
+        finally:
+            blockchain_repository.chain = chain
+
+
+@pytest.fixture
+def block_tree():
+    repository = object.__new__(BlockchainRepository)
+    repository.__init__(store_directory=None)
+    return repository
+
+
+def _child(parent: Block, name: str, timestamp: int = 1234) -> Block:
+    return Block(parent.index + 1, parent.hash, [], timestamp, [], name, 0)
+
+
+class TestBlockTree:
+    def test_reorg_to_branch_with_more_work(self, block_tree: BlockchainRepository):
+        genesis_block = block_tree.get_last_block()
+        block_1a = _child(genesis_block, "1a")
+        block_2a = _child(block_1a, "2a")
+        block_1b = _child(genesis_block, "1b")
+        block_2b = _child(block_1b, "2b")
+        block_3b = _child(block_2b, "3b")
+
+        for block in [block_1a, block_2a, block_1b, block_2b]:
+            block_tree.add_or_replace(block)
+        assert block_tree.chain == [genesis_block, block_1a, block_2a]
+
+        block_tree.add_or_replace(block_3b)
+        assert block_tree.chain == [genesis_block, block_1b, block_2b, block_3b]
+        assert block_tree.get_block_by_hash("2a") is None
+        assert block_tree.get_block_by_height(1) is block_1b
+        assert block_tree.replaced_blocks == 2
+
+    def test_orphans_connect_when_parent_arrives(
+        self, block_tree: BlockchainRepository
+    ):
+        genesis_block = block_tree.get_last_block()
+        block_1 = _child(genesis_block, "1")
+        block_2 = _child(block_1, "2")
+        block_3 = _child(block_2, "3")
+
+        block_tree.add_or_replace(block_3)
+        block_tree.add_or_replace(block_2)
+        assert block_tree.is_orphan("3") and block_tree.is_orphan("2")
+        assert block_tree.chain == [genesis_block]
+
+        block_tree.add_or_replace(block_1)
+        assert block_tree.chain == [genesis_block, block_1, block_2, block_3]
+        assert block_tree.orphan_count() == 0
+        assert block_tree.orphaned_blocks == 2
+
+    def test_blocks_with_wrong_index_are_ignored(
+        self, block_tree: BlockchainRepository
+    ):
+        genesis_block = block_tree.get_last_block()
+        block_1 = _child(genesis_block, "1")
+        skipping = Block(5, block_1.hash, [], 1234, [], "2", 0)
+        repeating = Block(1, "x", [], 1234, [], "2x", 0)
+        parent_of_repeating = _child(block_1, "x")
+
+        block_tree.add_or_replace(block_1)
+        block_tree.add_or_replace(skipping)
+        block_tree.add_or_replace(repeating)
+        block_tree.add_or_replace(parent_of_repeating)
+
+        assert block_tree.chain == [genesis_block, block_1, parent_of_repeating]
+        assert not block_tree.is_in_tree("2") and not block_tree.is_in_tree("2x")
+        assert block_tree.orphan_count() == 0
+
+    def test_set_chain_connects_orphans(self, block_tree: BlockchainRepository):
+        genesis_block = block_tree.get_last_block()
+        block_1 = _child(genesis_block, "1")
+        block_2 = _child(block_1, "2")
+
+        block_tree.add_or_replace(block_2)
+        block_tree.set_chain(Blockchain(chain=[genesis_block, block_1]))
+
+        assert block_tree.chain == [genesis_block, block_1, block_2]
+
+    def test_duplicates_are_ignored(self, block_tree: BlockchainRepository):
+        block = _child(block_tree.get_last_block(), "1")
+
+        block_tree.add_or_replace(block)
+        block_tree.add_or_replace(block)
+
+        assert len(block_tree.chain) == 2
+
+    def test_deep_side_branches_are_pruned(
+        self, block_tree: BlockchainRepository, monkeypatch
+    ):
+        monkeypatch.setattr(blockchain_repository_module, "FINALITY_DEPTH", 2)
+        genesis_block = block_tree.get_last_block()
+        block_1a = _child(genesis_block, "1a")
+        block_1b = _child(genesis_block, "1b", timestamp=1235)
+        block_tree.add_or_replace(block_1a)
+        block_tree.add_or_replace(block_1b)
+        block_tree.mark_verified([block_1a, block_1b])
+        assert block_tree.known_prefix_length([genesis_block, block_1b]) == 2
+
+        main_chain = [genesis_block, block_1a]
+        for name in ["2a", "3a", "4a"]:
+            main_chain.append(_child(main_chain[-1], name))
+            block_tree.add_or_replace(main_chain[-1])
+
+        assert block_tree.chain == main_chain
+        assert not block_tree.is_in_tree("1b")
+        assert block_tree.is_in_tree("1a")
+        assert block_tree.known_prefix_length([genesis_block, block_1b]) == 1
+        # Blocks forking below the finality depth are ignored
+        block_tree.add_or_replace(block_1b)
+        block_tree.add_or_replace(_child(genesis_block, "1c"))
+        assert not block_tree.is_in_tree("1b") and not block_tree.is_in_tree("1c")
+        assert block_tree.chain == main_chain
+
+    def test_reorg_across_chunks(self, block_tree: BlockchainRepository, monkeypatch):
+        monkeypatch.setattr(blockchain_repository_module, "CHAIN_CHUNK_SIZE", 2)
+        monkeypatch.setattr(blockchain_repository_module, "FINALITY_DEPTH", 3)
+        main_chain = [block_tree.get_last_block()]
+        for name in ["1", "2", "3", "4", "5", "6"]:
+            main_chain.append(_child_with_record(main_chain[-1], name, name))
+        block_tree.chain = main_chain
+        branch = main_chain[:4]
+        for name in ["4b", "5b", "6b", "7b"]:
+            branch.append(_child(branch[-1], name))
+            block_tree.add_or_replace(branch[-1])
+
+        snapshot = block_tree.get_snapshot()
+        assert snapshot == branch
+        assert isinstance(snapshot._chunks[0], tuple)
+        assert block_tree.get_block_by_hash("1") == main_chain[1]
+        assert block_tree.get_block_by_hash("5b") == branch[5]
+        assert block_tree.get_block_by_hash("5") is None
+        assert block_tree.find_records("3")[0].block_hash == "3"
+        assert block_tree.find_records("5") == []
+        # Final blocks of the main chain are known without a tree node
+        assert block_tree.is_in_tree("1") and "1" not in block_tree._tree
+
+    def test_orphan_pool_is_bounded(
+        self, block_tree: BlockchainRepository, monkeypatch
+    ):
+        monkeypatch.setattr(blockchain_repository_module, "MAX_ORPHAN_BLOCKS", 2)
+        unknown_parent = Block(5, "unknown", [], 1234, [], "5", 0)
+        orphans = [_child(unknown_parent, str(i)) for i in range(3)]
+
+        for orphan in orphans:
+            block_tree.add_or_replace(orphan)
+
+        assert block_tree.orphan_count() == 2
+        assert not block_tree.is_orphan("0")
+
+
+def _child_with_record(parent: Block, name: str, content: str) -> Block:
+    record = Record(index=0, timestamp=1234, content=content)
+    return Block(parent.index + 1, parent.hash, [], 1234, [record], name, 0)
+
+
+class TestRecordIndex:
+    def test_follows_reorg(self, block_tree: BlockchainRepository):
+        genesis_block = block_tree.get_last_block()
+        block_1a = _child_with_record(genesis_block, "1a", "Paid by A")
+        block_1b = _child_with_record(genesis_block, "1b", "Paid by B")
+        block_2b = _child_with_record(block_1b, "2b", "Paid again")
+        block_tree.add_or_replace(block_1a)
+
+        assert [match.block_hash for match in block_tree.find_records("paid")] == ["1a"]
+
+        block_tree.add_or_replace(block_1b)
+        block_tree.add_or_replace(block_2b)
+
+        assert [match.block_hash for match in block_tree.find_records("paid")] == [
+            "1b",
+            "2b",
+        ]
+        assert block_tree.locate_records("Paid by A") == []
+        (match,) = block_tree.locate_records("Paid again")
+        assert match.block_index == 2 and match.position == 0
+
+    def test_follows_set_chain(self, block_tree: BlockchainRepository):
+        genesis_block = block_tree.get_last_block()
+        block_1 = _child_with_record(genesis_block, "1", "Synced record")
+
+        block_tree.set_chain(Blockchain(chain=[genesis_block, block_1]))
+        assert block_tree.find_records("synced")[0].block_hash == "1"
+
+        block_tree.chain = [genesis_block]
+        assert block_tree.find_records("synced") == []
+
+
+class TestChainSnapshot:
+    @pytest.fixture
+    def blocks(self):
+        return [
+            Block(index, str(index - 1), [], 1234, [], str(index), 0)
+            for index in range(10)
+        ]
+
+    @staticmethod
+    def _draft(blocks: list[Block]) -> ChainDraft:
+        draft = ChainDraft(chunk_size=4)
+        for block in blocks:
+            draft.append(block)
+        return draft
+
+    def test_chunks(self, blocks: list[Block]):
+        snapshot = self._draft(blocks).snapshot(1)
+
+        assert snapshot.version == 1
+        assert len(snapshot) == 10
+        assert list(snapshot) == snapshot == blocks
+        assert snapshot[-1] is blocks[-1]
+        assert snapshot[3:9] == blocks[3:9]
+        assert list(snapshot.blocks(2, 7)) == blocks[2:7]
+        assert snapshot[::3] == blocks[::3]
+        with pytest.raises(IndexError):
+            snapshot[10]
+
+    def test_new_versions_share_chunks(self, blocks: list[Block]):
+        draft = self._draft(blocks)
+        snapshot = draft.snapshot(1)
+        fork = Block(6, "5", [], 1234, [], "6b", 0)
+
+        for _ in range(4):
+            draft.pop()
+        draft.append(fork)
+        reorganized = draft.snapshot(2)
+
+        assert reorganized == blocks[:6] + [fork]
+        assert snapshot == blocks
+        assert reorganized._chunks[0] is snapshot._chunks[0]
+        assert draft.height_of("6b") == 6
+        assert draft.height_of("7") is None and draft.height_of("3") == 3
+
+    def test_readers_keep_their_snapshot(self, block_tree: BlockchainRepository):
+        genesis_block = block_tree.get_last_block()
+        block_1a = _child(genesis_block, "1a")
+        block_1b = _child(genesis_block, "1b")
+        block_2b = _child(block_1b, "2b")
+        block_tree.add_or_replace(block_1a)
+
+        snapshot = block_tree.get_snapshot()
+        block_tree.add_or_replace(block_1b)
+        block_tree.add_or_replace(block_2b)
+
+        assert snapshot == [genesis_block, block_1a]
+        assert block_tree.get_snapshot() == [genesis_block, block_1b, block_2b]
+        assert block_tree.get_snapshot().version > snapshot.version
+
+    def test_lookups_by_hash_follow_the_snapshot(
+        self, block_tree: BlockchainRepository
+    ):
+        genesis_block = block_tree.get_last_block()
+        block_1a = _child(genesis_block, "1a")
+        block_1b = _child(genesis_block, "1b")
+        block_tree.add_or_replace(block_1a)
+
+        with locked_chain(block_tree):
+            # Changes of the writer that are not published yet
+            block_tree._remove_last_block()
+            block_tree._append_block(block_1b)
+            assert block_tree.get_block_by_hash("1a") == block_1a
+            assert block_tree.get_block_by_hash("1b") is None
+            block_tree._publish()
+
+        assert block_tree.get_block_by_hash("1a") is None
+        assert block_tree.get_block_by_hash("1b") == block_1b
+
+    def test_reads_do_not_take_the_lock(self, block_tree: BlockchainRepository):
+        with locked_chain(block_tree):
+            assert block_tree.get_chain().length == 1
+            assert block_tree.get_last_block().index == 0
+            assert block_tree.sample_side_links(2) == []
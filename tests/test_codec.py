@@ -0,0 +1,92 @@
+import json
+
+import pytest
+
+from blockchain_system.blockchain import (
+    Block,
+    Blockchain,
+    BlockId,
+    ChainPage,
+    ChainTip,
+    PendingBlock,
+    Record,
+    RecordMatch,
+    RecordProofRequest,
+    RecordQuery,
+    RecordQueryResult,
+    ShowChainRequest,
+    SyncBlocks,
+    SyncRequest,
+)
+from blockchain_system.codec import (
+    BinaryCodec,
+    CodecException,
+    JsonCodec,
+    decode_message,
+)
+
+BLOCK = Block(
+    index=3,
+    previous_hash="0" * 16 + "1" * 240,
+    side_links=["01" * 128, ""],
+    timestamp=1684000000,
+    records=[Record(index=0, timestamp=-1, content="Zażółć gęślą jaźń")],
+    hash="0" * 20 + "1" * 236,
+    nonce=2**40,
+)
+GENESIS_BLOCK = Block(
+    index=0, previous_hash="0", side_links=[], timestamp=1684000000, records=[], hash=""
+)
+
+MESSAGES = [
+    None,
+    BLOCK.records[0],
+    BLOCK,
+    PendingBlock(index=1, records=BLOCK.records),
+    Blockchain(chain=[GENESIS_BLOCK, BLOCK]),
+    ChainTip(node_id="node", index=3, hash=BLOCK.hash),
+    SyncRequest(
+        node_id="node", target_node_id="peer", locator=[BlockId(index=0, hash="")]
+    ),
+    SyncBlocks(
+        node_id="peer", target_node_id="node", start=3, blocks=[BLOCK], last=True
+    ),
+    BLOCK.record_proof(0),
+    RecordProofRequest(content="Zażółć gęślą jaźń"),
+    ShowChainRequest(request_id="request", start=2, page_size=10),
+    ChainPage(node_id="node", request_id="request", start=3, blocks=[BLOCK], last=True),
+    RecordQuery(request_id="request", text="gęślą", since=0, until=-1),
+    RecordQueryResult(
+        node_id="node",
+        request_id="request",
+        matches=[
+            RecordMatch(
+                record=BLOCK.records[0],
+                block_index=3,
+                block_hash=BLOCK.hash,
+                position=0,
+            )
+        ],
+    ),
+]
+
+
+@pytest.mark.parametrize("codec", [BinaryCodec(), JsonCodec()])
+@pytest.mark.parametrize("message", MESSAGES)
+def test_round_trip(codec, message):
+    assert decode_message(codec.encode(message)) == message
+
+
+def test_binary_format_is_compact():
+    blockchain = Blockchain(chain=[GENESIS_BLOCK, BLOCK])
+    body = BinaryCodec().encode(blockchain)
+
+    assert len(body) * 5 < len(json.dumps(blockchain.to_json()))
+
+
+def test_unknown_version():
+    body = bytearray(BinaryCodec().encode(BLOCK))
+    body[0] = 0x7F
+
+    with pytest.raises(CodecException):
+        BinaryCodec().decode(bytes(body))
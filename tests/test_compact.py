@@ -0,0 +1,68 @@
+import pytest
+
+from blockchain_system.blockchain import Block, Blockchain, Record
+from blockchain_system.compact import NO_HASH, CompactChain, HashTable
+
+
+@pytest.fixture
+def blocks():
+    genesis_block = Block(
+        index=0, previous_hash="0", side_links=[], timestamp=1234, records=[], hash=""
+    )
+    chain = [genesis_block]
+    for index in range(1, 6):
+        chain.append(
+            Block(
+                index=index,
+                previous_hash=chain[-1].hash,
+                side_links=[block.hash for block in chain[-2:]],
+                timestamp=1234 + index,
+                records=[
+                    Record(index=i, timestamp=-i, content=f"Record {index}.{i}")
+                    for i in range(index % 3)
+                ],
+                hash=format(index, "0>256b"),
+                nonce=2**40 + index,
+            )
+        )
+    return chain
+
+
+def test_round_trip(blocks):
+    compact_chain = CompactChain(blocks)
+
+    assert len(compact_chain) == len(blocks)
+    assert list(compact_chain) == blocks
+    assert compact_chain[-1] == blocks[-1]
+    assert compact_chain.to_json() == Blockchain(chain=blocks).to_json()
+    assert list(CompactChain.from_json(Blockchain(chain=blocks).to_json())) == blocks
+
+
+def test_hashes_are_interned(blocks):
+    compact_chain = CompactChain(blocks)
+
+    # Block hashes, the genesis previous hash and the Merkle roots
+    merkle_roots = {block.merkle_root for block in blocks}
+    assert len(compact_chain.hashes) == len(blocks) + 1 + len(merkle_roots)
+
+
+def test_truncate(blocks):
+    compact_chain = CompactChain(blocks)
+    compact_chain.truncate(3)
+
+    assert list(compact_chain) == blocks[:3]
+    compact_chain.append(blocks[3])
+    assert list(compact_chain) == blocks[:4]
+    with pytest.raises(IndexError):
+        compact_chain.block(4)
+
+
+def test_hash_table():
+    hashes = HashTable()
+    block_hash = "01" * 128
+
+    assert hashes.intern(block_hash) == hashes.intern(block_hash)
+    assert hashes.lookup(hashes.intern(block_hash)) == block_hash
+    assert hashes.lookup(hashes.intern("0")) == "0"
+    assert hashes.intern(None) == NO_HASH
+    assert hashes.lookup(NO_HASH) is None
@@ -0,0 +1,81 @@
+import threading
+import urllib.request
+
+from blockchain_system.blockchain import Block
+from blockchain_system.metrics import MetricsRegistry, MetricsServer, TimedLock
+from blockchain_system.node import forget_node, node_context
+from blockchain_system.services import _proof_of_work
+
+
+def test_render():
+    with node_context("metrics-render"):
+        registry = MetricsRegistry()
+        registry.counter("published_bytes_total", "Bytes", routing_key="a.b").inc(3)
+        registry.counter("published_bytes_total", "Bytes", routing_key="a.b").inc(2)
+        registry.gauge("chain_height").set(7)
+        histogram = registry.histogram("handling_seconds", buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        forget_node("metrics-render")
+
+    text = registry.render()
+
+    assert 'published_bytes_total{routing_key="a.b"} 5' in text
+    assert "# TYPE chain_height gauge\nchain_height 7" in text
+    assert 'handling_seconds_bucket{le="0.1"} 1' in text
+    assert 'handling_seconds_bucket{le="1.0"} 2' in text
+    assert 'handling_seconds_bucket{le="+Inf"} 3' in text
+    assert "handling_seconds_count 3" in text
+
+
+def test_registry_per_node():
+    with node_context("metrics-a"):
+        MetricsRegistry().counter("messages_total").inc()
+    with node_context("metrics-b"):
+        assert MetricsRegistry().counter("messages_total").value == 0
+    forget_node("metrics-a")
+    forget_node("metrics-b")
+
+
+def test_timed_lock():
+    registry = object.__new__(MetricsRegistry)
+    registry.__init__()
+    histogram = registry.histogram("lock_wait_seconds")
+    lock = TimedLock(histogram)
+
+    with lock:
+        assert lock.locked()
+        assert not lock.acquire(timeout=0.01)
+
+    assert histogram.count == 2
+    assert histogram.sum >= 0.01
+
+
+def test_proof_of_work_hashes():
+    with node_context("metrics-pow"):
+        block = Block(
+            index=1, previous_hash="0", side_links=[], timestamp=0, records=[]
+        )
+        _proof_of_work(block)
+        hashes = MetricsRegistry().counter("pow_hashes_total").value
+        rates = MetricsRegistry().histogram("pow_hashes_per_second")
+        forget_node("metrics-pow")
+
+    assert hashes == block.nonce + 1
+    assert rates.count == 1
+
+
+def test_metrics_server():
+    registry = object.__new__(MetricsRegistry)
+    registry.__init__()
+    registry.gauge("pending_blocks").set(3)
+    server = MetricsServer(registry, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with urllib.request.urlopen(server.url) as response:
+            assert "pending_blocks 3" in response.read().decode()
+    finally:
+        server.stop()
+        thread.join()
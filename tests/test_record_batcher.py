@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from blockchain_system.blockchain import Record
+from blockchain_system.blockchain_repository import (
+    MAX_PENDING_BLOCKS,
+    BlockchainRepository,
+    PendingBlocksRepository,
+)
+from blockchain_system.record_batcher import (
+    BATCH_LINGER_SECONDS,
+    MAX_BATCH_RECORDS,
+    RecordBatcher,
+)
+
+
+@pytest.fixture
+def pending_blocks_repository():
+    repo = PendingBlocksRepository()
+    yield repo
+    repo.clear()
+
+
+@pytest.fixture
+def record_batcher():
+    blockchain_repository = BlockchainRepository()
+    if blockchain_repository.get_last_block() is None:
+        genesis_block = blockchain_repository.create_genesis_block()
+        blockchain_repository.add_or_replace(genesis_block)
+
+    batcher = RecordBatcher()
+    yield batcher
+    batcher.records, batcher.size = [], 0
+    batcher.max_records = MAX_BATCH_RECORDS
+    batcher.linger = BATCH_LINGER_SECONDS
+
+
+def _record(content: str) -> Record:
+    return Record(index=0, timestamp=int(time.time()), content=content)
+
+
+def test_batch_by_record_count(
+    record_batcher: RecordBatcher, pending_blocks_repository: PendingBlocksRepository
+):
+    record_batcher.max_records = 2
+    record_batcher.linger = 60
+
+    record_batcher.add(_record("First transaction"))
+    assert pending_blocks_repository.pending_blocks_count() == 0
+
+    record_batcher.add(_record("Second transaction"))
+    pending_block = pending_blocks_repository.pop()
+    assert [record.content for record in pending_block.records] == [
+        "First transaction",
+        "Second transaction",
+    ]
+    assert pending_block.index == BlockchainRepository().get_last_block().index + 1
+
+
+def test_batch_by_linger_time(
+    record_batcher: RecordBatcher, pending_blocks_repository: PendingBlocksRepository
+):
+    record_batcher.max_records = 100
+    record_batcher.linger = 0.05
+
+    record_batcher.add(_record("Lonely transaction"))
+
+    pending_block = pending_blocks_repository.get(timeout=2)
+    assert len(pending_block.records) == 1
+
+
+def test_add_does_not_wait_for_a_full_queue(
+    record_batcher: RecordBatcher,
+    pending_blocks_repository: PendingBlocksRepository,
+    waiting_for_slot,
+):
+    record_batcher.max_records = 1
+    pending_blocks_repository.maxsize = 1
+    record_batcher.add(_record("First transaction"))
+    waiting = waiting_for_slot(pending_blocks_repository)
+    handing_over = threading.Thread(
+        target=record_batcher.add, args=(_record("Second transaction"),)
+    )
+    handing_over.start()
+
+    try:
+        assert waiting.wait(timeout=5)
+        # Records are still accepted while a full batch waits for a slot
+        record_batcher.max_records = 100
+        record_batcher.linger = 60
+        record_batcher.add(_record("Third transaction"))
+        assert [record.content for record in record_batcher.records] == [
+            "Third transaction"
+        ]
+    finally:
+        pending_blocks_repository.maxsize = MAX_PENDING_BLOCKS
+        first_block = pending_blocks_repository.pop()
+        handing_over.join(timeout=1)
+
+    assert first_block.records[0].content == "First transaction"
+    assert pending_blocks_repository.pop().records[0].content == "Second transaction"
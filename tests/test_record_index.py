@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from blockchain_system.blockchain import Block, Record
+from blockchain_system.record_index import RecordIndex, SortedEntries, tokenize
+
+
+def _block(index: int, *contents: str) -> Block:
+    return Block(
+        index=index,
+        previous_hash=str(index - 1),
+        side_links=[],
+        timestamp=index,
+        records=[
+            Record(index=i, timestamp=index * 10 + i, content=content)
+            for i, content in enumerate(contents)
+        ],
+        hash=str(index),
+    )
+
+
+@pytest.fixture
+def record_index():
+    record_index = RecordIndex()
+    record_index.add_block(0, _block(0))
+    record_index.add_block(1, _block(1, "Alice pays Bob", "Bob pays Carol"))
+    record_index.add_block(2, _block(2, "Carol pays alice"))
+    return record_index
+
+
+def test_tokenize():
+    assert tokenize("Alice pays Bob, 10 coins!") == {
+        "alice",
+        "pays",
+        "bob",
+        "10",
+        "coins",
+    }
+
+
+def test_find_by_text(record_index: RecordIndex):
+    assert record_index.find("alice") == [(10, 1, 0), (20, 2, 0)]
+    assert record_index.find("PAYS carol") == [(11, 1, 1), (20, 2, 0)]
+    assert record_index.find("alice dave") == []
+    assert record_index.find("!!!") == []
+    assert record_index.find("") == []
+
+
+def test_find_by_timestamp(record_index: RecordIndex):
+    assert record_index.find(since=11) == [(11, 1, 1), (20, 2, 0)]
+    assert record_index.find(until=11) == [(10, 1, 0), (11, 1, 1)]
+    assert record_index.find(since=11, until=19) == [(11, 1, 1)]
+    assert record_index.find(limit=1) == [(10, 1, 0)]
+    assert record_index.find("pays", since=11, limit=1) == [(11, 1, 1)]
+
+
+def test_locate(record_index: RecordIndex):
+    assert record_index.locate("Bob pays Carol") == [(11, 1, 1)]
+    assert record_index.locate("Bob pays") == []
+
+
+def test_remove_block(record_index: RecordIndex):
+    record_index.remove_block(2, _block(2, "Carol pays alice"))
+
+    assert len(record_index) == 2
+    assert record_index.find("alice") == [(10, 1, 0)]
+    assert record_index.locate("Carol pays alice") == []
+
+
+def test_sorted_entries():
+    rng = random.Random(7)
+    entries = [(rng.randrange(100), height, 0) for height in range(500)]
+    sorted_entries = SortedEntries(load=4)
+    for entry in entries:
+        sorted_entries.add(entry)
+    for entry in entries[::3]:
+        sorted_entries.remove(entry)
+    expected = sorted(set(entries) - set(entries[::3]))
+
+    assert len(sorted_entries) == len(expected)
+    assert list(sorted_entries) == expected
+    in_range = [entry for entry in expected if 20 <= entry[0] < 30]
+    assert sorted_entries.range((20,), (30,)) == in_range
+    assert sorted_entries.range((20,), (30,), limit=7) == in_range[:7]
+    assert (
+        sorted_entries.range((20,), limit=50)
+        == expected[
+            len(expected) - len([entry for entry in expected if entry[0] >= 20]) :
+        ][:50]
+    )
+    assert sorted_entries.range((100,)) == []
+    with pytest.raises(ValueError):
+        sorted_entries.remove(entries[0])
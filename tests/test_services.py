@@ -1,14 +1,51 @@
+import threading
 import time
 from unittest.mock import patch
 
 import pytest
 
-from blockchain_system.blockchain import PendingBlock, Record
+from blockchain_system import mining
+from blockchain_system.blockchain import (
+    Block,
+    Blockchain,
+    BlockHasher,
+    PendingBlock,
+    Record,
+    RecordProofRequest,
+    RecordQuery,
+    ShowChainRequest,
+    SyncBlocks,
+    SyncRequest,
+    difficulty_target,
+)
 from blockchain_system.blockchain_repository import (
     BlockchainRepository,
+    ChainDraft,
+    ChainSnapshot,
     PendingBlocksRepository,
+    SyncRepository,
+    SyncSessionException,
+)
+from blockchain_system.services import (
+    POW_DIFFICULTY,
+    InvalidBlockchainException,
+    InvalidProofException,
+    _is_valid_proof,
+    _proof_of_work,
+    add_block,
+    add_pending_block,
+    apply_sync_blocks,
+    build_locator,
+    check_chain_validity,
+    find_invalid_block,
+    find_records,
+    iter_chain_pages,
+    mine_block,
+    prove_record,
+    request_missing_blocks,
+    send_missing_blocks,
+    set_chain,
 )
-from blockchain_system.services import mine_block
 
 
 @pytest.fixture
@@ -18,7 +55,7 @@ def blockchain_repository():
     repo.chain = repo.chain[1:]
 
 
-@pytest.fixture(scope="session")
+@pytest.fixture
 def publisher_mock():
     with patch("blockchain_system.services.Publisher") as mck:
         yield mck
@@ -44,7 +81,7 @@ def pending_blocks_repository():
 
     yield repo
 
-    repo.pending_blocks = []
+    repo.clear()
 
 
 def test_mine_block(
@@ -60,6 +97,10 @@ def test_mine_block(
         == 1
     )
     assert pending_blocks_repository.pending_blocks_count() == 1
+    # The mined block comes back as a block_mined message
+    blockchain_repository.add_or_replace(
+        publisher_mock.return_value.notify_block_mined.call_args.kwargs["block"]
+    )
 
     assert (
         mine_block(
@@ -70,3 +111,564 @@ def test_mine_block(
     )
     assert pending_blocks_repository.pending_blocks_count() == 0
     publisher_mock.return_value.notify_block_mined.assert_called()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_proof_of_work(workers):
+    block = Block(
+        index=1,
+        previous_hash="0",
+        side_links=[],
+        timestamp=int(time.time()),
+        records=[Record(index=0, timestamp=int(time.time()), content="Proof")],
+    )
+
+    proof = _proof_of_work(block, workers=workers)
+
+    assert proof.startswith("0" * POW_DIFFICULTY)
+    assert proof == block.compute_hash()
+    assert _is_valid_proof(block, proof)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_proof_of_work_abort(workers):
+    block = Block(index=1, previous_hash="0", side_links=[], timestamp=0, records=[])
+
+    assert _proof_of_work(block, workers=workers, should_abort=lambda: True) is None
+    assert block.nonce == 0
+
+
+def test_search_nonce_ranges_counts_hashes():
+    block = Block(index=1, previous_hash="0", side_links=[], timestamp=0, records=[])
+    hasher = BlockHasher.from_block(block)
+    target = difficulty_target(8)
+    nonce = hasher.search(0, 1 << 20, target)
+    stop_event = threading.Event()
+    mining._init_worker(stop_event)
+
+    assert mining._search_nonce_ranges(
+        hasher.prefix, hasher.suffix, target, 0, 1, 64
+    ) == (nonce, nonce + 1)
+
+    stop_event.set()
+    assert mining._search_nonce_ranges(
+        hasher.prefix, hasher.suffix, target, 0, 1, 64
+    ) == (None, 0)
+
+
+def test_shutdown_parallel_miners():
+    miner = mining.get_parallel_miner(2)
+
+    mining.shutdown_parallel_miners()
+
+    assert mining.get_parallel_miner(2) is not miner
+    mining.shutdown_parallel_miners()
+
+
+def test_mine_block_indexes_the_block_after_the_tip(
+    blockchain_repository: BlockchainRepository,
+    pending_blocks_repository: PendingBlocksRepository,
+    publisher_mock,
+):
+    chain = blockchain_repository.chain
+    blockchain_repository.chain = [blockchain_repository.create_genesis_block()]
+    tip = blockchain_repository.get_last_block()
+    # A peer's block arrived after the pending block with index 1 was queued
+    peer_block = Block(
+        index=tip.index + 1,
+        previous_hash=tip.hash,
+        side_links=[],
+        timestamp=int(time.time()),
+        records=[],
+        hash="1" * 256,
+    )
+    blockchain_repository.add_or_replace(peer_block)
+
+    try:
+        mine_block(
+            pending_blocks_repository=pending_blocks_repository,
+            blockchain_repository=blockchain_repository,
+        )
+    finally:
+        blockchain_repository.chain = chain
+
+    mined_block = publisher_mock.return_value.notify_block_mined.call_args.kwargs[
+        "block"
+    ]
+    assert mined_block.previous_hash == peer_block.hash
+    assert mined_block.index == peer_block.index + 1
+
+
+def test_mine_block_rebuilds_on_new_tip(
+    blockchain_repository: BlockchainRepository,
+    pending_blocks_repository: PendingBlocksRepository,
+    publisher_mock,
+):
+    chain = blockchain_repository.chain
+    blockchain_repository.chain = [blockchain_repository.create_genesis_block()]
+    tip = blockchain_repository.get_last_block()
+    peer_block = Block(
+        index=tip.index + 1,
+        previous_hash=tip.hash,
+        side_links=[],
+        timestamp=int(time.time()),
+        records=[],
+        hash="1" * 256,
+    )
+
+    attempts = []
+
+    def proof_of_work(block, should_abort, **kwargs):
+        if block.previous_hash == tip.hash:
+            blockchain_repository.add_or_replace(peer_block)
+        proof = _proof_of_work(block, should_abort=should_abort, **kwargs)
+        attempts.append((block.previous_hash, proof))
+        return proof
+
+    try:
+        with patch(
+            "blockchain_system.services._proof_of_work", side_effect=proof_of_work
+        ):
+            mine_block(
+                pending_blocks_repository=pending_blocks_repository,
+                blockchain_repository=blockchain_repository,
+            )
+    finally:
+        blockchain_repository.chain = chain
+
+    mined_block = publisher_mock.return_value.notify_block_mined.call_args.kwargs[
+        "block"
+    ]
+    # The attempt on the stale tip was aborted, mining restarted on the new one
+    assert attempts == [(tip.hash, None), (peer_block.hash, mined_block.hash)]
+    assert mined_block.previous_hash == peer_block.hash
+    assert mined_block.index == peer_block.index + 1
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+def test_set_chain_verifies_only_new_blocks(
+    mine_blocks,
+    blockchain_repository: BlockchainRepository,
+):
+    chain = blockchain_repository.chain
+    genesis_block = blockchain_repository.create_genesis_block()
+    blockchain_repository.chain = [genesis_block] + mine_blocks(
+        genesis_block, 3, "Shared"
+    )
+    longer_chain = blockchain_repository.chain + mine_blocks(
+        blockchain_repository.get_last_block(), 2, "New"
+    )
+
+    try:
+        with patch(
+            "blockchain_system.services._is_valid_proof", wraps=_is_valid_proof
+        ) as is_valid_proof:
+            set_chain(Blockchain(chain=longer_chain[:]), blockchain_repository)
+            assert is_valid_proof.call_count == 2
+            assert blockchain_repository.chain == longer_chain
+            assert blockchain_repository.get_block_by_height(5) is longer_chain[5]
+
+            is_valid_proof.reset_mock()
+            assert check_chain_validity(
+                Blockchain(chain=longer_chain), blockchain_repository
+            )
+            assert is_valid_proof.call_count == 0
+    finally:
+        blockchain_repository.chain = chain
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+def test_known_blocks_are_compared_in_full(
+    mine_blocks,
+    blockchain_repository: BlockchainRepository,
+):
+    chain = blockchain_repository.chain
+    genesis_block = blockchain_repository.create_genesis_block()
+    blockchain_repository.chain = [genesis_block] + mine_blocks(
+        genesis_block, 3, "Shared"
+    )
+    new_blocks = mine_blocks(blockchain_repository.get_last_block(), 2, "Verified once")
+
+    def decoded(blocks):
+        return [Block.from_dict(block.to_dict()) for block in blocks]
+
+    try:
+        with patch(
+            "blockchain_system.services._is_valid_proof", wraps=_is_valid_proof
+        ) as is_valid_proof:
+            received = decoded(blockchain_repository.chain + new_blocks)
+            assert check_chain_validity(
+                Blockchain(chain=received), blockchain_repository
+            )
+            assert is_valid_proof.call_count == 2
+            # Blocks equal to the local ones are replaced by them
+            assert received[2] is blockchain_repository.chain[2]
+
+            is_valid_proof.reset_mock()
+            received = decoded(blockchain_repository.chain + new_blocks)
+            assert check_chain_validity(
+                Blockchain(chain=received), blockchain_repository
+            )
+            assert is_valid_proof.call_count == 0
+
+            received = decoded(blockchain_repository.chain + new_blocks)
+            received[-1].records[0].content = "Forged"
+            assert not check_chain_validity(
+                Blockchain(chain=received), blockchain_repository
+            )
+            assert is_valid_proof.call_count == 1
+    finally:
+        blockchain_repository.chain = chain
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+def test_copied_tip_does_not_vouch_for_forged_blocks(
+    mine_blocks,
+    blockchain_repository: BlockchainRepository,
+):
+    chain = blockchain_repository.chain
+    genesis_block = blockchain_repository.create_genesis_block()
+    blockchain_repository.chain = [genesis_block] + mine_blocks(
+        genesis_block, 4, "Shared"
+    )
+    local_chain = list(blockchain_repository.chain)
+    tip = local_chain[-1]
+    forged_chain = [genesis_block]
+    for index in range(1, 5):
+        forged_chain.append(
+            Block(
+                index=index,
+                previous_hash=forged_chain[-1].hash,
+                side_links=[],
+                timestamp=0,
+                records=[Record(index=0, timestamp=0, content="Forged")],
+                # The tip of the node is copied onto the last forged block
+                hash=tip.hash if index == tip.index else str(index),
+            )
+        )
+    forged_chain += mine_blocks(tip, 1, "New")
+
+    try:
+        assert not check_chain_validity(
+            Blockchain(chain=forged_chain[:]), blockchain_repository
+        )
+        with pytest.raises(InvalidBlockchainException):
+            set_chain(Blockchain(chain=forged_chain[:]), blockchain_repository)
+        assert blockchain_repository.chain == local_chain
+    finally:
+        blockchain_repository.chain = chain
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+def test_forged_prefix_with_copied_tip_does_not_reach_the_chain(
+    mine_blocks,
+    blockchain_repository: BlockchainRepository,
+):
+    chain = blockchain_repository.chain
+    genesis_block = blockchain_repository.create_genesis_block()
+    blockchain_repository.chain = [genesis_block] + mine_blocks(
+        genesis_block, 3, "Honest"
+    )
+    local_chain = list(blockchain_repository.chain)
+    tip = local_chain[-1]
+    # Forged records under the original hashes, followed by a copy of the tip
+    forged_chain = [genesis_block]
+    for block in local_chain[1:]:
+        forged_block = Block.from_dict(block.to_dict())
+        if block is not tip:
+            forged_block.records[0].content = "Forged"
+        forged_chain.append(forged_block)
+    new_block = mine_blocks(tip, 1, "New")[0]
+    forged_chain.append(new_block)
+
+    try:
+        with pytest.raises(InvalidBlockchainException):
+            set_chain(Blockchain(chain=forged_chain[:]), blockchain_repository)
+        assert blockchain_repository.chain == local_chain
+
+        # The same blocks announced one by one go through the fork choice
+        for block in forged_chain[1:]:
+            try:
+                add_block(blockchain_repository, block, block.hash)
+            except InvalidProofException:
+                assert block.records[0].content == "Forged"
+
+        assert blockchain_repository.chain == local_chain + [new_block]
+        assert blockchain_repository.chain[tip.index] is tip
+        assert not check_chain_validity(
+            Blockchain(chain=forged_chain[:]), blockchain_repository
+        )
+    finally:
+        blockchain_repository.chain = chain
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+def test_check_chain_validity_rejects_broken_suffix(
+    mine_blocks,
+    blockchain_repository: BlockchainRepository,
+):
+    chain = blockchain_repository.chain
+    genesis_block = blockchain_repository.create_genesis_block()
+    blockchain_repository.chain = [genesis_block] + mine_blocks(
+        genesis_block, 2, "Shared"
+    )
+    new_blocks = mine_blocks(blockchain_repository.get_last_block(), 2, "Suffix")
+    new_blocks[-1].records.append(
+        Record(index=0, timestamp=int(time.time()), content="Forged")
+    )
+
+    try:
+        assert not check_chain_validity(
+            Blockchain(chain=blockchain_repository.chain + new_blocks),
+            blockchain_repository,
+        )
+    finally:
+        blockchain_repository.chain = chain
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+@patch("blockchain_system.services.PARALLEL_VALIDATION_THRESHOLD", 0)
+@patch("blockchain_system.services.VALIDATION_CHUNK_SIZE", 2)
+@pytest.mark.parametrize("workers", [1, 2])
+def test_find_invalid_block(mine_blocks, workers):
+    genesis_block = Block(
+        index=0, previous_hash="0", side_links=[], timestamp=0, records=[]
+    )
+    genesis_block.hash = _proof_of_work(genesis_block)
+    chain = [genesis_block] + mine_blocks(genesis_block, 6, "Parallel")
+
+    assert find_invalid_block(Blockchain(chain=chain), workers=workers) is None
+
+    chain[4].records[0].content = "Forged"
+    assert find_invalid_block(Blockchain(chain=chain), workers=workers) == 4
+
+    chain[2].previous_hash = "1" * 256
+    assert find_invalid_block(Blockchain(chain=chain), workers=workers) == 2
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+@patch("blockchain_system.services.PARALLEL_VALIDATION_THRESHOLD", 0)
+@patch("blockchain_system.services.VALIDATION_CHUNK_SIZE", 2)
+def test_parallel_validation_reports_the_first_invalid_block(mine_blocks):
+    genesis_block = Block(
+        index=0, previous_hash="0", side_links=[], timestamp=0, records=[]
+    )
+    genesis_block.hash = _proof_of_work(genesis_block)
+    chain = [genesis_block] + mine_blocks(genesis_block, 11, "Parallel")
+    # The later chunk fails at its first block, often before the earlier chunk
+    chain[10].records[0].content = "Forged"
+    chain[3].records[0].content = "Forged"
+
+    for _ in range(3):
+        assert find_invalid_block(Blockchain(chain=chain), workers=2) == 3
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+@patch("blockchain_system.services.SYNC_PAGE_SIZE", 2)
+def test_sync_missing_blocks(
+    mine_blocks, blockchain_repository: BlockchainRepository, publisher_mock
+):
+    chain = blockchain_repository.chain
+    genesis_block = blockchain_repository.create_genesis_block()
+    blockchain_repository.chain = [genesis_block] + mine_blocks(
+        genesis_block, 3, "Synced"
+    )
+    peer_chain = blockchain_repository.chain + mine_blocks(
+        blockchain_repository.get_last_block(), 3, "Missing"
+    )
+    sync_repository = SyncRepository()
+    sync_request = SyncRequest(
+        node_id=sync_repository.node_id,
+        target_node_id="peer",
+        locator=build_locator(blockchain_repository),
+    )
+
+    try:
+        # The peer answers with the blocks after the common ancestor only
+        blockchain_repository.chain = peer_chain
+        publisher_mock.reset_mock()
+        send_missing_blocks(sync_request, blockchain_repository, sync_repository)
+        pages = [
+            call.args[0]
+            for call in publisher_mock.return_value.notify_sync_blocks.call_args_list
+        ]
+        for page in pages:
+            page.node_id = "peer"
+        assert [page.start for page in pages] == [4, 6]
+        assert [page.last for page in pages] == [False, True]
+
+        blockchain_repository.chain = peer_chain[:4]
+        assert sync_repository.start_session("peer")
+        assert not sync_repository.start_session("other peer")
+        for page in pages:
+            apply_sync_blocks(page, blockchain_repository, sync_repository)
+        assert blockchain_repository.chain == peer_chain
+    finally:
+        blockchain_repository.chain = chain
+        sync_repository.finish_session()
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+def test_sync_reads_only_the_chain_after_its_start(
+    mine_blocks,
+    blockchain_repository: BlockchainRepository,
+):
+    chain = blockchain_repository.chain
+    genesis_block = blockchain_repository.create_genesis_block()
+    local_chain = [genesis_block] + mine_blocks(genesis_block, 4, "Local")
+    fork = local_chain[:3] + mine_blocks(local_chain[2], 3, "Fork")
+    blockchain_repository.chain = local_chain
+    sync_repository = SyncRepository()
+    starts = []
+
+    def recording(blocks):
+        def wrapper(self, start=0, *args):
+            starts.append(start)
+            return blocks(self, start, *args)
+
+        return wrapper
+
+    def page(start, blocks):
+        return SyncBlocks(
+            node_id="peer",
+            target_node_id=sync_repository.node_id,
+            start=start,
+            blocks=blocks,
+            last=True,
+        )
+
+    try:
+        assert sync_repository.start_session("peer")
+        with patch.object(
+            ChainSnapshot, "blocks", recording(ChainSnapshot.blocks)
+        ), patch.object(ChainDraft, "blocks", recording(ChainDraft.blocks)):
+            apply_sync_blocks(page(3, fork[3:]), blockchain_repository, sync_repository)
+        assert blockchain_repository.chain == fork
+        assert starts and min(starts) == 3
+
+        # Blocks placed at another height than their index are rejected
+        assert sync_repository.start_session("peer")
+        with pytest.raises(InvalidBlockchainException):
+            apply_sync_blocks(
+                page(2, fork[3:] + mine_blocks(fork[-1], 2, "Next")),
+                blockchain_repository,
+                sync_repository,
+            )
+        assert blockchain_repository.chain == fork
+    finally:
+        blockchain_repository.chain = chain
+        sync_repository.finish_session()
+
+
+def test_sync_page_out_of_order():
+    sync_repository = SyncRepository()
+    assert sync_repository.start_session("peer")
+
+    def page(start):
+        return SyncBlocks(
+            node_id="peer",
+            target_node_id=sync_repository.node_id,
+            start=start,
+            blocks=[Block(start, "", [], 0, [])],
+            last=False,
+        )
+
+    sync_repository.add_page(page(3))
+    with pytest.raises(SyncSessionException):
+        sync_repository.add_page(page(5))
+    with pytest.raises(SyncSessionException):
+        sync_repository.add_page(page(4))
+
+
+def test_request_missing_blocks_is_rate_limited(publisher_mock):
+    blockchain_repository = object.__new__(BlockchainRepository)
+    blockchain_repository.__init__(store_directory=None)
+    sync_repository = object.__new__(SyncRepository)
+    sync_repository.__init__()
+
+    request_missing_blocks(blockchain_repository, sync_repository)
+    request_missing_blocks(blockchain_repository, sync_repository)
+
+    publisher_mock.return_value.notify_new_node.assert_called_once()
+    chain_tip = publisher_mock.return_value.notify_new_node.call_args.args[0]
+    assert chain_tip.node_id == sync_repository.node_id
+
+
+def test_add_pending_block_waits_for_a_slot_without_the_chain_lock(waiting_for_slot):
+    blockchain_repository = object.__new__(BlockchainRepository)
+    blockchain_repository.__init__(store_directory=None)
+    pending_blocks_repository = object.__new__(PendingBlocksRepository)
+    pending_blocks_repository.__init__(maxsize=1, full_policy="block")
+    pending_blocks_repository.add(PendingBlock(index=1, records=[]))
+    waiting = waiting_for_slot(pending_blocks_repository)
+    adding = threading.Thread(
+        target=add_pending_block,
+        args=(
+            pending_blocks_repository,
+            blockchain_repository,
+            PendingBlock(index=1, records=[]),
+        ),
+    )
+    adding.start()
+
+    try:
+        assert waiting.wait(timeout=5)
+        # Chain writers go on while the pending block waits for a slot
+        assert blockchain_repository._lock.acquire(timeout=1)
+        blockchain_repository._lock.release()
+    finally:
+        pending_blocks_repository.pop()
+        adding.join(timeout=1)
+
+    assert pending_blocks_repository.pop().index == 2
+
+
+@patch("blockchain_system.services.POW_DIFFICULTY", 4)
+def test_prove_record(mine_blocks):
+    blockchain_repository = object.__new__(BlockchainRepository)
+    blockchain_repository.__init__(store_directory=None)
+    genesis_block = blockchain_repository.get_last_block()
+    for block in mine_blocks(genesis_block, 2, "Proven"):
+        blockchain_repository.add_or_replace(block)
+
+    proof = prove_record(blockchain_repository, RecordProofRequest(content="Proven"))
+
+    assert proof.verify()
+    assert proof.hash == blockchain_repository.get_last_block().hash
+    assert proof.record.content == "Proven"
+    assert prove_record(blockchain_repository, RecordProofRequest(content="x")) is None
+
+    result = find_records(
+        blockchain_repository, RecordQuery(request_id="request", text="proven"), "node"
+    )
+    assert [match.block_index for match in result.matches] == [1, 2]
+    assert result.request_id == "request"
+
+
+@pytest.mark.parametrize(
+    "start, stop, page_size, pages",
+    [
+        (0, None, 2, [(0, 2, False), (2, 2, False), (4, 1, True)]),
+        (1, 4, 10, [(1, 3, True)]),
+        (3, 100, 2, [(3, 2, True)]),
+        (7, None, 2, [(5, 0, True)]),
+    ],
+)
+def test_iter_chain_pages(start, stop, page_size, pages):
+    blockchain_repository = object.__new__(BlockchainRepository)
+    blockchain_repository.__init__(store_directory=None)
+    blockchain_repository.chain = [
+        Block(index, str(index - 1), [], 0, [], str(index)) for index in range(5)
+    ]
+    request = ShowChainRequest(
+        request_id="request", start=start, stop=stop, page_size=page_size
+    )
+
+    chain_pages = list(iter_chain_pages(blockchain_repository, request, "node"))
+
+    assert [(page.start, len(page.blocks), page.last) for page in chain_pages] == pages
+    for page in chain_pages:
+        assert (
+            page.blocks
+            == blockchain_repository.chain[page.start : page.start + len(page.blocks)]
+        )
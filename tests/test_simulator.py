@@ -0,0 +1,29 @@
+import json
+
+from blockchain_system import app, services
+from blockchain_system.simulator import percentile, run_simulation, write_results
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([], 50) is None
+
+
+def test_run_simulation(tmp_path, monkeypatch):
+    # Nodes announce themselves before the first records are sent
+    monkeypatch.setattr(app, "NEW_NODE_ANNOUNCE_DELAY", 0)
+    result = run_simulation(nodes=2, records=10, rate=0, difficulty=8, timeout=30)
+
+    assert result.records_committed == 10
+    assert not result.timed_out
+    assert result.latency_seconds["p50"] is not None
+    assert result.blocks_mined >= 1
+    assert result.total_bytes > result.sync_bytes > 0
+    assert services.POW_DIFFICULTY != 8
+
+    path = tmp_path / "results.json"
+    write_results(result, str(path))
+    assert json.loads(path.read_text())["records_committed"] == 10
@@ -0,0 +1,157 @@
+import os
+from unittest.mock import patch
+
+import pytest
+
+from blockchain_system.blockchain_repository import BlockchainRepository
+from blockchain_system.services import _is_valid_proof
+from blockchain_system import snapshots
+from blockchain_system.snapshots import (
+    InvalidSnapshotException,
+    bootstrap_from_snapshot,
+    create_snapshot,
+    list_snapshots,
+    load_chain,
+    load_snapshot,
+    prune_snapshots,
+)
+
+
+@pytest.fixture
+def blockchain_repository(mine_blocks):
+    repo = BlockchainRepository()
+    chain = repo.chain
+    genesis_block = repo.create_genesis_block()
+    repo.chain = [genesis_block] + mine_blocks(genesis_block, 3, "Snapshot")
+    yield repo
+    repo.chain = chain
+
+
+def test_create_and_load(blockchain_repository: BlockchainRepository, tmp_path):
+    path = create_snapshot(blockchain_repository, str(tmp_path))
+
+    assert load_snapshot(path) == (0, blockchain_repository.chain)
+    assert list_snapshots(str(tmp_path)) == [path]
+    assert create_snapshot(blockchain_repository, str(tmp_path)) is None
+
+
+def test_snapshots_hold_new_blocks_only(
+    blockchain_repository: BlockchainRepository, tmp_path
+):
+    chain = blockchain_repository.chain
+    blockchain_repository.chain = chain[:2]
+    create_snapshot(blockchain_repository, str(tmp_path))
+    blockchain_repository.chain = chain
+
+    path = create_snapshot(blockchain_repository, str(tmp_path))
+
+    assert load_snapshot(path) == (2, chain[2:])
+    assert load_chain(str(tmp_path)) == chain
+
+
+def test_corrupted_snapshot(blockchain_repository: BlockchainRepository, tmp_path):
+    path = create_snapshot(blockchain_repository, str(tmp_path))
+    with open(path, "r+b") as snapshot_file:
+        snapshot_file.seek(-1, os.SEEK_END)
+        snapshot_file.write(b"\xff")
+
+    with pytest.raises(InvalidSnapshotException):
+        load_snapshot(path)
+    assert load_chain(str(tmp_path)) == []
+
+
+def test_bootstrap_validates_new_blocks(
+    blockchain_repository: BlockchainRepository, tmp_path
+):
+    create_snapshot(blockchain_repository, str(tmp_path))
+    snapshot_chain = blockchain_repository.chain
+    blockchain_repository.chain = snapshot_chain[:2]
+
+    with patch(
+        "blockchain_system.services._is_valid_proof", wraps=_is_valid_proof
+    ) as is_valid_proof, patch("blockchain_system.services.POW_DIFFICULTY", 4):
+        assert bootstrap_from_snapshot(blockchain_repository, str(tmp_path))
+        # Blocks the node already had are not verified again
+        assert is_valid_proof.call_count == 2
+    assert blockchain_repository.chain == snapshot_chain
+
+
+def test_bootstrap_trusts_blocks_up_to_the_newest_checkpoint(
+    blockchain_repository: BlockchainRepository, tmp_path
+):
+    snapshot_chain = blockchain_repository.chain
+    blockchain_repository.chain = snapshot_chain[:3]
+    create_snapshot(blockchain_repository, str(tmp_path))
+    blockchain_repository.chain = snapshot_chain
+    create_snapshot(blockchain_repository, str(tmp_path))
+    blockchain_repository.chain = snapshot_chain[:1]
+    checkpoints = {1: snapshot_chain[1].hash, 2: snapshot_chain[2].hash}
+
+    with patch(
+        "blockchain_system.services._is_valid_proof", wraps=_is_valid_proof
+    ) as is_valid_proof, patch("blockchain_system.services.POW_DIFFICULTY", 4):
+        assert bootstrap_from_snapshot(
+            blockchain_repository, str(tmp_path), checkpoints
+        )
+        # Only the block after the checkpoint at height 2 is verified
+        assert is_valid_proof.call_count == 1
+    assert blockchain_repository.chain == snapshot_chain
+
+
+def test_load_chain_reads_only_needed_snapshots(
+    mine_blocks, blockchain_repository: BlockchainRepository, tmp_path
+):
+    chain = blockchain_repository.chain
+    blockchain_repository.chain = chain[:2]
+    first = create_snapshot(blockchain_repository, str(tmp_path))
+    blockchain_repository.chain = chain[:3]
+    create_snapshot(blockchain_repository, str(tmp_path))
+    fork = chain[:2] + mine_blocks(chain[1], 2, "Fork")
+    blockchain_repository.chain = fork
+    last = create_snapshot(blockchain_repository, str(tmp_path))
+
+    with patch(
+        "blockchain_system.snapshots.load_snapshot", wraps=snapshots.load_snapshot
+    ) as load:
+        # The second snapshot was replaced by the third one
+        assert load_chain(str(tmp_path)) == fork
+        assert [call.args[0] for call in load.call_args_list] == [first, last]
+
+        load.reset_mock()
+        # Blocks up to the tip of the first snapshot are in the local chain
+        assert load_chain(str(tmp_path), chain) == fork
+        assert [call.args[0] for call in load.call_args_list] == [last]
+
+
+def test_bootstrap_rejects_forged_snapshot(
+    mine_blocks, blockchain_repository: BlockchainRepository, tmp_path
+):
+    chain = blockchain_repository.chain
+    forged_block = mine_blocks(chain[-1], 1, "Forged")[0]
+    forged_block.records[0].content = "Changed"
+    blockchain_repository.chain = chain + [forged_block]
+    create_snapshot(blockchain_repository, str(tmp_path))
+    blockchain_repository.chain = chain
+
+    with patch("blockchain_system.services.POW_DIFFICULTY", 4):
+        assert not bootstrap_from_snapshot(blockchain_repository, str(tmp_path))
+    assert blockchain_repository.chain == chain
+
+
+def test_prune_replaced_snapshots(
+    mine_blocks, blockchain_repository: BlockchainRepository, tmp_path
+):
+    chain = blockchain_repository.chain
+    blockchain_repository.chain = chain[:2]
+    first = create_snapshot(blockchain_repository, str(tmp_path))
+    blockchain_repository.chain = chain[:3]
+    create_snapshot(blockchain_repository, str(tmp_path))
+    # A reorganization replaces the blocks of the second snapshot
+    fork = chain[:2] + mine_blocks(chain[1], 2, "Fork")
+    blockchain_repository.chain = fork
+    path = create_snapshot(blockchain_repository, str(tmp_path))
+
+    assert load_snapshot(path) == (2, fork[2:])
+    prune_snapshots(str(tmp_path))
+    assert list_snapshots(str(tmp_path)) == [first, path]
+    assert load_chain(str(tmp_path)) == fork
@@ -0,0 +1,71 @@
+import json
+import threading
+
+import pytest
+
+from blockchain_system import tracing
+from blockchain_system.blockchain import Block
+from blockchain_system.blockchain_repository import BlockchainRepository
+from blockchain_system.codec import get_codec
+from blockchain_system.node import forget_node, node_context
+from blockchain_system.services import _proof_of_work
+from blockchain_system.subscriber import handle_message
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracing.enable_tracing(str(path))
+    yield path
+    tracing.disable_tracing()
+
+
+def test_disabled_tracing_is_noop():
+    assert not tracing.tracing_enabled()
+    assert tracing.span("message") is tracing.phase("deserialize")
+
+
+def test_message_span(trace_file):
+    with node_context("tracing-node"):
+        repository = BlockchainRepository()
+        block = Block(
+            index=1,
+            previous_hash=repository.get_last_block().hash,
+            side_links=[],
+            timestamp=0,
+            records=[],
+        )
+        block.hash = _proof_of_work(block)
+        body = get_codec("binary").encode(block)
+        handle_message("blockchain.event.block_mined", body)
+        forget_node("tracing-node")
+
+    (line,) = trace_file.read_text().splitlines()
+    span = json.loads(line)
+    assert span["name"] == "message"
+    assert span["node"] == "tracing-node"
+    assert span["attributes"] == {
+        "routing_key": "blockchain.event.block_mined",
+        "size": len(body),
+    }
+    assert set(span["phases"]) == {"deserialize", "validate", "apply"}
+
+
+def test_sample_stacks():
+    stopped = threading.Event()
+
+    def spin():
+        while not stopped.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=spin, name="miner")
+    thread.start()
+    try:
+        samples = tracing.sample_stacks(0.1, interval=0.001)
+    finally:
+        stopped.set()
+        thread.join()
+
+    assert samples
+    assert all(stack.startswith("miner;") for stack in samples)
+    assert any(":spin:" in stack for stack in samples)
@@ -0,0 +1,166 @@
+import queue
+import threading
+
+import pytest
+
+from blockchain_system.app import App
+from blockchain_system.blockchain import Record, ShowChainRequest
+from blockchain_system.blockchain_repository import BlockchainRepository
+from blockchain_system.node import forget_node, node_context
+from blockchain_system.publisher import Publisher
+from blockchain_system.subscriber import ChainPageSubscriber, Subscriber
+from blockchain_system.transports import (
+    InProcessBroker,
+    InProcessTransport,
+    socket_bus,
+    topic_matches,
+)
+from blockchain_system.transports.socket_bus import (
+    SocketBusServer,
+    SocketSubscription,
+    SocketTransport,
+)
+
+
+@pytest.mark.parametrize(
+    "binding_key, routing_key, matches",
+    [
+        ("blockchain.#", "blockchain.command.mine", True),
+        ("blockchain.#", "blockchain", True),
+        ("blockchain.event.#", "blockchain.command.mine", False),
+        ("blockchain.*.mine", "blockchain.command.mine", True),
+        ("blockchain.*", "blockchain.command.mine", False),
+        ("#.mine", "blockchain.command.mine", True),
+        ("blockchain.command.mine", "blockchain.command.mine", True),
+    ],
+)
+def test_topic_matches(binding_key, routing_key, matches):
+    assert topic_matches(binding_key, routing_key) is matches
+
+
+def _consume(subscription) -> queue.Queue:
+    received = queue.Queue()
+    threading.Thread(
+        target=subscription.consume,
+        args=(lambda routing_key, body, ack: received.put((routing_key, body)),),
+        daemon=True,
+    ).start()
+    return received
+
+
+def _check_routing(publishing_transport, subscribing_transport):
+    commands = subscribing_transport.subscribe("blockchain.command.#")
+    events = subscribing_transport.subscribe("blockchain.event.#")
+    received_commands = _consume(commands)
+    received_events = _consume(events)
+
+    publishing_transport.publish("blockchain.command.mine", b"first")
+    publishing_transport.publish("blockchain.event.block_mined", b"second")
+    publishing_transport.publish("blockchain.command.mine", b"third")
+
+    assert received_commands.get(timeout=5) == ("blockchain.command.mine", b"first")
+    assert received_commands.get(timeout=5) == ("blockchain.command.mine", b"third")
+    assert received_events.get(timeout=5) == (
+        "blockchain.event.block_mined",
+        b"second",
+    )
+    commands.stop()
+    events.stop()
+
+
+def test_in_process_transport():
+    broker = InProcessBroker()
+    _check_routing(InProcessTransport(broker), InProcessTransport(broker))
+
+
+def test_socket_transport(tmp_path):
+    for address in ["tcp://127.0.0.1:0", f"unix://{tmp_path / 'bus.sock'}"]:
+        server = SocketBusServer(address).start()
+        publishing_transport = SocketTransport(server.address)
+        try:
+            _check_routing(publishing_transport, SocketTransport(server.address))
+        finally:
+            publishing_transport.close()
+            server.stop()
+
+
+def test_socket_bus_client_not_reading_does_not_block_publishers(monkeypatch):
+    monkeypatch.setattr(socket_bus, "SOCKET_BUS_CLIENT_BUFFER", 1024 * 1024)
+    server = SocketBusServer("tcp://127.0.0.1:0").start()
+    publishing_transport = SocketTransport(server.address)
+    # Subscribed, but never reads its messages
+    stalled = SocketSubscription(server.address, "blockchain.#")
+    reading = SocketTransport(server.address).subscribe("blockchain.command.#")
+    received = _consume(reading)
+    published = threading.Event()
+
+    def publish():
+        for _ in range(200):
+            publishing_transport.publish("blockchain.event.sync_blocks", b"x" * 100_000)
+        publishing_transport.publish("blockchain.command.mine", b"after")
+        published.set()
+
+    try:
+        threading.Thread(target=publish, daemon=True).start()
+        assert published.wait(timeout=30)
+        assert received.get(timeout=5) == ("blockchain.command.mine", b"after")
+        assert sum(client.dropped for _, client in server.server._bindings) > 0
+    finally:
+        stalled.stop()
+        reading.stop()
+        publishing_transport.close()
+        server.stop()
+
+
+def test_nodes_in_one_process(monkeypatch):
+    broker = InProcessBroker()
+    apps = {}
+    repositories = {}
+    chain_changed = threading.Condition()
+    for name in ["node-a", "node-b"]:
+        with node_context(name):
+            transport = InProcessTransport(broker)
+            apps[name] = App(Subscriber(transport), Publisher(transport))
+            repositories[name] = BlockchainRepository()
+        publish = repositories[name]._publish
+
+        def publish_and_notify(publish=publish):
+            publish()
+            with chain_changed:
+                chain_changed.notify_all()
+
+        monkeypatch.setattr(repositories[name], "_publish", publish_and_notify)
+        with node_context(name):
+            apps[name].start(block=False)
+
+    try:
+        with node_context("node-a"):
+            Publisher().notify_add_record(
+                Record(index=0, timestamp=0, content="A transaction")
+            )
+
+        with chain_changed:
+            chain_changed.wait_for(
+                lambda: all(len(repo.chain) == 2 for repo in repositories.values()),
+                timeout=30,
+            )
+        chains = {name: repo.chain for name, repo in repositories.items()}
+
+        assert chains["node-a"] == chains["node-b"]
+        assert chains["node-a"][1].records[0].content == "A transaction"
+
+        with node_context("client"):
+            transport = InProcessTransport(broker)
+            rendered = []
+            subscriber = ChainPageSubscriber(
+                "request", render=rendered.append, transport=transport
+            )
+            Publisher(transport).notify_show_chain(
+                ShowChainRequest(request_id="request", page_size=1)
+            )
+            assert subscriber.start_consuming()
+            assert rendered == chains["node-a"]
+    finally:
+        for app in apps.values():
+            app.stop()
+        forget_node("client")